@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Latency benchmark of the HTTP API under concurrent enroll load.
+
+Starts the aiohttp app in-process against a seeded enrollment store whose disk backup
+is real (every write schedules a full backup), fires concurrent POST /enroll requests
+and, alongside them, probes a cheap endpoint that does not touch the database. If
+database work blocks the event loop, the probe latency climbs with the enroll load.
+
+Usage: PYTHONPATH=. python benchmarks/bench_enroll_api.py --requests 500 --concurrency 32
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def report(name, latencies):
+    ms = [v * 1000 for v in latencies]
+    print(f"{name:<16} n={len(ms):<6} mean={statistics.mean(ms):8.2f}ms "
+          f"p50={percentile(ms, 50):8.2f}ms p95={percentile(ms, 95):8.2f}ms "
+          f"p99={percentile(ms, 99):8.2f}ms max={max(ms):8.2f}ms")
+
+async def run(args):
+    import aiohttp
+    from aiohttp.test_utils import TestServer
+    import src.enroll.enroll as enroll
+    from src.database.database import db_manager
+
+    # Only the API is measured; subscribers would need a broker.
+    enroll.start_subscriber_for_enrollment = lambda *a, **k: None
+
+    padding = "x" * args.row_bytes
+    with db_manager.lock:
+        db_manager.conn.executemany(
+            "INSERT INTO enrollments (id, queue, target_url, subscription_args) VALUES (?, ?, ?, ?)",
+            ((f"seed-{i}", "bench.queue", "http://localhost/none", f'{{"pad": "{padding}"}}')
+             for i in range(args.seed))
+        )
+        db_manager.conn.commit()
+
+    server = TestServer(enroll.create_app())
+    await server.start_server()
+    base = str(server.make_url(""))
+    enroll_latencies, probe_latencies = [], []
+    done = asyncio.Event()
+
+    async with aiohttp.ClientSession() as session:
+        async def enroll_worker(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                async with session.post(base + "/enroll", json={
+                        "queue": "bench.queue", "target_url": "http://localhost/none"}) as resp:
+                    await resp.read()
+                    assert resp.status == 201, resp.status
+                enroll_latencies.append(time.perf_counter() - start)
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                async with session.get(base + "/debug/budget") as resp:
+                    await resp.read()
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(args.probe_interval)
+
+        prober = asyncio.create_task(probe())
+        per_worker = max(1, args.requests // args.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(enroll_worker(per_worker) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+        start = time.perf_counter()
+        async with session.get(base + "/enrollments") as resp:
+            await resp.read()
+        list_latency = time.perf_counter() - start
+
+    await server.close()
+    print(f"seeded rows={args.seed} row_bytes={args.row_bytes} "
+          f"concurrency={args.concurrency} throughput={len(enroll_latencies) / elapsed:.1f} enroll/s")
+    report("POST /enroll", enroll_latencies)
+    report("probe (no db)", probe_latencies)
+    print(f"{'GET /enrollments':<16} {list_latency * 1000:.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=5000, help="rows preloaded into the store")
+    parser.add_argument("--row-bytes", type=int, default=2048, help="padding per seeded row")
+    parser.add_argument("--probe-interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    backup_dir = tempfile.mkdtemp(prefix="hotpotato-bench-")
+    os.environ["SQLITE_BACKUP_PATH"] = os.path.join(backup_dir, "hotpotato.sqlite")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Long-running soak test: enrollment churn and message traffic against local stand-ins.
+
+Runs the real HTTP API and subscribers in-process against a minimal AMQP 1.0 broker
+(built on proton, no external broker needed) and a local HTTP target. Every cycle it
+deletes and creates enrollments through the API and pushes messages to their queues.
+Every --interval seconds it records RSS, traced Python memory, thread count, open file
+descriptors and delivery throughput. Once the warm-up is over the first sample becomes
+the baseline; the run fails (exit status 1) if any metric grows past its threshold,
+and prints the allocation sites that grew the most.
+
+RSS that climbs during the first minutes and then levels off is usually glibc creating
+malloc arenas for the subscriber threads; MALLOC_ARENA_MAX=2 keeps that small. Growth
+that continues after the warm-up, in any metric, is a leak.
+
+Usage: PYTHONPATH=. python benchmarks/soak.py --duration 14400 --interval 60
+       PYTHONPATH=. python benchmarks/soak.py --duration 120 --interval 10 --warmup 20  # smoke run
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from proton import Message
+from proton.handlers import MessagingHandler
+from proton.reactor import Container
+from proton.utils import BlockingConnection
+
+logger = logging.getLogger("soak")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class LocalBroker(MessagingHandler):
+    """
+    Just enough of an AMQP 1.0 broker for the soak: named queues, credit-based delivery
+    to consumers, and requeueing of released, modified or orphaned deliveries.
+    Selectors and transactions are not supported.
+    """
+    def __init__(self, url):
+        super(LocalBroker, self).__init__(auto_accept=False)
+        self.url = url
+        self.queues = {}
+        self.consumers = {}
+        self.unsettled = {}
+        self.received = 0
+
+    def on_start(self, event):
+        self.acceptor = event.container.listen(self.url)
+
+    def on_link_opening(self, event):
+        if event.link.is_sender:
+            address = event.link.remote_source.address
+            event.link.source.address = address
+            self.consumers.setdefault(address, []).append(event.link)
+        else:
+            event.link.target.address = event.link.remote_target.address
+
+    def _unlink(self, link):
+        if link.is_sender:
+            consumers = self.consumers.get(link.source.address, [])
+            if link in consumers:
+                consumers.remove(link)
+            for delivery, (address, message) in list(self.unsettled.items()):
+                if delivery.link == link:
+                    del self.unsettled[delivery]
+                    self.queues.setdefault(address, deque()).appendleft(message)
+
+    def on_link_closing(self, event):
+        self._unlink(event.link)
+
+    def _unlink_connection(self, connection):
+        link = connection.link_head(0)
+        while link:
+            self._unlink(link)
+            link = link.next(0)
+
+    def on_connection_closing(self, event):
+        self._unlink_connection(event.connection)
+
+    def on_disconnected(self, event):
+        self._unlink_connection(event.connection)
+
+    def _dispatch(self, address):
+        queue = self.queues.get(address)
+        consumers = self.consumers.get(address)
+        while queue and consumers:
+            ready = [link for link in consumers if link.credit > 0]
+            if not ready:
+                return
+            for link in ready:
+                if not queue:
+                    return
+                message = queue.popleft()
+                self.unsettled[link.send(message)] = (address, message)
+
+    def on_sendable(self, event):
+        self._dispatch(event.link.source.address)
+
+    def on_message(self, event):
+        address = event.link.target.address or event.message.address
+        self.queues.setdefault(address, deque()).append(event.message)
+        self.received += 1
+        self.accept(event.delivery)
+        self._dispatch(address)
+
+    def on_accepted(self, event):
+        self.unsettled.pop(event.delivery, None)
+
+    def on_rejected(self, event):
+        self.unsettled.pop(event.delivery, None)
+
+    def on_released(self, event):
+        # Also called for MODIFIED.
+        entry = self.unsettled.pop(event.delivery, None)
+        if entry is not None:
+            address, message = entry
+            self.queues.setdefault(address, deque()).append(message)
+            self._dispatch(address)
+
+    def depth(self):
+        return sum(len(queue) for queue in list(self.queues.values()))
+
+class Target(BaseHTTPRequestHandler):
+    """HTTP target that answers every POST with 200 and counts them."""
+    lock = threading.Lock()
+    delivered = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with Target.lock:
+            Target.delivered += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def open_fds():
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return -1
+
+def sample(started, delivered, last):
+    traced, _ = tracemalloc.get_traced_memory()
+    now = time.monotonic()
+    throughput = 0.0
+    if last is not None and now > last["at"]:
+        throughput = (delivered - last["delivered"]) / (now - last["at"])
+    return {
+        "at": now,
+        "elapsed_s": round(now - started, 1),
+        "rss_mb": round(rss_bytes() / 2 ** 20, 2),
+        "traced_mb": round(traced / 2 ** 20, 2),
+        "threads": threading.active_count(),
+        "fds": open_fds(),
+        "delivered": delivered,
+        "throughput": round(throughput, 1),
+    }
+
+def run_api(app, port, ready):
+    from aiohttp import web
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    ready.set()
+    loop.run_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=3600, help="seconds to run")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between samples")
+    parser.add_argument("--warmup", type=float, default=60, help="seconds before the baseline sample")
+    parser.add_argument("--enrollments", type=int, default=20, help="enrollments kept alive")
+    parser.add_argument("--churn", type=int, default=5, help="enrollments replaced per cycle")
+    parser.add_argument("--messages", type=int, default=200, help="messages pushed per cycle")
+    parser.add_argument("--queues", type=int, default=10, help="distinct queue names")
+    parser.add_argument("--cycle", type=float, default=1.0, help="seconds per cycle")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=32)
+    parser.add_argument("--max-thread-growth", type=int, default=10)
+    parser.add_argument("--max-fd-growth", type=int, default=20)
+    parser.add_argument("--min-throughput", type=float, default=0,
+                        help="fail if a sample's deliveries/s drop below this (0 = off)")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites reported at the end")
+    parser.add_argument("--trace-frames", type=int, default=1,
+                        help="frames kept per allocation by tracemalloc (more is slower)")
+    parser.add_argument("--output", help="also write samples to this JSON-lines file")
+    parser.add_argument("--verbose", action="store_true", help="keep the service's own logs and prints")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+        sys.stdout = open(os.devnull, "w")
+
+    broker_url = f"amqp://127.0.0.1:{free_port()}"
+    api_port, target_port = free_port(), free_port()
+    os.environ["AMQP_URL"] = broker_url
+    os.environ.setdefault("SQLITE_BACKUP_PATH", os.path.join(tempfile.mkdtemp(prefix="hotpotato-soak-"),
+                                                             "hotpotato.sqlite"))
+    tracemalloc.start(args.trace_frames)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import requests
+    from src.enroll.enroll import create_app
+
+    broker = LocalBroker(broker_url)
+    threading.Thread(target=Container(broker).run, daemon=True, name="soak-broker").start()
+    target = ThreadingHTTPServer(("127.0.0.1", target_port), Target)
+    threading.Thread(target=target.serve_forever, daemon=True, name="soak-target").start()
+    api_ready = threading.Event()
+    threading.Thread(target=run_api, args=(create_app(), api_port, api_ready),
+                     daemon=True, name="soak-api").start()
+    api_ready.wait(10)
+    time.sleep(0.5)
+
+    api = f"http://127.0.0.1:{api_port}"
+    target_url = f"http://127.0.0.1:{target_port}/receive"
+    queues = [f"soak.q{i}" for i in range(args.queues)]
+    producer = BlockingConnection(broker_url)
+    senders = {queue: producer.create_sender(queue) for queue in queues}
+    enrollments = deque()
+
+    def enroll():
+        queue = random.choice(queues)
+        resp = requests.post(api + "/enroll", json={"queue": queue, "target_url": target_url}, timeout=30)
+        resp.raise_for_status()
+        enrollments.append((resp.json()["id"], queue))
+
+    def delete():
+        enrollment_id, _ = enrollments.popleft()
+        requests.delete(f"{api}/enroll/{enrollment_id}", timeout=30).raise_for_status()
+
+    started = time.monotonic()
+    baseline = None
+    baseline_snapshot = None
+    last = None
+    samples = []
+    failures = []
+    output = open(args.output, "a") if args.output else None
+    next_sample = started
+    sent = 0
+    logger.info("Soak: broker %s, API %s, target %s, %.0fs.", broker_url, api, target_url, args.duration)
+
+    try:
+        while time.monotonic() - started < args.duration:
+            cycle_start = time.monotonic()
+            while len(enrollments) < args.enrollments:
+                enroll()
+            for _ in range(min(args.churn, len(enrollments))):
+                delete()
+                enroll()
+            live_queues = sorted({queue for _, queue in enrollments})
+            for i in range(args.messages):
+                senders[live_queues[i % len(live_queues)]].send(
+                    Message(body=json.dumps({"seq": sent, "padding": "x" * 256})))
+                sent += 1
+
+            if time.monotonic() >= next_sample:
+                with Target.lock:
+                    delivered = Target.delivered
+                current = sample(started, delivered, last)
+                current.update(sent=sent, queued=broker.depth(), enrolled=len(enrollments))
+                last = current
+                samples.append(current)
+                if output is not None:
+                    output.write(json.dumps(current) + "\n")
+                    output.flush()
+                logger.info("t=%(elapsed_s)7.1fs rss=%(rss_mb)8.2fMB traced=%(traced_mb)7.2fMB "
+                            "threads=%(threads)4d fds=%(fds)4d delivered/s=%(throughput)8.1f "
+                            "queued=%(queued)d", current)
+                if baseline is None and current["elapsed_s"] >= args.warmup:
+                    baseline = current
+                    baseline_snapshot = tracemalloc.take_snapshot()
+                    logger.info("Baseline taken.")
+                elif baseline is not None and args.min_throughput and current["throughput"] < args.min_throughput:
+                    failures.append(f"throughput {current['throughput']}/s at t={current['elapsed_s']}s "
+                                    f"below {args.min_throughput}/s")
+                next_sample += args.interval
+
+            time.sleep(max(0.0, args.cycle - (time.monotonic() - cycle_start)))
+    except KeyboardInterrupt:
+        logger.info("Interrupted; evaluating what was collected.")
+    finally:
+        producer.close()
+        if output is not None:
+            output.close()
+
+    if baseline is None or samples[-1] is baseline:
+        logger.error("Run too short: no sample after the warm-up baseline.")
+        sys.exit(2)
+    final = samples[-1]
+    for metric, limit in (("rss_mb", args.max_rss_growth_mb), ("traced_mb", args.max_traced_growth_mb),
+                          ("threads", args.max_thread_growth), ("fds", args.max_fd_growth)):
+        growth = final[metric] - baseline[metric]
+        logger.info("%-10s baseline=%10s final=%10s growth=%10s (limit %s)", metric,
+                    baseline[metric], final[metric], round(growth, 2), limit)
+        if growth > limit:
+            failures.append(f"{metric} grew by {round(growth, 2)} (limit {limit})")
+
+    logger.info("Top %d allocation sites by growth since the baseline:", args.top)
+    for stat in tracemalloc.take_snapshot().compare_to(baseline_snapshot, "lineno" if args.trace_frames == 1 else "traceback")[:args.top]:
+        logger.info("  %s", stat)
+
+    if failures:
+        for failure in failures:
+            logger.error("FAIL: %s", failure)
+        sys.exit(1)
+    logger.info("PASS: %d message(s) sent, %d delivered.", sent, final["delivered"])
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,35 @@ import requests
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def send_message_callback(target_url, payload):
+def send_message_callback(target_url, payload, raise_errors=False, timeout=300, headers=None, trace=None,
+                          compressor=None):
     """
     Sends an HTTP POST to the target URL with the provided JSON payload.
-    Returns the HTTP status code.
+    Returns the HTTP status code. Transport errors are reported as status 500,
+    unless raise_errors is set, in which case the exception propagates.
+    Extra headers (e.g. trace context) are sent as given; when a MessageTrace is passed
+    the POST is recorded as its "http" span. With a Compressor the body is encoded (and
+    possibly compressed) by it, in the calling thread.
     """
+    span = trace.span("http") if trace is not None else None
     try:
-        response = requests.post(target_url, json=payload, timeout=300)
+        if compressor is not None:
+            body, body_headers = compressor.encode(payload)
+            response = requests.post(target_url, data=body, timeout=timeout,
+                                     headers={**body_headers, **(headers or {})})
+        else:
+            options = {"headers": headers} if headers else {}
+            response = requests.post(target_url, json=payload, timeout=timeout, **options)
         logger.info("HTTP POST to %s returned status %s", target_url, response.status_code)
+        if span is not None:
+            # elapsed runs from sending the request until the response headers are parsed.
+            span.end(status=response.status_code,
+                     response_ms=round(response.elapsed.total_seconds() * 1000, 3))
         return response.status_code
     except Exception as e:
         logger.error("HTTP POST to %s failed: %s", target_url, e)
+        if span is not None:
+            span.end(error=type(e).__name__)
+        if raise_errors:
+            raise
         return 500
@@ -0,0 +1,84 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Bytes of received-but-unsettled message bodies allowed across all enrollments (0 = unlimited).
+INFLIGHT_BUDGET_BYTES = int(os.environ.get("INFLIGHT_BUDGET_BYTES", str(256 * 1024 * 1024)))
+
+def message_size(message):
+    """Approximate in-memory size of a message body in bytes."""
+    body = getattr(message, "body", None)
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, memoryview, str)):
+        return len(body)
+    return len(json.dumps(body, default=str))
+
+class MemoryBudget:
+    """
+    Byte counter for message bodies held between receipt and settlement.
+
+    reserve() never refuses: the size of a message is only known once it has arrived,
+    so callers stop granting link credit while the budget is exhausted instead.
+    Listeners are called (from the releasing thread) whenever an exhausted budget
+    drops back under its limit.
+    """
+    def __init__(self, name, limit_bytes=0):
+        self.name = name
+        self.limit_bytes = limit_bytes
+        self.lock = threading.Lock()
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.messages = 0
+        self.listeners = []
+
+    @property
+    def exhausted(self):
+        return self.limit_bytes > 0 and self.used_bytes >= self.limit_bytes
+
+    def reserve(self, size):
+        with self.lock:
+            self.used_bytes += size
+            self.messages += 1
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+
+    def release(self, size, messages=1):
+        with self.lock:
+            was_exhausted = self.exhausted
+            self.used_bytes = max(0, self.used_bytes - size)
+            self.messages = max(0, self.messages - messages)
+            listeners = list(self.listeners) if was_exhausted and not self.exhausted else ()
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error("Budget '%s' listener failed: %s", self.name, e)
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "used_bytes": self.used_bytes,
+                "peak_bytes": self.peak_bytes,
+                "messages": self.messages,
+                "exhausted": self.exhausted,
+            }
+
+# Process-wide budget shared by every subscriber.
+global_budget = MemoryBudget("global", INFLIGHT_BUDGET_BYTES)
+
+# Per-enrollment budgets, keyed by enrollment id, for the budget gauges.
+enrollment_budgets = {}
@@ -0,0 +1,113 @@
+import json
+import gzip
+import logging
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+ENCODINGS = ("gzip", "zstd")
+
+# Global registry of active compressors, keyed by enrollment id, for the byte counters.
+compressors = {}
+
+class Compressor:
+    """
+    Encodes an enrollment's outbound JSON payloads, compressing bodies of at least
+    min_bytes with gzip or zstd and counting raw versus sent bytes.
+
+    zstd needs the optional `zstandard` package; without it gzip is used instead.
+    encode() is called from whichever thread performs the POST and is thread-safe.
+    """
+    def __init__(self, enrollment_id, encoding="gzip", min_bytes=1024, level=None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}'; expected one of {', '.join(ENCODINGS)}")
+        if encoding == "zstd" and zstandard is None:
+            logger.warning("Compression for client '%s': zstandard is not installed, using gzip.",
+                           enrollment_id)
+            encoding = "gzip"
+        self.enrollment_id = enrollment_id
+        self.encoding = encoding
+        self.min_bytes = min_bytes
+        if encoding == "gzip":
+            self.level = 6 if level is None else level
+            if not 0 <= self.level <= 9:
+                raise ValueError("gzip level must be between 0 and 9")
+        else:
+            self.level = 3 if level is None else level
+            if not 1 <= self.level <= 22:
+                raise ValueError("zstd level must be between 1 and 22")
+            # ZstdCompressor instances are not thread-safe; keep one per thread.
+            self.local = threading.local()
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.compressed_messages = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    @classmethod
+    def from_args(cls, enrollment_id, compression_args):
+        """
+        Builds a compressor from the "compression" entry of subscription_args, or returns
+        None when compression is not enabled. Accepts "gzip", "zstd" or a dict such as
+        {"encoding": "zstd", "min_bytes": 1024, "level": 3}.
+        Raises ValueError for unknown encodings or levels.
+        """
+        if not compression_args:
+            return None
+        if isinstance(compression_args, str):
+            compression_args = {"encoding": compression_args}
+        if not isinstance(compression_args, dict):
+            raise ValueError("compression must be an encoding name or an object")
+        level = compression_args.get("level")
+        return cls(
+            enrollment_id,
+            encoding=compression_args.get("encoding", "gzip"),
+            min_bytes=max(0, int(compression_args.get("min_bytes", 1024))),
+            level=None if level is None else int(level),
+        )
+
+    def _compress(self, body):
+        if self.encoding == "gzip":
+            return gzip.compress(body, compresslevel=self.level)
+        compressor = getattr(self.local, "compressor", None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(body)
+
+    def encode(self, payload):
+        """
+        Serializes the payload to JSON and compresses it when it reaches min_bytes.
+        Returns (body, headers) ready to be POSTed.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        raw_size = len(body)
+        headers = {"Content-Type": "application/json"}
+        compressed = raw_size >= self.min_bytes
+        if compressed:
+            body = self._compress(body)
+            headers["Content-Encoding"] = self.encoding
+        with self.lock:
+            self.messages += 1
+            self.compressed_messages += compressed
+            self.raw_bytes += raw_size
+            self.sent_bytes += len(body)
+        return body, headers
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "encoding": self.encoding,
+                "level": self.level,
+                "min_bytes": self.min_bytes,
+                "messages": self.messages,
+                "compressed_messages": self.compressed_messages,
+                "raw_bytes": self.raw_bytes,
+                "sent_bytes": self.sent_bytes,
+                "ratio": round(self.sent_bytes / self.raw_bytes, 4) if self.raw_bytes else None,
+            }
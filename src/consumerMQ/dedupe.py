@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEDUPE_DIR = os.environ.get("DEDUPE_DIR", "/app/data/dedupe")
+
+SPILL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivered (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+"""
+
+def validate_key_spec(key_spec):
+    """Raises ValueError unless key_spec is one message_key() understands."""
+    if key_spec in ("message_id", "body_hash"):
+        return
+    if isinstance(key_spec, str) and key_spec.startswith("property:") and len(key_spec) > len("property:"):
+        return
+    raise ValueError(f"Unknown dedupe key: {key_spec}")
+
+def message_key(message, key_spec="message_id"):
+    """
+    Extracts the deduplication key of a message according to key_spec:
+      - "message_id": the AMQP message-id (default).
+      - "property:<name>": an application property of the message.
+      - "body_hash": a SHA-256 digest of the message body.
+    Returns None when the message carries no usable key.
+    """
+    if key_spec == "message_id":
+        key = getattr(message, "id", None)
+    elif key_spec.startswith("property:"):
+        properties = getattr(message, "properties", None) or {}
+        key = properties.get(key_spec[len("property:"):])
+    elif key_spec == "body_hash":
+        body = getattr(message, "body", None)
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            raw = bytes(body)
+        elif isinstance(body, str):
+            raw = body.encode("utf-8")
+        else:
+            raw = json.dumps(body, sort_keys=True, default=str).encode("utf-8")
+        key = hashlib.sha256(raw).hexdigest()
+    else:
+        raise ValueError(f"Unknown dedupe key: {key_spec}")
+    if key is None or key == "":
+        return None
+    return str(key)
+
+class DedupeCache:
+    """
+    Bounded record of message keys already delivered successfully for one enrollment.
+
+    Keys live in an in-memory LRU limited to max_entries and expire after ttl_seconds.
+    When spill_path is set, every key is also written through to a SQLite file as it is
+    recorded, and the file is consulted on lookup once a key is evicted from memory, so
+    a redelivery storm after a restart, or a crash, is absorbed too.
+    """
+    def __init__(self, key="message_id", max_entries=10000, ttl_seconds=3600, spill_path=None):
+        validate_key_spec(key)
+        self.key = key
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.spill_path = spill_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.spill_conn = None
+        self._spill_writes = 0
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path) or ".", exist_ok=True)
+            # Autocommit in WAL mode: each key is one WAL append, without an fsync, so it
+            # survives the process crashing right after the delivery it records.
+            self.spill_conn = sqlite3.connect(spill_path, check_same_thread=False, isolation_level=None)
+            self.spill_conn.execute("PRAGMA journal_mode=WAL")
+            self.spill_conn.execute("PRAGMA synchronous=NORMAL")
+            self.spill_conn.executescript(SPILL_SCHEMA)
+            logger.info("Dedupe cache spilling to '%s'.", spill_path)
+
+    @classmethod
+    def from_args(cls, enrollment_id, dedupe_args):
+        """
+        Builds a cache from the "dedupe" entry of subscription_args, or returns None when
+        deduplication is not enabled. Accepts either `true` or a dict such as:
+          {"key": "message_id", "max_entries": 10000, "ttl_seconds": 3600, "spill": true}
+        """
+        options = cls.validate_args(dedupe_args)
+        if options is None:
+            return None
+        spill_path = options["spill_path"]
+        if not spill_path and options["spill"]:
+            spill_path = default_spill_path(enrollment_id)
+        return cls(
+            key=options["key"],
+            max_entries=options["max_entries"],
+            ttl_seconds=options["ttl_seconds"],
+            spill_path=spill_path,
+        )
+
+    @staticmethod
+    def validate_args(dedupe_args):
+        """
+        Checks the "dedupe" entry of subscription_args without creating anything.
+        Returns the cache options, or None when deduplication is not enabled.
+        Raises ValueError (or TypeError) for malformed settings.
+        """
+        if not dedupe_args:
+            return None
+        if dedupe_args is True:
+            dedupe_args = {}
+        if not isinstance(dedupe_args, dict):
+            raise ValueError("dedupe must be `true` or an object")
+        if not dedupe_args.get("enabled", True):
+            return None
+        key = dedupe_args.get("key", "message_id")
+        validate_key_spec(key)
+        max_entries = int(dedupe_args.get("max_entries", 10000))
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        return {
+            "key": key,
+            "max_entries": max_entries,
+            "ttl_seconds": float(dedupe_args.get("ttl_seconds", 3600)),
+            "spill_path": dedupe_args.get("spill_path"),
+            "spill": bool(dedupe_args.get("spill")),
+        }
+
+    def key_for(self, message):
+        """Returns the deduplication key for a message, or None if it has none."""
+        return message_key(message, self.key)
+
+    def seen(self, key):
+        """Returns True if the key was recorded as delivered and has not expired."""
+        now = time.monotonic()
+        with self.lock:
+            expires_at = self.entries.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    return True
+                del self.entries[key]
+            if self.spill_conn is None:
+                return False
+            row = self.spill_conn.execute(
+                "SELECT expires_at FROM delivered WHERE key = ?", (key,)
+            ).fetchone()
+            return row is not None and row[0] > time.time()
+
+    def add(self, key):
+        """Records a key as delivered, evicting the least recently used keys past max_entries."""
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = now + self.ttl_seconds
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                # Already in the spill file, if there is one.
+                self.entries.popitem(last=False)
+            self._spill(key)
+
+    def _spill(self, key):
+        """Writes a key through to the spill file. Caller must hold the lock."""
+        if self.spill_conn is None:
+            return
+        self.spill_conn.execute(
+            "INSERT OR REPLACE INTO delivered (key, expires_at) VALUES (?, ?)", (key, time.time() + self.ttl_seconds)
+        )
+        self._spill_writes += 1
+        # Purge expired rows now and then rather than on every write.
+        if self._spill_writes % 256 == 0:
+            self.spill_conn.execute("DELETE FROM delivered WHERE expires_at <= ?", (time.time(),))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        """Closes the spill file, if any; every key is already in it."""
+        with self.lock:
+            if self.spill_conn is None:
+                return
+            self.spill_conn.close()
+            self.spill_conn = None
+
+def default_spill_path(enrollment_id):
+    return os.path.join(DEDUPE_DIR, f"{enrollment_id}.sqlite")
+
+def remove_spill(enrollment_id):
+    """
+    Deletes the enrollment's spill file from DEDUPE_DIR, once the enrollment is gone and
+    its subscriber has closed the file. Custom spill_path files are left alone.
+    """
+    path = default_spill_path(enrollment_id)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            continue
+        logger.info("Removed dedupe spill file '%s'.", path + suffix)
@@ -0,0 +1,185 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.consumerMQ.subscriber import SubscriberRunner, get_subscription_args, parse_delivery_args
+from src.consumerMQ.scheduler import parse_scheduling_args
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+POLICIES = ("all", "any", "quorum")
+
+# subscription_args a fan-out member may set besides "fanout". The group's receiver
+# settings (prefetch, max_inflight_bytes, scheduling) go inside "fanout"; nothing else
+# has a per-member meaning on the shared receiver.
+MEMBER_ARGS = {"fanout", "timeout"}
+
+def fanout_args(enrollment):
+    """Returns the enrollment's "fanout" settings as a dict, or None when fan-out is off."""
+    args = get_subscription_args(enrollment).get("fanout")
+    if not args:
+        return None
+    if args is True:
+        args = {}
+    if not isinstance(args, dict):
+        raise ValueError("fanout must be `true` or an object")
+    if not args.get("enabled", True):
+        return None
+    return args
+
+def validate_fanout(args, subscription_args=None):
+    """
+    Raises ValueError if the "fanout" entry of subscription_args is malformed or, given
+    the whole subscription_args, if they set options a fan-out member cannot honour.
+    """
+    args = fanout_args({"subscription_args": {"fanout": args}})
+    if args is None:
+        return
+    unsupported = sorted(key for key, value in (subscription_args or {}).items()
+                         if key not in MEMBER_ARGS and value not in (None, False)
+                         and not (key == "delivery" and value == "http"))
+    if unsupported:
+        raise ValueError(f"{', '.join(unsupported)} cannot be combined with fanout; "
+                         "members only set timeout, and prefetch, max_inflight_bytes and scheduling "
+                         "go inside fanout")
+    parse_delivery_args({key: args[key] for key in ("prefetch", "max_inflight_bytes") if key in args})
+    parse_scheduling_args(args.get("scheduling"))
+    if args.get("policy", "all") not in POLICIES:
+        raise ValueError(f"Unknown policy '{args.get('policy')}'; expected one of {', '.join(POLICIES)}")
+    if "quorum" in args and int(args["quorum"]) < 1:
+        raise ValueError("quorum must be at least 1")
+    if int(args.get("max_workers", 8)) < 1:
+        raise ValueError("max_workers must be at least 1")
+
+def group_id(queue):
+    return f"fanout-{queue}"
+
+class FanoutGroup:
+    """
+    Serves every fan-out enrollment of one queue from a single receiver.
+
+    The group runs one SubscriberRunner whose callback is the group itself: each
+    message is decoded once, POSTed to all member targets concurrently, and reported
+    as 200 when enough members answered 2xx for the policy ("all", "any" or "quorum",
+    majority by default), or else as the first failing member's status. The runner's
+    response policy then settles the message, so a failed fan-out is redelivered to
+    every member, including those that already accepted it.
+    """
+    def __init__(self, amqp_url, queue, send_message_callback):
+        self.amqp_url = amqp_url
+        self.queue = queue
+        self.send_message_callback = send_message_callback
+        self.lock = threading.Lock()
+        self.members = {}
+        self.policy = "all"
+        self.quorum = None
+        self.max_workers = 8
+        self.executor = None
+        self.runner = None
+
+    @property
+    def id(self):
+        return group_id(self.queue)
+
+    def _group_enrollment(self, args):
+        subscription_args = {key: args[key] for key in ("prefetch", "max_inflight_bytes", "scheduling") if key in args}
+        return {"id": self.id, "queue": self.queue, "target_url": None,
+                "subscription_args": subscription_args}
+
+    def _configure(self, args):
+        """Applies the fan-out settings of the member that joined or changed last."""
+        self.policy = args.get("policy", "all")
+        self.quorum = int(args["quorum"]) if "quorum" in args else None
+        max_workers = max(1, int(args.get("max_workers", 8)))
+        if self.executor is None or max_workers != self.max_workers:
+            old_executor = self.executor
+            self.max_workers = max_workers
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.id)
+            if old_executor is not None:
+                old_executor.shutdown(wait=False)
+
+    def join(self, enrollment):
+        """
+        Adds (or updates) a member and starts the group's receiver if needed. Returns True
+        if the running receiver took the change in place, False if it was (re)started.
+        """
+        args = fanout_args(enrollment)
+        with self.lock:
+            self.members[enrollment["id"]] = enrollment
+            self._configure(args)
+        if self.runner is None:
+            self.runner = SubscriberRunner(self.amqp_url, self._group_enrollment(args), self)
+            self.runner.start()
+            logger.info("Fan-out group '%s': started with member %s.", self.id, enrollment["id"])
+            return False
+        if not self.runner.update(self._group_enrollment(args)):
+            # e.g. scheduling switched on or off: the receiver must be restarted.
+            self.runner.stop()
+            self.runner.join()
+            self.runner = SubscriberRunner(self.amqp_url, self._group_enrollment(args), self)
+            self.runner.start()
+            logger.info("Fan-out group '%s': receiver restarted for member %s's settings.",
+                        self.id, enrollment["id"])
+            return False
+        logger.info("Fan-out group '%s': member %s joined (%d members).",
+                    self.id, enrollment["id"], len(self.members))
+        return True
+
+    def leave(self, enrollment_id):
+        """Removes a member. Stops the group and returns True when it was the last one."""
+        with self.lock:
+            self.members.pop(enrollment_id, None)
+            empty = not self.members
+            if empty:
+                self.executor.shutdown(wait=False)
+        if not empty:
+            logger.info("Fan-out group '%s': member %s left.", self.id, enrollment_id)
+            return False
+        if self.runner is not None:
+            self.runner.stop()
+        logger.info("Fan-out group '%s': last member left, stopped.", self.id)
+        return True
+
+    def satisfied(self, successes, total):
+        if self.policy == "any":
+            return successes >= 1
+        if self.policy == "quorum":
+            return successes >= (self.quorum or total // 2 + 1)
+        return successes == total
+
+    def _post(self, member, payload, headers):
+        args = get_subscription_args(member)
+        options = {"raise_errors": True}
+        if args.get("timeout") is not None:
+            options["timeout"] = args["timeout"]
+        if headers:
+            options["headers"] = headers
+        try:
+            return self.send_message_callback(member["target_url"], payload, **options)
+        except Exception as e:
+            logger.error("Fan-out group '%s': POST to %s failed: %s", self.id, member["target_url"], e)
+            return None
+
+    def __call__(self, target_url, payload, headers=None, **options):
+        """Group delivery callback: POSTs the payload to every member. Returns a status code."""
+        with self.lock:
+            members = list(self.members.values())
+            if not members:
+                return 503
+            futures = [self.executor.submit(self._post, member, payload, headers) for member in members]
+        statuses = [future.result() for future in futures]
+        successes = sum(1 for status in statuses if status is not None and 200 <= status < 300)
+        if self.satisfied(successes, len(members)):
+            return 200
+        failed = [status for status in statuses if status is not None and not 200 <= status < 300]
+        logger.info("Fan-out group '%s': %d/%d member(s) succeeded, policy '%s' not met.",
+                    self.id, successes, len(members), self.policy)
+        return failed[0] if failed else 500
+
+    def snapshot(self):
+        """Returns the group receiver's live state plus the fan-out settings and members."""
+        snapshot = self.runner.snapshot() if self.runner is not None else {}
+        with self.lock:
+            snapshot["fanout"] = {"policy": self.policy, "quorum": self.quorum,
+                                  "max_workers": self.max_workers, "members": sorted(self.members)}
+        return snapshot
@@ -0,0 +1,182 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+GROUP_PROPERTY = "JMSXGroupID"
+
+def validate_key_spec(key_spec):
+    """Raises ValueError unless key_spec is one group_key() understands."""
+    if key_spec == "group_id":
+        return
+    if isinstance(key_spec, str) and key_spec.startswith("property:") and len(key_spec) > len("property:"):
+        return
+    raise ValueError(f"Unknown ordering key: {key_spec}")
+
+def group_key(message, key_spec="group_id"):
+    """
+    Extracts the ordering key of a message according to key_spec:
+      - "group_id": the AMQP group-id, falling back to the JMSXGroupID property (default).
+      - "property:<name>": an application property of the message.
+    Returns None when the message carries no key.
+    """
+    properties = getattr(message, "properties", None) or {}
+    if key_spec == "group_id":
+        key = getattr(message, "group_id", None) or properties.get(GROUP_PROPERTY)
+    elif key_spec.startswith("property:"):
+        key = properties.get(key_spec[len("property:"):])
+    else:
+        raise ValueError(f"Unknown ordering key: {key_spec}")
+    if key is None or key == "":
+        return None
+    return str(key)
+
+class KeyedDispatcher:
+    """
+    Runs delivery tasks on a worker pool while keeping tasks that share a key strictly
+    serialized: a key's next task only starts once its previous one finished. Tasks
+    with different keys run in parallel, up to max_workers at a time.
+
+    At most max_active_keys keys may have work queued or running, and each key holds at
+    most max_key_backlog tasks; submit() returns False when either bound is hit. The
+    caller should hold on to the task, in order, and retry once on_room is called.
+
+    Given an executor (such as the enrollment's ScheduledFlow), tasks run there instead
+    of on a pool of its own, and max_workers is ignored.
+    """
+    def __init__(self, enrollment_id, key="group_id", max_workers=8, max_active_keys=1000,
+                 max_key_backlog=100, executor=None):
+        validate_key_spec(key)
+        self.enrollment_id = enrollment_id
+        self.key = key
+        self.max_workers = max_workers
+        self.max_active_keys = max_active_keys
+        self.max_key_backlog = max_key_backlog
+        self.lock = threading.Lock()
+        self.backlogs = {}
+        # Called from a worker thread each time a finished task frees room under the bounds.
+        self.on_room = None
+        self.shared_executor = executor is not None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers,
+                                                       thread_name_prefix=f"deliver-{enrollment_id}")
+
+    @classmethod
+    def from_args(cls, enrollment_id, ordering_args, executor=None):
+        """
+        Builds a dispatcher from the "ordering" entry of subscription_args, or returns None
+        when keyed-ordering mode is not enabled. Accepts either `true` or a dict such as:
+          {"key": "group_id", "max_workers": 8, "max_active_keys": 1000, "max_key_backlog": 100}
+        """
+        options = cls.validate_args(ordering_args)
+        if options is None:
+            return None
+        return cls(enrollment_id, executor=executor, **options)
+
+    @staticmethod
+    def validate_args(ordering_args):
+        """
+        Checks the "ordering" entry of subscription_args without starting anything.
+        Returns the dispatcher options, or None when keyed-ordering mode is not enabled.
+        Raises ValueError (or TypeError) for malformed settings.
+        """
+        if not ordering_args:
+            return None
+        if ordering_args is True:
+            ordering_args = {}
+        if not isinstance(ordering_args, dict):
+            raise ValueError("ordering must be `true` or an object")
+        if not ordering_args.get("enabled", True):
+            return None
+        key = ordering_args.get("key", "group_id")
+        validate_key_spec(key)
+        return {
+            "key": key,
+            "max_workers": max(1, int(ordering_args.get("max_workers", 8))),
+            "max_active_keys": max(1, int(ordering_args.get("max_active_keys", 1000))),
+            "max_key_backlog": max(1, int(ordering_args.get("max_key_backlog", 100))),
+        }
+
+    def reconfigure(self, ordering_args):
+        """
+        Applies new bounds and pool size from the "ordering" entry of subscription_args.
+        A resized pool replaces the executor; tasks already queued on the old one still run
+        there, and each key keeps a single task in flight, so per-key order is preserved.
+        The key spec is not changed here: that needs a new dispatcher (see requires_restart).
+        """
+        if ordering_args is True:
+            ordering_args = {}
+        ordering_args = ordering_args or {}
+        self.max_active_keys = max(1, int(ordering_args.get("max_active_keys", 1000)))
+        self.max_key_backlog = max(1, int(ordering_args.get("max_key_backlog", 100)))
+        max_workers = max(1, int(ordering_args.get("max_workers", 8)))
+        if max_workers != self.max_workers and not self.shared_executor:
+            with self.lock:
+                old_executor = self.executor
+                self.max_workers = max_workers
+                self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix=f"deliver-{self.enrollment_id}")
+            old_executor.shutdown(wait=False)
+
+    def key_for(self, message):
+        """
+        Returns the ordering key of a message. Messages without a key get a key of their
+        own, so they are not ordered against anything.
+        """
+        return group_key(message, self.key) or object()
+
+    def submit(self, key, task):
+        """Queues task() behind earlier tasks of the same key. Returns False if over a bound."""
+        with self.lock:
+            backlog = self.backlogs.get(key)
+            if backlog is None:
+                if len(self.backlogs) >= self.max_active_keys:
+                    return False
+                self.backlogs[key] = deque([task])
+                self.executor.submit(self._run, key)
+                return True
+            if len(backlog) >= self.max_key_backlog:
+                return False
+            backlog.append(task)
+            return True
+
+    def _run(self, key):
+        with self.lock:
+            task = self.backlogs[key][0]
+        try:
+            task()
+        except Exception as e:
+            logger.error("Subscriber for client '%s': Delivery task failed: %s", self.enrollment_id, e)
+        with self.lock:
+            backlog = self.backlogs[key]
+            backlog.popleft()
+            done = not backlog
+            if done:
+                del self.backlogs[key]
+        if self.on_room is not None:
+            try:
+                self.on_room()
+            except Exception as e:
+                logger.error("Subscriber for client '%s': Dispatcher room callback failed: %s", self.enrollment_id, e)
+        if done:
+            return
+        # Resubmit rather than loop so one busy key does not monopolise a worker.
+        try:
+            self.executor.submit(self._run, key)
+        except RuntimeError:
+            # Shutting down; the remaining deliveries stay unsettled and go back to the broker.
+            pass
+
+    def active_keys(self):
+        with self.lock:
+            return len(self.backlogs)
+
+    def backlog_size(self):
+        with self.lock:
+            return sum(len(backlog) for backlog in self.backlogs.values())
+
+    def close(self):
+        """Stops accepting work; queued tasks are dropped, running ones finish in the background."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,80 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Settlement outcomes a delivery attempt can map to.
+ACCEPT = "accept"                # ACCEPTED: delivered, remove from the queue
+RETRY = "retry"                  # MODIFIED(failed): redeliver, counts towards max-delivery
+UNDELIVERABLE = "undeliverable"  # MODIFIED(failed, undeliverable): not to be redelivered here
+REJECT = "reject"                # REJECTED: straight to the dead-letter queue
+OUTCOMES = (ACCEPT, RETRY, UNDELIVERABLE, REJECT)
+
+# Parse failures may also keep the historical behaviour of posting the raw body.
+FORWARD = "forward"
+
+def _check_outcome(outcome, allowed=OUTCOMES):
+    if outcome not in allowed:
+        raise ValueError(f"Unknown outcome '{outcome}'; expected one of {', '.join(allowed)}")
+    return outcome
+
+class ResponsePolicy:
+    """
+    Maps the result of a delivery attempt to a settlement outcome.
+
+    Status rules are keyed by exact code ("404") or by class ("4xx"); exact codes win.
+    Error rules are keyed by exception class name and match any class in the raised
+    exception's MRO (e.g. "Timeout", "ConnectionError"), with "default" as fallback.
+    Without rules every 2xx is accepted and everything else is retried, and messages
+    whose body is not valid JSON are forwarded as-is.
+    """
+    def __init__(self, status_rules=None, error_rules=None, parse_error=FORWARD):
+        self.status_rules = {}
+        for key, outcome in (status_rules or {}).items():
+            key = str(key).lower()
+            if not (len(key) == 3 and (key.isdigit() or (key[0].isdigit() and key[1:] == "xx"))):
+                raise ValueError(f"Invalid status rule '{key}'; use a code like '404' or a class like '4xx'")
+            self.status_rules[key] = _check_outcome(outcome)
+        self.error_rules = {name: _check_outcome(outcome) for name, outcome in (error_rules or {}).items()}
+        self.parse_error = _check_outcome(parse_error, OUTCOMES + (FORWARD,))
+
+    @classmethod
+    def from_args(cls, policy_args):
+        """
+        Builds a policy from the "policy" entry of subscription_args, e.g.:
+          {"status": {"404": "reject", "4xx": "undeliverable"},
+           "errors": {"Timeout": "retry", "default": "retry"},
+           "parse_error": "reject"}
+        Raises ValueError for unknown outcomes or malformed rules.
+        """
+        policy_args = policy_args or {}
+        if not isinstance(policy_args, dict):
+            raise ValueError("policy must be an object")
+        for name in ("status", "errors"):
+            if policy_args.get(name) is not None and not isinstance(policy_args[name], dict):
+                raise ValueError(f"{name} must be an object mapping to outcomes")
+        return cls(
+            status_rules=policy_args.get("status"),
+            error_rules=policy_args.get("errors"),
+            parse_error=policy_args.get("parse_error", FORWARD),
+        )
+
+    @property
+    def classifies_errors(self):
+        """True when exceptions should reach the policy instead of being folded into a 500."""
+        return bool(self.error_rules)
+
+    def classify_status(self, status):
+        outcome = self.status_rules.get(str(status))
+        if outcome is None:
+            outcome = self.status_rules.get(f"{str(status)[:1]}xx")
+        if outcome is None:
+            outcome = ACCEPT if 200 <= status < 300 else RETRY
+        return outcome
+
+    def classify_error(self, error):
+        for cls in type(error).__mro__:
+            outcome = self.error_rules.get(cls.__name__)
+            if outcome is not None:
+                return outcome
+        return self.error_rules.get("default", RETRY)
@@ -0,0 +1,278 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Worker threads shared by every enrollment that opts into scheduling.
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "16"))
+# Link credit handed out per worker, split among the scheduled enrollments by weight.
+SCHEDULER_CREDIT_PER_WORKER = int(os.environ.get("SCHEDULER_CREDIT_PER_WORKER", "2"))
+
+# Priority classes, highest first.
+PRIORITIES = ("critical", "standard", "bulk")
+
+# Queue waits kept per enrollment for the percentiles.
+WAIT_SAMPLES = 1024
+
+def parse_scheduling_args(scheduling_args):
+    """
+    Reads the "scheduling" entry of subscription_args: `true` or a dict such as
+    {"weight": 4, "priority": "critical"}. Returns (weight, priority), or None when
+    scheduling is not enabled. Raises ValueError for bad weights or priorities.
+    """
+    if not scheduling_args:
+        return None
+    if scheduling_args is True:
+        scheduling_args = {}
+    if not isinstance(scheduling_args, dict):
+        raise ValueError("scheduling must be `true` or an object")
+    if not scheduling_args.get("enabled", True):
+        return None
+    weight = float(scheduling_args.get("weight", 1))
+    if not (math.isfinite(weight) and weight > 0):
+        raise ValueError("weight must be a finite number greater than 0")
+    priority = scheduling_args.get("priority", "standard")
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'; expected one of {', '.join(PRIORITIES)}")
+    return weight, priority
+
+class ScheduledFlow:
+    """
+    One enrollment's share of the delivery scheduler. Quacks like the executors it
+    replaces (submit/shutdown), so a KeyedDispatcher can run its tasks through it.
+    All fields are guarded by the scheduler's lock.
+    """
+    def __init__(self, scheduler, enrollment_id, weight=1.0, priority="standard"):
+        self.scheduler = scheduler
+        self.enrollment_id = enrollment_id
+        self.weight = weight
+        self.priority = priority
+        self.tasks = deque()
+        self.deficit = 0.0
+        self.closed = False
+        self.running = 0
+        self.completed = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @classmethod
+    def from_args(cls, enrollment_id, scheduling_args, scheduler=None):
+        """
+        Registers the enrollment with the scheduler (the process-wide one by default)
+        according to the "scheduling" entry of subscription_args, or returns None when
+        scheduling is not enabled.
+        """
+        parsed = parse_scheduling_args(scheduling_args)
+        if parsed is None:
+            return None
+        weight, priority = parsed
+        return (scheduler or delivery_scheduler).register(enrollment_id, weight, priority)
+
+    def submit(self, fn, *args):
+        """Queues fn(*args) behind this enrollment's earlier tasks. Raises RuntimeError once shut down."""
+        self.scheduler.submit(self, fn, args)
+
+    def reconfigure(self, scheduling_args):
+        """Applies a new weight and priority class; queued tasks keep their order."""
+        parsed = parse_scheduling_args(scheduling_args)
+        if parsed is not None:
+            self.scheduler.reconfigure(self, *parsed)
+
+    def credit(self):
+        """Link credit this enrollment may hold: its weighted share of the scheduler's capacity."""
+        return self.scheduler.credit_for(self)
+
+    def shutdown(self, wait=False, cancel_futures=True):
+        """Leaves the scheduler. Queued tasks are dropped; running ones finish. Idempotent."""
+        self.scheduler.unregister(self)
+
+    def _record_wait(self, wait):
+        self.waits.append(wait)
+        self.wait_count += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def _snapshot(self):
+        waits = sorted(self.waits)
+
+        def percentile(fraction):
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))] * 1000, 3)
+
+        return {
+            "weight": self.weight,
+            "priority": self.priority,
+            "queued": len(self.tasks),
+            "running": self.running,
+            "completed": self.completed,
+            "credit": self.scheduler._credit_for(self),
+            "wait_ms": {
+                "mean": round(self.wait_total / self.wait_count * 1000, 3) if self.wait_count else None,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": round(self.wait_max * 1000, 3),
+            },
+        }
+
+class DeliveryScheduler:
+    """
+    Shares a fixed pool of delivery workers among enrollments.
+
+    Priority classes are served strictly in order: a worker only picks a "standard"
+    task when no "critical" one is queued, and "bulk" after both. Within a class,
+    enrollments take turns by deficit round-robin: each turn adds the enrollment's
+    weight to its deficit and every task run costs 1, so over time each backlogged
+    enrollment gets workers in proportion to its weight whatever its volume.
+
+    Link credit is split the same way (see credit_for), which keeps each enrollment's
+    backlog in the scheduler, and so its queue wait, bounded.
+    """
+    def __init__(self, workers=DELIVERY_WORKERS, credit_per_worker=SCHEDULER_CREDIT_PER_WORKER):
+        self.workers = max(1, workers)
+        self.credit_per_worker = max(1, credit_per_worker)
+        self.condition = threading.Condition()
+        self.flows = {}
+        self.active = {priority: deque() for priority in PRIORITIES}
+        self.busy = 0
+        self.threads = []
+        self.closed = False
+
+    def register(self, enrollment_id, weight=1.0, priority="standard"):
+        with self.condition:
+            if not self.threads:
+                self._start_workers()
+            flow = ScheduledFlow(self, enrollment_id, weight, priority)
+            previous = self.flows.get(enrollment_id)
+            if previous is not None:
+                # A restarted subscriber registers before the old one has closed.
+                self._unregister(previous)
+            self.flows[enrollment_id] = flow
+            return flow
+
+    def _start_workers(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True, name=f"scheduler-{number}")
+            thread.start()
+            self.threads.append(thread)
+
+    def unregister(self, flow):
+        with self.condition:
+            self._unregister(flow)
+
+    def _unregister(self, flow):
+        if flow.closed:
+            return
+        flow.closed = True
+        flow.tasks.clear()
+        if flow in self.active[flow.priority]:
+            self.active[flow.priority].remove(flow)
+        if self.flows.get(flow.enrollment_id) is flow:
+            del self.flows[flow.enrollment_id]
+
+    def reconfigure(self, flow, weight, priority):
+        with self.condition:
+            if flow.closed:
+                return
+            if priority != flow.priority and flow in self.active[flow.priority]:
+                self.active[flow.priority].remove(flow)
+                self.active[priority].append(flow)
+            flow.weight = weight
+            flow.priority = priority
+
+    def submit(self, flow, fn, args=()):
+        with self.condition:
+            if flow.closed or self.closed:
+                raise RuntimeError("cannot schedule new tasks after shutdown")
+            if not flow.tasks:
+                flow.deficit = 0.0
+                self.active[flow.priority].append(flow)
+            flow.tasks.append((fn, args, time.monotonic()))
+            self.condition.notify()
+
+    def _next_task(self):
+        """Picks the next task by strict priority, then deficit round-robin. Caller holds the lock."""
+        for priority in PRIORITIES:
+            active = self.active[priority]
+            while active:
+                flow = active[0]
+                if flow.deficit < 1:
+                    flow.deficit += flow.weight
+                    if flow.deficit < 1:
+                        # Weights under 1 save up over several turns.
+                        active.rotate(-1)
+                        continue
+                flow.deficit -= 1
+                task = flow.tasks.popleft()
+                if not flow.tasks:
+                    active.popleft()
+                    flow.deficit = 0.0
+                elif flow.deficit < 1:
+                    active.rotate(-1)
+                return flow, task
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                picked = self._next_task()
+                while picked is None and not self.closed:
+                    self.condition.wait()
+                    picked = self._next_task()
+                if picked is None:
+                    return
+                flow, (fn, args, queued_at) = picked
+                flow._record_wait(time.monotonic() - queued_at)
+                flow.running += 1
+                self.busy += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error("Scheduled delivery task for client '%s' failed: %s", flow.enrollment_id, e)
+            finally:
+                with self.condition:
+                    flow.running -= 1
+                    flow.completed += 1
+                    self.busy -= 1
+
+    def credit_for(self, flow):
+        with self.condition:
+            return self._credit_for(flow)
+
+    def _credit_for(self, flow):
+        total_weight = sum(other.weight for other in self.flows.values())
+        if flow.closed or not total_weight:
+            return 1
+        capacity = self.workers * self.credit_per_worker
+        return max(1, int(capacity * flow.weight / total_weight))
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queued": {priority: sum(len(flow.tasks) for flow in self.active[priority])
+                           for priority in PRIORITIES},
+                "enrollments": {enrollment_id: flow._snapshot()
+                                for enrollment_id, flow in self.flows.items()},
+            }
+
+    def close(self):
+        """Stops the workers once their current task is done; queued tasks are dropped."""
+        with self.condition:
+            self.closed = True
+            for flow in list(self.flows.values()):
+                self._unregister(flow)
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+# Process-wide scheduler; its workers start with the first scheduled enrollment.
+delivery_scheduler = DeliveryScheduler()
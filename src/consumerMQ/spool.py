@@ -0,0 +1,415 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+from src.consumerMQ.policy import ResponsePolicy, ACCEPT, RETRY, REJECT
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "/app/data/spool")
+
+# Every record is framed as <payload length><crc32 of payload><payload>.
+# Segments are preallocated with zeros, so a zero length marks the end of written data.
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+# Records the target refused for good, one JSON object per line, next to the segments.
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+# Records carrying HTTP headers (the message's trace context) start with this byte,
+# then the headers as JSON and a newline, then the payload. A JSON payload never
+# starts with it, so records written without headers read back unchanged.
+HEADERS_MARKER = b"\0"
+
+def encode_record(payload, headers=None):
+    """Serializes a payload, and the headers to POST it with, into a spool record."""
+    record = json.dumps(payload, default=str).encode("utf-8")
+    if headers:
+        record = HEADERS_MARKER + json.dumps(headers).encode("utf-8") + b"\n" + record
+    return record
+
+def decode_record(raw):
+    """Returns (payload, headers) of a spool record."""
+    raw = bytes(raw)
+    headers = {}
+    if raw.startswith(HEADERS_MARKER):
+        header_line, raw = raw[len(HEADERS_MARKER):].split(b"\n", 1)
+        headers = json.loads(header_line)
+    return json.loads(raw), headers
+
+class Spool:
+    """
+    Durable local log of messages awaiting delivery to an enrollment's target.
+
+    The log is split into fixed-size segment files that are memory-mapped and appended to
+    from the reactor thread. A single reader consumes records in order and commits its
+    position to a cursor file once a record has been delivered; fully consumed segments
+    are deleted. Appends fail (return False) once max_bytes of undelivered records are
+    pending, so the caller can leave the message in the broker instead. max_bytes may be
+    smaller than a segment: segment files are sparse until written.
+    """
+    def __init__(self, path, segment_bytes=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 fsync="interval", fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.condition = threading.Condition()
+        self.maps = {}
+        self.write_segment = None
+        self.write_offset = 0
+        self.read_segment = None
+        self.read_offset = 0
+        self.last_flush = time.monotonic()
+        self.closed = False
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+
+    @classmethod
+    def from_args(cls, enrollment_id, spool_args):
+        """
+        Builds a spool from the "spool" entry of subscription_args, or returns None when
+        spooling is not enabled. Accepts either `true` or a dict such as:
+          {"segment_bytes": 16777216, "max_bytes": 1073741824, "fsync": "interval", "fsync_interval": 1.0,
+           "max_attempts": 10}
+        max_attempts is used by the SpoolDrainer, not by the spool itself.
+        """
+        options = cls.validate_args(spool_args)
+        if options is None:
+            return None
+        return cls(
+            options["path"] or os.path.join(SPOOL_DIR, str(enrollment_id)),
+            segment_bytes=options["segment_bytes"],
+            max_bytes=options["max_bytes"],
+            fsync=options["fsync"],
+            fsync_interval=options["fsync_interval"],
+        )
+
+    @staticmethod
+    def validate_args(spool_args):
+        """
+        Checks the "spool" entry of subscription_args without touching the disk.
+        Returns the spool options, or None when spooling is not enabled.
+        Raises ValueError (or TypeError) for malformed settings.
+        """
+        if not spool_args:
+            return None
+        if spool_args is True:
+            spool_args = {}
+        if not isinstance(spool_args, dict):
+            raise ValueError("spool must be `true` or an object")
+        if not spool_args.get("enabled", True):
+            return None
+        options = {
+            "path": spool_args.get("path"),
+            "segment_bytes": int(spool_args.get("segment_bytes", 16 * 1024 * 1024)),
+            "max_bytes": int(spool_args.get("max_bytes", 1024 * 1024 * 1024)),
+            "fsync": spool_args.get("fsync", "interval"),
+            "fsync_interval": float(spool_args.get("fsync_interval", 1.0)),
+            "max_attempts": int(spool_args.get("max_attempts", 10)),
+        }
+        if options["fsync"] not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {options['fsync']}")
+        if options["segment_bytes"] <= 2 * RECORD_HEADER.size:
+            raise ValueError(f"segment_bytes must be greater than {2 * RECORD_HEADER.size}")
+        if options["max_bytes"] < 1:
+            raise ValueError("max_bytes must be at least 1")
+        if options["max_attempts"] < 1:
+            raise ValueError("max_attempts must be at least 1")
+        return options
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, f"{seq:020d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _map(self, seq):
+        """Returns the mmap of a segment, creating and preallocating the file if needed."""
+        segment_map = self.maps.get(seq)
+        if segment_map is None:
+            segment_path = self._segment_path(seq)
+            with open(segment_path, "a+b") as f:
+                if os.path.getsize(segment_path) < self.segment_bytes:
+                    f.truncate(self.segment_bytes)
+                segment_map = mmap.mmap(f.fileno(), self.segment_bytes)
+            self.maps[seq] = segment_map
+        return segment_map
+
+    def _record_at(self, segment_map, offset):
+        """Returns the payload stored at offset, or None if there is no complete record there."""
+        if offset + RECORD_HEADER.size > self.segment_bytes:
+            return None
+        length, crc = RECORD_HEADER.unpack_from(segment_map, offset)
+        start = offset + RECORD_HEADER.size
+        if length == 0 or start + length > self.segment_bytes:
+            return None
+        payload = segment_map[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def _recover(self):
+        """Finds the write position after the last intact record and loads the read cursor."""
+        segments = self._segments()
+        if not segments:
+            segments = [0]
+        self.write_segment = segments[-1]
+        segment_map = self._map(self.write_segment)
+        offset = 0
+        while True:
+            payload = self._record_at(segment_map, offset)
+            if payload is None:
+                break
+            offset += RECORD_HEADER.size + len(payload)
+        # Zero whatever a crash left half-written so readers stop at the same place.
+        tail = min(RECORD_HEADER.size, self.segment_bytes - offset)
+        segment_map[offset:offset + tail] = b"\0" * tail
+        self.write_offset = offset
+
+        self.read_segment, self.read_offset = segments[0], 0
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        if os.path.exists(cursor_path):
+            try:
+                with open(cursor_path) as f:
+                    seq, offset = (int(part) for part in f.read().split())
+                if seq in segments:
+                    self.read_segment, self.read_offset = seq, offset
+            except Exception as e:
+                logger.error("Spool '%s': ignoring unreadable cursor: %s", self.path, e)
+        logger.info("Spool '%s' opened: %d segment(s), write at %d/%d.",
+                    self.path, len(segments), self.write_segment, self.write_offset)
+
+    def _flush(self, force=False):
+        """Flushes the write segment to disk according to the fsync policy."""
+        if self.fsync == "never" and not force:
+            return
+        now = time.monotonic()
+        if force or self.fsync == "always" or now - self.last_flush >= self.fsync_interval:
+            self.maps[self.write_segment].flush()
+            self.last_flush = now
+
+    def append(self, payload):
+        """
+        Durably appends a record (bytes). Returns False if the record does not fit within
+        the spool's size caps, in which case nothing is written.
+        """
+        size = RECORD_HEADER.size + len(payload)
+        if size + RECORD_HEADER.size > self.segment_bytes:
+            logger.error("Spool '%s': record of %d bytes exceeds segment size.", self.path, len(payload))
+            return False
+        with self.condition:
+            if self.closed:
+                return False
+            if self._pending_bytes() + size > self.max_bytes:
+                return False
+            if self.write_offset + size + RECORD_HEADER.size > self.segment_bytes:
+                self._flush(force=self.fsync != "never")
+                self.write_segment += 1
+                self.write_offset = 0
+            segment_map = self._map(self.write_segment)
+            start = self.write_offset + RECORD_HEADER.size
+            segment_map[start:start + len(payload)] = payload
+            # Header last: a reader never sees a length before its payload is in place.
+            RECORD_HEADER.pack_into(segment_map, self.write_offset, len(payload), zlib.crc32(payload))
+            self.write_offset += size
+            self._flush()
+            self.condition.notify_all()
+        return True
+
+    def next_record(self, timeout=None):
+        """
+        Returns (position, payload) for the oldest undelivered record, waiting up to
+        timeout seconds for one to be appended. Returns None on timeout or close.
+        The record stays in the spool until commit(position) is called.
+        """
+        with self.condition:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self.closed:
+                payload = self._record_at(self._map(self.read_segment), self.read_offset)
+                if payload is not None:
+                    return (self.read_segment, self.read_offset), payload
+                if self.read_segment < self.write_segment:
+                    # Nothing more in this segment; the writer has moved on.
+                    self._drop_segment(self.read_segment)
+                    self.read_segment += 1
+                    self.read_offset = 0
+                    self._save_cursor()
+                    continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return None
+
+    def commit(self, position):
+        """Marks the record at position as delivered and advances the read cursor past it."""
+        seq, offset = position
+        with self.condition:
+            if self.closed:
+                return
+            if (seq, offset) != (self.read_segment, self.read_offset):
+                return
+            payload = self._record_at(self._map(seq), offset)
+            if payload is None:
+                return
+            self.read_offset = offset + RECORD_HEADER.size + len(payload)
+            self._save_cursor()
+
+    def _save_cursor(self):
+        """Atomically persists the read cursor. Caller must hold the condition."""
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        tmp_path = cursor_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{self.read_segment} {self.read_offset}")
+            if self.fsync == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, cursor_path)
+
+    def _drop_segment(self, seq):
+        """Unmaps and deletes a fully consumed segment. Caller must hold the condition."""
+        segment_map = self.maps.pop(seq, None)
+        if segment_map is not None:
+            segment_map.close()
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+
+    def pending_bytes(self):
+        """Approximate number of spooled bytes not yet delivered."""
+        with self.condition:
+            return self._pending_bytes()
+
+    def _pending_bytes(self):
+        # Unused tails of earlier segments count as pending until the reader moves past them.
+        return ((self.write_segment - self.read_segment) * self.segment_bytes
+                + self.write_offset - self.read_offset)
+
+    def dead_letter(self, raw, **details):
+        """Appends a record the target refused, with details of why, to the dead-letter file."""
+        entry = dict(details, failed_at=time.time())
+        try:
+            entry["payload"], entry["headers"] = decode_record(raw)
+        except ValueError:
+            entry["raw"] = bytes(raw).decode("utf-8", "replace")
+        with open(os.path.join(self.path, DEAD_LETTER_FILE), "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        """Flushes and unmaps all segments; wakes up any waiting reader."""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            if self.write_segment in self.maps:
+                self._flush(force=True)
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+            self.condition.notify_all()
+
+class SpoolDrainer:
+    """
+    Delivery loop that drains a spool to the enrollment's target at the target's pace.
+
+    Responses are classified by the enrollment's response policy. Accepted records are
+    committed; retried ones are posted again with exponential backoff, up to max_attempts
+    in all, so delivery is at-least-once and in spool order. Records the policy rejects
+    or marks undeliverable, or that run out of attempts, are written to the spool's
+    dead-letter file and committed: the broker was already ACKed, so there is no queue
+    to hand them back to, and they must not hold up the records behind them.
+    """
+    def __init__(self, spool, enrollment, send_message_callback, max_backoff=30.0, max_attempts=10):
+        self.spool = spool
+        self.enrollment = enrollment
+        self.send_message_callback = send_message_callback
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        # Kept in step with the subscriber's settings when the enrollment changes.
+        self.compressor = None
+        self.policy = ResponsePolicy()
+        self.timeout = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name=f"spool-{self.enrollment.get('id')}")
+        self.thread.start()
+
+    def _post(self, raw):
+        """Posts a record to the target. Returns (outcome, status, error)."""
+        policy = self.policy
+        try:
+            payload, headers = decode_record(raw)
+        except ValueError as e:
+            logger.error("Spool drain for client '%s': unreadable record: %s", self.enrollment.get("id"), e)
+            return REJECT, None, e
+        options = {}
+        if policy.classifies_errors:
+            options["raise_errors"] = True
+        if self.timeout is not None:
+            options["timeout"] = self.timeout
+        if self.compressor is not None:
+            options["compressor"] = self.compressor
+        if headers:
+            options["headers"] = headers
+        try:
+            status = self.send_message_callback(self.enrollment["target_url"], payload, **options)
+        except Exception as e:
+            logger.error("Spool drain for client '%s' failed: %s", self.enrollment.get("id"), e)
+            return policy.classify_error(e), None, e
+        return policy.classify_status(status), status, None
+
+    def _run(self):
+        backoff = 0.5
+        attempts = 0
+        while not self.stop_event.is_set():
+            record = self.spool.next_record(timeout=1.0)
+            if record is None:
+                continue
+            position, raw = record
+            outcome, status, error = self._post(raw)
+            attempts += 1
+            if outcome == RETRY and attempts < self.max_attempts:
+                logger.info("Spool drain for client '%s': target returned %s, retrying in %.1fs",
+                            self.enrollment.get("id"), status if error is None else type(error).__name__, backoff)
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            if outcome != ACCEPT:
+                self._dead_letter(raw, outcome, status, error, attempts)
+            self.spool.commit(position)
+            backoff = 0.5
+            attempts = 0
+
+    def _dead_letter(self, raw, outcome, status, error, attempts):
+        logger.warning("Spool drain for client '%s': record %s after %d attempt(s), moved to %s.",
+                       self.enrollment.get("id"), outcome, attempts, DEAD_LETTER_FILE)
+        try:
+            self.spool.dead_letter(raw, outcome=outcome, status=status,
+                                   error=None if error is None else f"{type(error).__name__}: {error}",
+                                   attempts=attempts)
+        except Exception as e:
+            logger.error("Spool drain for client '%s': failed to write dead letter: %s",
+                         self.enrollment.get("id"), e)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
@@ -0,0 +1,85 @@
+import time
+import logging
+from proton import Delivery
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Names under which settlement outcomes are counted.
+_OUTCOME_COUNTERS = {
+    Delivery.ACCEPTED: "accepted",
+    Delivery.REJECTED: "rejected",
+    Delivery.RELEASED: "released",
+    Delivery.MODIFIED: "modified",
+}
+
+class SubscriberState:
+    """
+    Live state of one subscriber, kept up to date by the subscriber as things happen so
+    that reading it costs the same whatever the load.
+
+    Fields are only written from the subscriber's own threads (runner and reactor) and
+    are plain attributes, so snapshot() can be called from any thread; each field is
+    current, though two fields may be a message apart.
+    """
+    def __init__(self, enrollment_id, queue=None):
+        self.enrollment_id = enrollment_id
+        self.queue = queue
+        self.phase = "created"
+        self.connection = "closed"
+        self.link = "detached"
+        self.credit = 0
+        self.credit_blocked = False
+        self.unsettled = 0
+        self.received = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.released = 0
+        self.modified = 0
+        self.filtered = 0
+        self.started_at = None
+        self.last_message_at = None
+        self.last_settled_at = None
+        self.last_error = None
+
+    def record_received(self, credit):
+        self.received += 1
+        self.unsettled += 1
+        self.credit = credit
+        self.last_message_at = time.time()
+
+    def record_settled(self, state):
+        """Counts an outcome given to a received delivery (state is a Delivery state constant)."""
+        counter = _OUTCOME_COUNTERS.get(state)
+        if counter is not None:
+            setattr(self, counter, getattr(self, counter) + 1)
+        self.unsettled = max(0, self.unsettled - 1)
+        self.last_settled_at = time.time()
+
+    def record_credit(self, credit, blocked):
+        self.credit = credit
+        self.credit_blocked = blocked
+
+    def snapshot(self):
+        now = time.time()
+        return {
+            "enrollment_id": self.enrollment_id,
+            "queue": self.queue,
+            "phase": self.phase,
+            "connection": self.connection,
+            "link": self.link,
+            "credit": self.credit,
+            "credit_blocked": self.credit_blocked,
+            "unsettled": self.unsettled,
+            "received": self.received,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "released": self.released,
+            "modified": self.modified,
+            "filtered": self.filtered,
+            "started_at": self.started_at,
+            "last_message_at": self.last_message_at,
+            "last_settled_at": self.last_settled_at,
+            "idle_seconds": None if self.last_message_at is None else round(now - self.last_message_at, 3),
+            "last_error": self.last_error,
+        }
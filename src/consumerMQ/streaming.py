@@ -0,0 +1,149 @@
+import logging
+import threading
+from src.consumerMQ.policy import ACCEPT, RETRY, REJECT
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Global registry of stream channels, keyed by enrollment id.
+stream_channels = {}
+
+# How messages reach the enrollment: one POST each (the default) or over its WebSocket.
+DELIVERY_MODES = ("http", "websocket")
+
+class StreamChannel:
+    """
+    Bridges one enrollment's AMQP receiver (reactor thread) and the WebSocket a target
+    keeps open to hot-potato (aiohttp event loop).
+
+    The reactor side pushes message frames with push(); they are queued onto the event
+    loop and written in order by the WebSocket handler. Frames coming from the client
+    (window updates, acks and nacks) are turned into callbacks on the reactor thread
+    through the subscriber's event injector. Link credit is only granted from window
+    updates, so the client's window bounds how many messages are in flight.
+    """
+    def __init__(self, enrollment_id, max_window=1000):
+        self.enrollment_id = enrollment_id
+        self.max_window = max_window
+        self.lock = threading.Lock()
+        self.loop = None
+        self.outbox = None
+        self.notify = None
+
+    @classmethod
+    def from_args(cls, enrollment_id, args):
+        """
+        Builds a channel when subscription_args selects "delivery": "websocket", or returns
+        None for the default HTTP POST delivery. Window bound: {"stream": {"max_window": 1000}}.
+        """
+        max_window = cls.validate_args(args)
+        if max_window is None:
+            return None
+        return cls(enrollment_id, max_window=max_window)
+
+    @staticmethod
+    def validate_args(args):
+        """
+        Checks the "delivery" and "stream" entries of subscription_args. Returns the window
+        bound for websocket delivery, or None for HTTP POST delivery.
+        Raises ValueError for unknown delivery modes or a malformed window.
+        """
+        delivery = args.get("delivery", "http")
+        if delivery not in DELIVERY_MODES:
+            raise ValueError(f"Unknown delivery '{delivery}'; expected one of {', '.join(DELIVERY_MODES)}")
+        if delivery != "websocket":
+            return None
+        stream_args = args.get("stream") or {}
+        if not isinstance(stream_args, dict):
+            raise ValueError("stream must be an object")
+        max_window = stream_args.get("max_window", 1000)
+        if isinstance(max_window, bool) or not isinstance(max_window, int) or max_window < 1:
+            raise ValueError("max_window must be an integer of at least 1")
+        return max_window
+
+    def bind(self, notify):
+        """Sets the callable used to hand client events to the reactor thread: notify(name, subject)."""
+        self.notify = notify
+
+    @property
+    def connected(self):
+        return self.loop is not None
+
+    def attach(self, loop, outbox):
+        """Called on the event loop when a client connects. Returns False if one already is."""
+        with self.lock:
+            if self.loop is not None:
+                return False
+            self.loop = loop
+            self.outbox = outbox
+        logger.info("Stream for client '%s': consumer connected.", self.enrollment_id)
+        return True
+
+    def detach(self):
+        """Called on the event loop when the client goes away; unsettled messages are returned."""
+        with self.lock:
+            self.loop = None
+            self.outbox = None
+        logger.info("Stream for client '%s': consumer disconnected.", self.enrollment_id)
+        if self.notify is not None:
+            self.notify("stream_detached", None)
+
+    def push(self, frame):
+        """Queues a frame for the client. Returns False if no client is connected."""
+        with self.lock:
+            loop, outbox = self.loop, self.outbox
+        if loop is None:
+            return False
+        loop.call_soon_threadsafe(outbox.put_nowait, frame)
+        return True
+
+    def on_client_frame(self, frame):
+        """
+        Handles a JSON frame received from the client:
+          {"type": "window", "credit": n}              grant n more messages
+          {"type": "ack", "seq": n}                    accept message n
+          {"type": "nack", "seq": n, "requeue": true}  retry message n (requeue false: dead-letter)
+        Raises ValueError for malformed frames.
+        """
+        if not isinstance(frame, dict):
+            raise ValueError("Frame must be a JSON object")
+        frame_type = frame.get("type")
+        if frame_type == "window":
+            credit = int(frame.get("credit", 0))
+            if credit <= 0:
+                raise ValueError("Window credit must be positive")
+            self.notify("stream_credit", credit)
+        elif frame_type == "ack":
+            self.notify("stream_settle", (int(frame["seq"]), ACCEPT))
+        elif frame_type == "nack":
+            outcome = RETRY if frame.get("requeue", True) else REJECT
+            self.notify("stream_settle", (int(frame["seq"]), outcome))
+        else:
+            raise ValueError(f"Unknown frame type: {frame_type}")
+
+class StreamState:
+    """
+    Reactor-side bookkeeping for a stream: sequence numbers and the deliveries waiting
+    for the client's ack or nack. Only touched from the reactor thread.
+    """
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.next_seq = 0
+        self.pending = {}
+
+    def track(self, delivery, dedupe_key):
+        self.next_seq += 1
+        self.pending[self.next_seq] = (delivery, dedupe_key)
+        return self.next_seq
+
+    def grantable(self, link_credit, requested):
+        """Credit that may be added without letting credit plus unacked exceed the window."""
+        return max(0, min(requested, self.max_window - link_credit - len(self.pending)))
+
+    def pop(self, seq):
+        return self.pending.pop(seq, None)
+
+    def drain(self):
+        pending = list(self.pending.values())
+        self.pending.clear()
+        return pending
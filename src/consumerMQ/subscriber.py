@@ -1,40 +1,430 @@
+import os
 import json
+import math
+import time
 import logging
 import threading
+from collections import deque
 from proton.handlers import MessagingHandler, TransactionHandler
-from proton.reactor import Container
+from proton.reactor import Container, EventInjector, ApplicationEvent, Selector
 from proton import Disposition, Receiver
+from src.consumerMQ.dedupe import DedupeCache, remove_spill
+from src.consumerMQ.spool import Spool, SpoolDrainer, encode_record
+from src.consumerMQ.transactions import TransactionBatcher
+from src.consumerMQ.ordering import KeyedDispatcher
+from src.consumerMQ.streaming import StreamChannel, StreamState, stream_channels
+from src.consumerMQ.policy import ResponsePolicy, ACCEPT, UNDELIVERABLE, REJECT, FORWARD
+from src.consumerMQ.budget import MemoryBudget, global_budget, enrollment_budgets, message_size
+from src.consumerMQ.state import SubscriberState
+from src.consumerMQ.compression import Compressor, compressors
+from src.consumerMQ.transform import compile_transform
+from src.consumerMQ.tracing import MessageTrace, sample_rate_from_args, propagation_headers
+from src.consumerMQ.scheduler import ScheduledFlow
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def get_subscription_args(enrollment):
+    """
+    Returns the enrollment's subscription_args as a dict. Enrollments restored from the
+    database carry them as a JSON string, freshly enrolled ones as a dict.
+    """
+    args = enrollment.get("subscription_args") or {}
+    if isinstance(args, str):
+        try:
+            args = json.loads(args)
+        except Exception:
+            logger.error("Invalid subscription_args for enrollment '%s'; ignoring them.",
+                         enrollment.get("id"))
+            args = {}
+    return args
+
+def _int_arg(args, name, default, minimum):
+    value = args.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+def parse_delivery_args(args):
+    """
+    Reads the basic delivery settings of subscription_args. Returns a dict with
+    prefetch (>= 1, default 10), max_inflight_bytes (>= 0, 0 for no limit), timeout
+    (seconds > 0, or None for the callback's default) and selector (a string or None).
+    Raises ValueError for malformed values.
+    """
+    timeout = args.get("timeout")
+    if timeout is not None:
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)):
+            raise ValueError("timeout must be a number of seconds")
+        if not (math.isfinite(timeout) and timeout > 0):
+            raise ValueError("timeout must be a finite number greater than 0")
+    selector = args.get("selector")
+    if selector is not None and not isinstance(selector, str):
+        raise ValueError("selector must be a string")
+    return {
+        "prefetch": _int_arg(args, "prefetch", 10, 1),
+        "max_inflight_bytes": _int_arg(args, "max_inflight_bytes", 0, 0),
+        "timeout": timeout,
+        "selector": selector,
+    }
+
+# subscription_args entries that can change on a running subscriber. Changing any other
+# entry (or switching ordering on or off, or changing its key) needs a restart; changing the queue or selector
+# only re-attaches the receiver.
+HOT_SWAPPABLE_ARGS = {"timeout", "policy", "prefetch", "max_inflight_bytes", "ordering", "selector", "trace",
+                      "transform", "scheduling"}
+
+def requires_restart(old_enrollment, new_enrollment):
+    """Returns True if moving a running subscriber between these enrollments needs a restart."""
+    old_args = get_subscription_args(old_enrollment)
+    new_args = get_subscription_args(new_enrollment)
+    for key in set(old_args) | set(new_args):
+        if key not in HOT_SWAPPABLE_ARGS and old_args.get(key) != new_args.get(key):
+            return True
+    return (bool(old_args.get("ordering")) != bool(new_args.get("ordering"))
+            or _ordering_key(old_args) != _ordering_key(new_args)
+            or bool(old_args.get("scheduling")) != bool(new_args.get("scheduling")))
+
+def _ordering_key(args):
+    # Tasks queued under one key spec cannot be serialized against tasks keyed by another,
+    # so changing it needs a fresh dispatcher.
+    ordering = args.get("ordering")
+    return ordering.get("key", "group_id") if isinstance(ordering, dict) else "group_id"
+
+# Seconds a stopping subscriber waits for the broker to confirm the close before it
+# stops its container anyway.
+STOP_GRACE_SECONDS = 10
+
+class _ForceStop:
+    """Container task that stops a container whose connection did not close in time."""
+    def on_timer_task(self, event):
+        event.container.stop()
+
 class SubscriberHandler(MessagingHandler, TransactionHandler):
-    def __init__(self, amqp_url, enrollment, send_message_callback):
+    def __init__(self, amqp_url, enrollment, send_message_callback, state=None):
         """
         :param amqp_url: The AMQP URL for the ActiveMQ broker.
         :param enrollment: Dictionary with enrollment details.
                            Expected keys: "id", "queue", "target_url", etc.
         :param send_message_callback: Function that sends an HTTP POST to the enrollment's target URL;
                                       must return an integer HTTP status code.
+        :param state: SubscriberState to keep up to date; a private one is created if omitted.
         """
         # Disable auto_accept and auto_settle so that we control the message disposition explicitly.
-        super(SubscriberHandler, self).__init__(auto_accept=False, auto_settle=False)
+        # Credit is granted by _replenish_credit rather than proton's prefetch, so that it can
+        # follow the in-flight memory budgets and, when streaming, the consumer's window.
+        super(SubscriberHandler, self).__init__(prefetch=0, auto_accept=False, auto_settle=False)
         self.amqp_url = amqp_url
         self.enrollment = enrollment
         self.send_message_callback = send_message_callback
+        self.state = state if state is not None else SubscriberState(enrollment.get("id"), enrollment.get("queue"))
+        args = get_subscription_args(enrollment)
+        self.budget = MemoryBudget(enrollment.get("id"))
+        # Deliveries charged to the budgets and not yet settled; only touched on the reactor thread.
+        self.inflight = set()
+        self.credit_blocked = False
+        self._configure(args)
+        self.stream = StreamChannel.from_args(enrollment.get("id"), args)
+        self.stream_state = StreamState(self.stream.max_window) if self.stream is not None else None
+        self.stream_credit_wanted = 0
+        self.dedupe = DedupeCache.from_args(enrollment.get("id"), args.get("dedupe"))
+        self.compressor = Compressor.from_args(enrollment.get("id"), args.get("compression"))
+        self.spool = Spool.from_args(enrollment.get("id"), args.get("spool"))
+        self.spool_drainer = None
+        if self.spool is not None:
+            self.spool_drainer = SpoolDrainer(self.spool, enrollment, send_message_callback,
+                                              max_attempts=Spool.validate_args(args.get("spool"))["max_attempts"])
+            self.spool_drainer.compressor = self.compressor
+            self.spool_drainer.policy = self.policy
+            self.spool_drainer.timeout = self.timeout
+            self.spool_drainer.start()
+        self.transactions = TransactionBatcher.from_args(enrollment.get("id"), args.get("transaction"))
+        self.flow = ScheduledFlow.from_args(enrollment.get("id"), args.get("scheduling"))
+        self.dispatcher = KeyedDispatcher.from_args(enrollment.get("id"), args.get("ordering"), executor=self.flow)
+        # Ordered deliveries the dispatcher had no room for, in arrival order, as (key, task).
+        # No credit is granted while any are parked. Only touched on the reactor thread.
+        self.parked = deque()
+        if self.dispatcher is not None:
+            self.dispatcher.on_room = self._on_dispatch_room
+        # Lets other threads hand results back to the reactor thread, which alone may settle.
+        self.injector = None
+        # Guards the injector against being closed while another thread triggers it; once
+        # stopping, notifications are dropped as the reactor will not process them.
+        self.notify_lock = threading.Lock()
+        self.stopping = False
+        self.container = None
+        self.connection = None
+        self.receiver = None
+        self.stop_task = None
+
+    def _configure(self, args):
+        """
+        Applies the hot-swappable settings from subscription_args. Everything is parsed
+        before anything is assigned, so a ValueError leaves the current settings intact.
+        """
+        delivery_args = parse_delivery_args(args)
+        policy = ResponsePolicy.from_args(args.get("policy"))
+        trace_sample_rate = sample_rate_from_args(args.get("trace"))
+        # Already compiled (and cached) when the enrollment was validated.
+        transform = compile_transform(args.get("transform"))
+        self.prefetch = delivery_args["prefetch"]
+        self.budget.limit_bytes = delivery_args["max_inflight_bytes"]
+        self.timeout = delivery_args["timeout"]
+        self.selector = delivery_args["selector"]
+        self.policy = policy
+        self.trace_sample_rate = trace_sample_rate
+        self.transform = transform
+
+    def close(self):
+        """Releases resources held by the handler once its container has stopped."""
+        with self.notify_lock:
+            self.stopping = True
+        global_budget.remove_listener(self._on_budget_available)
+        if enrollment_budgets.get(self.enrollment.get("id")) is self.budget:
+            del enrollment_budgets[self.enrollment.get("id")]
+        if self.compressor is not None and compressors.get(self.enrollment.get("id")) is self.compressor:
+            del compressors[self.enrollment.get("id")]
+        if self.stream is not None and stream_channels.get(self.enrollment.get("id")) is self.stream:
+            del stream_channels[self.enrollment.get("id")]
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        self.parked.clear()
+        if self.flow is not None:
+            self.flow.shutdown()
+        if self.spool_drainer is not None:
+            self.spool_drainer.stop()
+        with self.notify_lock:
+            if self.injector is not None:
+                # The container has stopped and proton never closes the injector's pipe. No
+                # thread can be writing to it: they all see stopping and drop their events.
+                for fd in self.injector.pipe:
+                    os.close(fd)
+                self.injector = None
+        if self.spool is not None:
+            self.spool.close()
+        if self.dedupe is not None:
+            self.dedupe.close()
+        # Whatever is still unsettled will never be: hand its bytes back to the global budget.
+        self._drop_inflight()
 
     def on_start(self, event):
         logger.info("Subscriber for client '%s': Connecting to AMQP broker at %s", 
                     self.enrollment["id"], self.amqp_url)
-        connection = event.container.connect(self.amqp_url)
+        self.injector = EventInjector()
+        event.container.selectable(self.injector)
+        enrollment_budgets[self.enrollment["id"]] = self.budget
+        global_budget.add_listener(self._on_budget_available)
+        if self.compressor is not None:
+            compressors[self.enrollment["id"]] = self.compressor
+        if self.stream is not None:
+            self.stream.bind(self._notify)
+            stream_channels[self.enrollment["id"]] = self.stream
+        self.container = event.container
+        self.state.connection = "connecting"
+        self.connection = event.container.connect(self.amqp_url)
+        self._attach_receiver()
+
+    def _attach_receiver(self):
         logger.info("Subscriber for client '%s': Creating receiver for queue: %s", 
                     self.enrollment["id"], self.enrollment["queue"])
+        options = Selector(self.selector) if self.selector else None
+        self.state.queue = self.enrollment["queue"]
+        self.state.link = "attaching"
         # Create receiver normally; auto_settle is disabled by our constructor.
-        event.container.create_receiver(connection, self.enrollment["queue"])
+        self.receiver = self.container.create_receiver(self.connection, self.enrollment["queue"],
+                                                       options=options)
+        self._replenish_credit()
+
+    def update_enrollment(self, enrollment):
+        """
+        Hot-swaps the enrollment of the running subscriber. Safe to call from any thread;
+        the change is applied in one step on the reactor thread, without reconnecting.
+        The caller must have checked requires_restart() first.
+        """
+        self._notify("enrollment_updated", enrollment)
+
+    def on_enrollment_updated(self, event):
+        enrollment = event.subject
+        args = get_subscription_args(enrollment)
+        reattach = (enrollment["queue"] != self.enrollment["queue"]
+                    or args.get("selector") != self.selector)
+        try:
+            self._configure(args)
+        except (TypeError, ValueError) as e:
+            # Validated before it was stored, so this should not happen; keep running as is.
+            logger.error("Subscriber for client '%s': Enrollment update refused: %s",
+                         self.enrollment["id"], e)
+            return
+        self.enrollment = enrollment
+        if self.spool_drainer is not None:
+            self.spool_drainer.enrollment = enrollment
+            self.spool_drainer.policy = self.policy
+            self.spool_drainer.timeout = self.timeout
+        if self.dispatcher is not None:
+            self.dispatcher.reconfigure(args.get("ordering"))
+            self._drain_parked()
+        if self.flow is not None:
+            self.flow.reconfigure(args.get("scheduling"))
+        if reattach and self.receiver is not None:
+            # In-flight deliveries of the old link are redelivered by the broker.
+            self.receiver.close()
+            self._attach_receiver()
+        else:
+            self._replenish_credit()
+        logger.info("Subscriber for client '%s': Enrollment updated in place (receiver %s).",
+                    self.enrollment["id"], "re-attached" if reattach else "kept")
 
     def on_connection_opened(self, event):
         logger.info("Subscriber for client '%s': Connection opened successfully.", 
                     self.enrollment["id"])
+        self.state.connection = "open"
+        if self.transactions is not None:
+            self.transactions.attach(event.container, event.connection, self)
+
+    def on_disconnected(self, event):
+        self.state.connection = "disconnected"
+        self.state.link = "detached"
+        # Deliveries of the lost connection can no longer be settled; the broker redelivers them.
+        self.parked.clear()
+        self._drop_inflight()
+        self._finish_stop(event)
+
+    def on_connection_closed(self, event):
+        self.state.connection = "closed"
+        self._finish_stop(event)
+
+    def _finish_stop(self, event):
+        if self.stop_task is not None:
+            # Closed as requested; the pending grace timer would otherwise keep the container alive.
+            self.stop_task.cancel()
+            self.stop_task = None
+            event.container.stop()
+        if self.transactions is not None:
+            self.transactions.detach()
+
+    def on_transaction_declared(self, event):
+        self.transactions.on_declared(event.transaction)
+
+    def on_transaction_declare_failed(self, event):
+        logger.error("Subscriber for client '%s': Transaction declare failed; accepting individually.",
+                     self.enrollment["id"])
+
+    def on_transaction_committed(self, event):
+        self.transactions.on_committed(event.transaction)
+
+    def on_transaction_commit_failed(self, event):
+        self.transactions.on_failed(event.transaction)
+
+    def on_transaction_aborted(self, event):
+        self.transactions.on_failed(event.transaction)
+
+    def on_link_opened(self, event):
+        if event.receiver is not None and event.receiver is self.receiver:
+            self.state.link = "attached"
+        self._replenish_credit()
+
+    def on_link_closed(self, event):
+        if event.receiver is not None and event.receiver is self.receiver:
+            self.state.link = "detached"
+
+    def on_link_error(self, event):
+        if event.receiver is not None and event.receiver is self.receiver:
+            self.state.link = "error"
+            self.state.last_error = str(event.link.remote_condition)
+
+    def _budget_exhausted(self):
+        return self.budget.exhausted or global_budget.exhausted
+
+    def _replenish_credit(self):
+        """
+        Tops link credit up to the prefetch window (or to what the stream consumer asked
+        for), unless an in-flight memory budget is exhausted. In that case no credit is
+        granted and excess messages stay in the broker until deliveries settle.
+        Scheduled enrollments hold at most their weighted share of the scheduler's credit.
+        While ordered deliveries are parked (see _dispatch_message) no credit is granted.
+        """
+        if self.receiver is None:
+            return
+        if self.parked:
+            self.state.record_credit(self.receiver.credit, True)
+            return
+        if self._budget_exhausted():
+            self.credit_blocked = True
+            self.state.record_credit(self.receiver.credit, True)
+            return
+        self.credit_blocked = False
+        if self.stream is not None:
+            credit = self.stream_state.grantable(self.receiver.credit, self.stream_credit_wanted)
+            self.stream_credit_wanted -= credit
+        else:
+            window = self.prefetch if self.flow is None else min(self.prefetch, self.flow.credit())
+            credit = window - self.receiver.credit
+        if credit > 0:
+            self.receiver.flow(credit)
+        self.state.record_credit(self.receiver.credit, False)
+
+    def _on_budget_available(self):
+        # Called from whichever thread released global budget; only wake blocked receivers.
+        if self.credit_blocked:
+            self._notify("budget_available", None)
+
+    def on_budget_available(self, event):
+        self._replenish_credit()
+
+    def _hold_inflight(self, delivery, message):
+        """Charges a received message's body to the in-flight budgets until it is settled."""
+        size = message_size(message)
+        delivery.inflight_bytes = size
+        self.inflight.add(delivery)
+        self.budget.reserve(size)
+        global_budget.reserve(size)
+
+    def _release_inflight(self, delivery):
+        size = getattr(delivery, "inflight_bytes", None)
+        if size is None:
+            return
+        delivery.inflight_bytes = None
+        self.inflight.discard(delivery)
+        self.budget.release(size)
+        global_budget.release(size)
+        self._replenish_credit()
+
+    def _drop_inflight(self):
+        """
+        Releases the budget held by every delivery that will never be settled, e.g. after
+        a disconnect or once the container has stopped. Credit is not topped up here.
+        """
+        size = messages = 0
+        for delivery in self.inflight:
+            size += delivery.inflight_bytes or 0
+            messages += 1
+            delivery.inflight_bytes = None
+        self.inflight.clear()
+        if messages:
+            self.state.unsettled = max(0, self.state.unsettled - messages)
+            self.budget.release(size, messages)
+            global_budget.release(size, messages)
+
+    def settle(self, delivery, state=None):
+        super(SubscriberHandler, self).settle(delivery, state)
+        self.state.record_settled(state)
+        self._release_inflight(delivery)
+
+    def _accept(self, delivery):
+        """Accepts a delivery, under the open transaction when transactional batching is enabled."""
+        if self.transactions is None or not self.transactions.accept(delivery):
+            self.accept(delivery)
+        else:
+            # Settled once the transaction commits, but no longer held by us.
+            self.state.record_settled(Disposition.ACCEPTED)
+            self._release_inflight(delivery)
+
     def on_rejected(self, event):
         logger.debug("on_rejected: Message was rejected by remote peer. Delivery: %s", event.delivery)
 
@@ -52,6 +442,21 @@ class SubscriberHandler(MessagingHandler, TransactionHandler):
         logger.info("Subscriber for client '%s': Received message: %s", 
                     self.enrollment["id"], message.body)
         print(f"EVENT: {event}")
+        self.state.record_received(self.receiver.credit if self.receiver is not None else 0)
+        trace = MessageTrace.maybe_start(self.enrollment.get("id"), message, self.trace_sample_rate)
+        self._hold_inflight(event.delivery, message)
+        dedupe_key = self.dedupe.key_for(message) if self.dedupe is not None else None
+        if dedupe_key is not None and self.dedupe.seen(dedupe_key):
+            # Already delivered once; this is a redelivery after a lost ACK.
+            self._accept(event.delivery)
+            logger.info("Subscriber for client '%s': Duplicate message '%s' accepted without delivery.",
+                        self.enrollment["id"], dedupe_key)
+            if trace is not None:
+                trace.finish(outcome="duplicate")
+            return
+
+        if trace is not None:
+            trace.begin("parse")
         try:
             payload = message.body
             if isinstance(payload, str):
@@ -59,33 +464,295 @@ class SubscriberHandler(MessagingHandler, TransactionHandler):
         except Exception as e:
             logger.error("Subscriber for client '%s': Failed to parse message: %s", 
                          self.enrollment["id"], e)
+            if trace is not None:
+                trace.end("parse", error=type(e).__name__)
+            if self.policy.parse_error != FORWARD:
+                # Poison message: settle it right away instead of burning delivery attempts.
+                self._settle_outcome(event.delivery, self.policy.parse_error, dedupe_key)
+                if trace is not None:
+                    trace.finish(outcome=self.policy.parse_error)
+                return
             payload = message.body
+        if trace is not None:
+            trace.end("parse")
+
+        if self.transform is not None:
+            matched, payload = self.transform.apply(payload)
+            if not matched:
+                # Not for this target: consumed without a POST.
+                self._accept(event.delivery)
+                self.state.filtered += 1
+                logger.debug("Subscriber for client '%s': Message filtered out and accepted.",
+                             self.enrollment["id"])
+                if trace is not None:
+                    trace.finish(outcome="filtered")
+                return
+
+        if self.stream is not None:
+            self._stream_message(event, payload, dedupe_key)
+            if trace is not None:
+                trace.finish(outcome="streamed")
+            return
 
+        if self.spool is not None:
+            self._spool_message(event, payload, dedupe_key, trace)
+            return
+
+        if self.dispatcher is not None:
+            self._dispatch_message(event, payload, dedupe_key, trace)
+            return
+
+        if self.flow is not None:
+            self._schedule_message(event, payload, dedupe_key, trace)
+            return
+
+        status, error = self._deliver(payload, message, trace)
+        self._settle_delivery(event.delivery, status, error, dedupe_key, trace)
+
+    def _deliver(self, payload, message=None, trace=None):
+        """
+        Posts the payload to the enrollment's target. Safe to call from worker threads.
+        Returns (status, error) where error is the exception raised by the callback, if any.
+        The message's trace context, if any, is passed on in the request headers.
+        """
+        options = {}
+        if self.policy.classifies_errors:
+            options["raise_errors"] = True
+        if self.timeout is not None:
+            options["timeout"] = self.timeout
+        headers = propagation_headers(message, trace) if message is not None else {}
+        if headers:
+            options["headers"] = headers
+        if trace is not None:
+            options["trace"] = trace
+        if self.compressor is not None:
+            options["compressor"] = self.compressor
         try:
-            status = self.send_message_callback(self.enrollment["target_url"], payload)
-            if 200 <= status < 300:
-                # Explicitly accept the message
-                self.accept(event.delivery)
-                logger.info("Subscriber for client '%s': Message accepted (ACK).", 
-                            self.enrollment["id"])
-            else:
-                # Explicitly reject the message
-                local_state = event.delivery.local
-                local_state.failed = True
-                local_state.undeliverable = False
-                event.delivery.update(local_state.type)
-                self.settle(event.delivery, event.delivery.MODIFIED)
-                logger.info("Subscriber for client '%s': Message.RELEASED (NACK) with status %s", 
-                            self.enrollment["id"], status)
+            return self.send_message_callback(self.enrollment["target_url"], payload, **options), None
         except Exception as e:
             logger.error("Subscriber for client '%s': Error in send_message_callback: %s", 
                          self.enrollment["id"], e)
-            # Explicitly reject the message
-            local_state = event.delivery.local
-            local_state.failed = True
-            local_state.undeliverable = False
-            event.delivery.update(local_state.type)
-            self.settle(event.delivery, event.delivery.MODIFIED)
+            return None, e
+
+    def _settle_delivery(self, delivery, status, error, dedupe_key, trace=None):
+        """Settles a delivery according to the response policy. Must run on the reactor thread."""
+        if error is None:
+            outcome = self.policy.classify_status(status)
+        else:
+            outcome = self.policy.classify_error(error)
+        if trace is not None:
+            trace.begin("settle")
+        self._settle_outcome(delivery, outcome, dedupe_key)
+        if trace is not None:
+            trace.end("settle")
+            trace.finish(outcome=outcome, status=status)
+        if outcome == ACCEPT:
+            logger.info("Subscriber for client '%s': Message accepted (ACK).", 
+                        self.enrollment["id"])
+        elif error is None:
+            logger.info("Subscriber for client '%s': Message settled as %s with status %s", 
+                        self.enrollment["id"], outcome, status)
+        else:
+            logger.info("Subscriber for client '%s': Message settled as %s after %s", 
+                        self.enrollment["id"], outcome, type(error).__name__)
+
+    def _settle_outcome(self, delivery, outcome, dedupe_key=None):
+        """Applies a policy outcome to a delivery. Must run on the reactor thread."""
+        if outcome == ACCEPT:
+            self._accept(delivery)
+            if dedupe_key is not None:
+                self.dedupe.add(dedupe_key)
+        elif outcome == REJECT:
+            self.reject(delivery)
+        elif outcome == UNDELIVERABLE:
+            self._modify(delivery, undeliverable=True)
+        else:
+            self._modify(delivery)
+
+    def _modify(self, delivery, undeliverable=False):
+        """
+        Settles the delivery as MODIFIED (failed). The broker retries it unless it is
+        flagged undeliverable.
+        """
+        local_state = delivery.local
+        local_state.failed = True
+        local_state.undeliverable = undeliverable
+        delivery.update(local_state.type)
+        self.settle(delivery, delivery.MODIFIED)
+
+    def _dispatch_message(self, event, payload, dedupe_key, trace=None):
+        """
+        Hands the delivery to the keyed dispatcher so it is posted from a worker thread,
+        in order with other messages of its group. The outcome is settled back on the
+        reactor thread through on_delivery_done.
+        """
+        delivery = event.delivery
+        message = event.message
+
+        def task():
+            if trace is not None:
+                trace.end("queue_wait")
+            status, error = self._deliver(payload, message, trace)
+            self._complete(delivery, status, error, dedupe_key, trace)
+
+        if trace is not None:
+            trace.begin("queue_wait")
+        # Releasing a message over a bound would let later messages of its key overtake it.
+        # Park it instead and stop granting credit until the dispatcher has room again.
+        # Parked first and drained after, so a task finishing meanwhile always sees it.
+        self.parked.append((self.dispatcher.key_for(message), task))
+        if not self._drain_parked() and len(self.parked) == 1:
+            logger.warning("Subscriber for client '%s': Ordering backlog full, pausing credit.",
+                           self.enrollment["id"])
+
+    def _on_dispatch_room(self):
+        # Called from a dispatcher worker thread; only wake a receiver with parked deliveries.
+        if self.parked:
+            self._notify("dispatch_room", None)
+
+    def on_dispatch_room(self, event):
+        if self._drain_parked():
+            self._replenish_credit()
+
+    def _drain_parked(self):
+        """Hands parked deliveries to the dispatcher in order. Returns True once none are left."""
+        while self.parked:
+            key, task = self.parked[0]
+            if not self.dispatcher.submit(key, task):
+                return False
+            self.parked.popleft()
+        return True
+
+    def _schedule_message(self, event, payload, dedupe_key, trace=None):
+        """
+        Queues the delivery on the shared scheduler so it is posted from one of its
+        workers when this enrollment's turn comes. The outcome is settled back on the
+        reactor thread through on_delivery_done.
+        """
+        delivery = event.delivery
+        message = event.message
+
+        def task():
+            if trace is not None:
+                trace.end("queue_wait")
+            status, error = self._deliver(payload, message, trace)
+            self._complete(delivery, status, error, dedupe_key, trace)
+
+        if trace is not None:
+            trace.begin("queue_wait")
+        self.flow.submit(task)
+
+    def _complete(self, delivery, status, error, dedupe_key, trace=None):
+        """Reports a delivery outcome from a worker thread to the reactor thread."""
+        if trace is not None:
+            # Includes the hop back to the reactor thread.
+            trace.begin("settle")
+        self._notify("delivery_done", (delivery, status, error, dedupe_key, trace))
+
+    def _notify(self, name, subject):
+        """
+        Dispatches on_<name> on the reactor thread from any other thread. Before the
+        container started (e.g. in unit tests) the callback runs inline. Once the
+        subscriber is stopping the event is dropped; unsettled deliveries go back to
+        the broker with the connection.
+        """
+        event = ApplicationEvent(name, subject=subject)
+        with self.notify_lock:
+            if self.stopping:
+                logger.debug("Subscriber for client '%s': Stopping, %s event dropped.",
+                             self.enrollment["id"], name)
+                return
+            if self.injector is not None:
+                self.injector.trigger(event)
+                return
+        getattr(self, "on_" + name)(event)
+
+    def request_stop(self):
+        """
+        Asks the reactor thread to close the connection, after which the container's run()
+        returns and its sockets and pipes are released. Safe to call from any thread once
+        the container has started.
+        """
+        self._notify("stop_requested", None)
+        with self.notify_lock:
+            self.stopping = True
+
+    def on_stop_requested(self, event):
+        if self.state.connection == "disconnected":
+            # Waiting to reconnect: there is no broker to confirm a close, so stop right away.
+            self.injector.close()
+            self.container.stop()
+            return
+        if self.connection is not None:
+            self.connection.close()
+        # Lets the reactor run out of work once the close completes.
+        self.injector.close()
+        self.stop_task = self.container.schedule(STOP_GRACE_SECONDS, _ForceStop())
+
+    def on_delivery_done(self, event):
+        self._settle_delivery(*event.subject)
+
+    def _stream_message(self, event, payload, dedupe_key):
+        """Forwards the message to the connected WebSocket consumer and waits for its ack."""
+        seq = self.stream_state.track(event.delivery, dedupe_key)
+        if not self.stream.push({"type": "message", "seq": seq, "payload": payload}):
+            self.stream_state.pop(seq)
+            self.release(event.delivery, delivered=False)
+            logger.warning("Subscriber for client '%s': No stream consumer connected, message RELEASED.",
+                           self.enrollment["id"])
+
+    def on_stream_credit(self, event):
+        self.stream_credit_wanted += event.subject
+        self._replenish_credit()
+
+    def on_stream_settle(self, event):
+        seq, outcome = event.subject
+        entry = self.stream_state.pop(seq)
+        if entry is None:
+            logger.warning("Subscriber for client '%s': Stream %s for unknown seq %s ignored.",
+                           self.enrollment["id"], outcome, seq)
+            return
+        delivery, dedupe_key = entry
+        self._settle_outcome(delivery, outcome, dedupe_key)
+        logger.info("Subscriber for client '%s': Stream consumer settled seq %s as %s.",
+                    self.enrollment["id"], seq, outcome)
+
+    def on_stream_detached(self, event):
+        # Window credit asked for by the gone consumer must not carry over to the next one.
+        self.stream_credit_wanted = 0
+        # Messages the consumer never acknowledged count as a failed delivery attempt.
+        for delivery, _ in self.stream_state.drain():
+            self._modify(delivery)
+
+    def _spool_message(self, event, payload, dedupe_key, trace=None):
+        """
+        Accepts the delivery once its payload is durably in the local spool; the spool
+        drainer takes care of the HTTP delivery. A full spool leaves the message in the broker.
+        """
+        if trace is not None:
+            trace.begin("spool")
+        try:
+            # The trace context travels with the record so the drainer's POST carries it too.
+            record = encode_record(payload, propagation_headers(event.message, trace))
+            spooled = self.spool.append(record)
+        except Exception as e:
+            logger.error("Subscriber for client '%s': Failed to spool message: %s",
+                         self.enrollment["id"], e)
+            spooled = False
+        if trace is not None:
+            trace.end("spool")
+            trace.finish(outcome="spooled" if spooled else "released")
+        if spooled:
+            self._accept(event.delivery)
+            if dedupe_key is not None:
+                self.dedupe.add(dedupe_key)
+            logger.info("Subscriber for client '%s': Message spooled and accepted (ACK).",
+                        self.enrollment["id"])
+        else:
+            # Not a delivery attempt: the broker keeps it without bumping the delivery count.
+            self.release(event.delivery, delivered=False)
+            logger.warning("Subscriber for client '%s': Spool full, message RELEASED.",
+                           self.enrollment["id"])
 
 class SubscriberRunner:
     """
@@ -96,24 +763,81 @@ class SubscriberRunner:
         self.enrollment = enrollment
         self.send_message_callback = send_message_callback
         self.container = None
+        self.handler = None
         self.thread = None
+        self.state = SubscriberState(enrollment["id"], enrollment.get("queue"))
+        # Guards the container's creation against a stop() racing with the thread's start.
+        self.lock = threading.Lock()
+        self.stop_requested = False
+        # Set when the enrollment was deleted: its on-disk dedupe state goes with it.
+        self.discard = False
 
     def start(self):
         def run_container():
-            handler = SubscriberHandler(self.amqp_url, self.enrollment, self.send_message_callback)
-            self.container = Container(handler)
+            self.state.phase = "running"
+            self.state.started_at = time.time()
             try:
+                with self.lock:
+                    if self.stop_requested:
+                        self.state.phase = "stopped"
+                        return
+                    self.handler = SubscriberHandler(self.amqp_url, self.enrollment, self.send_message_callback,
+                                                     state=self.state)
+                    self.container = Container(self.handler)
                 self.container.run()
+                self.state.phase = "stopped"
             except Exception as e:
+                self.state.phase = "failed"
+                self.state.last_error = str(e)
                 logger.error("Subscriber for client '%s' terminated with error: %s", 
                              self.enrollment["id"], e)
-        self.thread = threading.Thread(target=run_container, daemon=True)
+            finally:
+                self.state.connection = "closed"
+                self.state.link = "detached"
+                if self.handler is not None:
+                    self.handler.close()
+                if self.discard:
+                    remove_spill(self.enrollment["id"])
+        self.thread = threading.Thread(target=run_container, daemon=True,
+                                       name=f"subscriber-{self.enrollment['id']}")
         self.thread.start()
 
-    def stop(self):
-        if self.container:
+    def update(self, enrollment):
+        """
+        Applies a changed enrollment to the running subscriber without tearing down its
+        connection. Returns False if the change needs a restart instead.
+        """
+        if requires_restart(self.enrollment, enrollment):
+            return False
+        self.enrollment = enrollment
+        if self.handler is not None:
+            self.handler.update_enrollment(enrollment)
+        return True
+
+    def snapshot(self):
+        """Returns the subscriber's live state as a JSON-serialisable dict."""
+        snapshot = self.state.snapshot()
+        snapshot["thread_alive"] = self.thread is not None and self.thread.is_alive()
+        return snapshot
+
+    def stop(self, discard=False):
+        """
+        Stops the subscriber without waiting for it; see join(). A started subscriber
+        closes its connection from its own thread so nothing is left open behind it.
+        With discard, the enrollment's dedupe spill file is deleted once it is closed.
+        """
+        with self.lock:
+            self.stop_requested = True
+            self.discard = self.discard or discard
+            starting = self.thread is not None and self.container is None
+        if starting:
+            logger.info("Subscriber for client '%s': Stopped before it started.", self.enrollment["id"])
+        elif self.container:
             try:
-                self.container.stop()
+                if self.handler.injector is not None:
+                    self.handler.request_stop()
+                else:
+                    self.container.stop()
                 logger.info("Subscriber for client '%s': Stopped.", self.enrollment["id"])
             except Exception as e:
                 logger.error("Error stopping subscriber for client '%s': %s", 
@@ -121,6 +845,13 @@ class SubscriberRunner:
         else:
             logger.warning("No active container to stop for client '%s'.", self.enrollment["id"])
 
+    def join(self, timeout=None):
+        """Waits for the subscriber thread to finish. Returns False if it is still running."""
+        if self.thread is not None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
 def run_subscriber(amqp_url, enrollment, send_message_callback):
     """
     Convenience function that creates and starts a SubscriberRunner.
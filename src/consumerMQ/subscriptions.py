@@ -1,30 +1,87 @@
 import logging
 from src.consumerMQ.subscriber import SubscriberRunner
+from src.consumerMQ.fanout import FanoutGroup, fanout_args
+from src.consumerMQ.dedupe import remove_spill
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Global registry for active subscriber runners.
+# Global registry for active subscriber runners. Fan-out groups are listed here too,
+# under their group ID, so that they show up alongside the runners.
 active_subscribers = {}
 
+# Global registry of fan-out groups keyed by queue, and of the group each fan-out
+# enrollment belongs to, keyed by enrollment ID.
+fanout_groups = {}
+fanout_members = {}
+
 def start_subscriber_for_enrollment(amqp_url, enrollment, send_message_callback):
     """
-    Starts a new SubscriberRunner for the given enrollment.
-    Returns the runner instance.
+    Starts a new SubscriberRunner for the given enrollment, or adds a fan-out enrollment
+    to the group receiving its queue.
+    Returns the runner instance (the group for fan-out enrollments).
     """
+    if fanout_args(enrollment) is not None:
+        group = fanout_groups.get(enrollment["queue"])
+        if group is None:
+            group = fanout_groups[enrollment["queue"]] = FanoutGroup(
+                amqp_url, enrollment["queue"], send_message_callback)
+            active_subscribers[group.id] = group
+        group.join(enrollment)
+        fanout_members[enrollment["id"]] = group
+        logger.info("Added enrollment %s to fan-out group %s", enrollment["id"], group.id)
+        return group
     runner = SubscriberRunner(amqp_url, enrollment, send_message_callback)
     runner.start()
     active_subscribers[enrollment["id"]] = runner
     logger.info("Started subscriber for enrollment: %s", enrollment["id"])
     return runner
 
-def stop_subscriber_for_enrollment(enrollment_id):
+def stop_subscriber_for_enrollment(enrollment_id, wait=False, discard=False):
     """
     Stops the subscriber runner associated with the given enrollment ID and removes it from the registry.
+    A fan-out enrollment leaves its group; the group stops with its last member.
+    With wait, returns only once the runner's thread has finished and released its spool,
+    dedupe cache and other per-enrollment resources. With discard (the enrollment was
+    deleted), its dedupe spill file is removed as well.
     """
+    group = fanout_members.pop(enrollment_id, None)
+    if group is not None:
+        if group.leave(enrollment_id):
+            fanout_groups.pop(group.queue, None)
+            active_subscribers.pop(group.id, None)
+        logger.info("Removed enrollment %s from fan-out group %s", enrollment_id, group.id)
+        return
     runner = active_subscribers.pop(enrollment_id, None)
     if runner:
-        runner.stop()
+        runner.stop(discard=discard)
+        if wait:
+            runner.join()
         logger.info("Stopped subscriber for enrollment: %s", enrollment_id)
     else:
         logger.warning("No active subscriber found for enrollment: %s", enrollment_id)
+        if discard:
+            remove_spill(enrollment_id)
+
+def update_subscriber_for_enrollment(amqp_url, enrollment, send_message_callback):
+    """
+    Applies a changed enrollment to its running subscriber in place when possible;
+    otherwise restarts the subscriber under the same enrollment ID.
+    Returns True if the subscriber was updated in place.
+    """
+    group = fanout_members.get(enrollment["id"])
+    if group is not None and group.queue == enrollment["queue"] and fanout_args(enrollment) is not None:
+        in_place = group.join(enrollment)
+        logger.info("Updated fan-out member %s for enrollment: %s",
+                    "in place" if in_place else "with a receiver restart", enrollment["id"])
+        return in_place
+    runner = active_subscribers.get(enrollment["id"])
+    if group is None and runner is not None and fanout_args(enrollment) is None and runner.update(enrollment):
+        logger.info("Updated subscriber in place for enrollment: %s", enrollment["id"])
+        return True
+    if group is not None or runner is not None:
+        # The new subscriber reopens the same spool directory and dedupe spill file, so the
+        # old one must have closed them first.
+        stop_subscriber_for_enrollment(enrollment["id"], wait=True)
+    start_subscriber_for_enrollment(amqp_url, enrollment, send_message_callback)
+    return False
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import logging.handlers
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Fraction of messages traced (0 disables tracing); subscription_args "trace" overrides it.
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+# Number of finished traces kept in memory for GET /debug/traces.
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "1000"))
+# Optional JSON-lines file that finished traces are appended to, with size-based rotation.
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+TRACE_FILE_MAX_BYTES = int(os.environ.get("TRACE_FILE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.environ.get("TRACE_FILE_BACKUPS", "3"))
+
+# W3C trace context: version-traceid-parentid-flags.
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+def sample_rate_from_args(trace_args):
+    """
+    Returns the sample rate for an enrollment from the "trace" entry of subscription_args:
+    `true` traces every message, `false` none, {"sample_rate": 0.01} a fraction.
+    Without it the TRACE_SAMPLE_RATE environment variable applies.
+    """
+    if trace_args is None:
+        return TRACE_SAMPLE_RATE
+    if isinstance(trace_args, bool):
+        return 1.0 if trace_args else 0.0
+    if not isinstance(trace_args, dict):
+        raise ValueError("trace must be a boolean or an object")
+    rate = float(trace_args.get("sample_rate", TRACE_SAMPLE_RATE))
+    if not 0 <= rate <= 1:
+        raise ValueError("trace.sample_rate must be between 0 and 1")
+    return rate
+
+def incoming_context(message):
+    """Returns the (traceparent, tracestate) carried in a message's application properties."""
+    properties = getattr(message, "properties", None) or {}
+    traceparent = properties.get("traceparent")
+    if not isinstance(traceparent, str) or not _TRACEPARENT.match(traceparent.strip().lower()):
+        return None, None
+    tracestate = properties.get("tracestate")
+    return traceparent.strip().lower(), tracestate if isinstance(tracestate, str) else None
+
+def propagation_headers(message, trace=None):
+    """
+    Returns the HTTP headers that carry a message's trace context to the target, or an
+    empty dict when there is none. A sampled message's POST becomes the parent span.
+    """
+    if trace is not None:
+        return trace.headers()
+    traceparent, tracestate = incoming_context(message)
+    if traceparent is None:
+        return {}
+    headers = {"traceparent": traceparent}
+    if tracestate:
+        headers["tracestate"] = tracestate
+    return headers
+
+class Span:
+    """Times one stage of a message trace from its creation until end() is called."""
+    def __init__(self, trace, name, **attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def end(self, **attributes):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+            self.attributes.update(attributes)
+            self.trace.spans.append(self)
+        return self
+
+class MessageTrace:
+    """
+    The spans of one sampled message, from on_message to settlement.
+
+    A trace is handed between the reactor thread and delivery worker threads along
+    with its delivery, so only one thread touches it at a time.
+    """
+    def __init__(self, enrollment_id, message):
+        self.enrollment_id = enrollment_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.open_spans = {}
+        self.attributes = {}
+        traceparent, self.tracestate = incoming_context(message)
+        if traceparent is not None:
+            _, self.trace_id, self.parent_id, self.flags = _TRACEPARENT.match(traceparent).groups()
+        else:
+            self.trace_id, self.parent_id, self.flags = os.urandom(16).hex(), None, "01"
+        self.span_id = os.urandom(8).hex()
+        creation_time = getattr(message, "creation_time", None)
+        if creation_time:
+            # Broker and producer clocks may differ from ours; treat as an estimate.
+            self.attributes["broker_ms"] = round((self.started_at - creation_time) * 1000, 3)
+
+    @classmethod
+    def maybe_start(cls, enrollment_id, message, sample_rate):
+        """Starts a trace for the message with probability sample_rate, else returns None."""
+        if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+            return None
+        return cls(enrollment_id, message)
+
+    def span(self, name, **attributes):
+        return Span(self, name, **attributes)
+
+    def begin(self, name):
+        """Opens a span that ends in another callback (or thread) with end(name)."""
+        if name not in self.open_spans:
+            self.open_spans[name] = Span(self, name)
+
+    def end(self, name, **attributes):
+        span = self.open_spans.pop(name, None)
+        if span is not None:
+            span.end(**attributes)
+
+    def headers(self):
+        headers = {"traceparent": f"00-{self.trace_id}-{self.span_id}-{self.flags}"}
+        if self.tracestate:
+            headers["tracestate"] = self.tracestate
+        return headers
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "enrollment_id": self.enrollment_id,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "offset_ms": round((span.start - self.start) * 1000, 3),
+                    "duration_ms": round(span.duration * 1000, 3),
+                    **({"attributes": span.attributes} if span.attributes else {}),
+                }
+                for span in self.spans
+            ],
+        }
+
+    def finish(self, **attributes):
+        """Records the final attributes (e.g. the outcome) and exports the trace."""
+        self.attributes.update(attributes)
+        trace_exporter.export(self.to_dict())
+
+class TraceExporter:
+    """
+    Keeps the most recent finished traces in a ring buffer and, when a path is given,
+    appends them as JSON lines to a size-rotated file.
+    """
+    def __init__(self, buffer_size=1000, path="", max_bytes=16 * 1024 * 1024, backups=3):
+        self.lock = threading.Lock()
+        self.buffer = deque(maxlen=max(1, buffer_size))
+        self.file_logger = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self.file_logger = logging.getLogger(f"{__name__}.file")
+                self.file_logger.propagate = False
+                self.file_logger.setLevel(logging.INFO)
+                self.file_logger.addHandler(handler)
+            except Exception as e:
+                logger.error("Cannot open trace file %s: %s", path, e)
+
+    def export(self, record):
+        with self.lock:
+            self.buffer.append(record)
+        if self.file_logger is not None:
+            self.file_logger.info(json.dumps(record, default=str))
+
+    def recent(self, enrollment_id=None, min_ms=0.0, limit=100):
+        """Returns up to limit finished traces, newest first, optionally filtered."""
+        with self.lock:
+            records = list(self.buffer)
+        matches = []
+        for record in reversed(records):
+            if enrollment_id is not None and record["enrollment_id"] != enrollment_id:
+                continue
+            if record["duration_ms"] < min_ms:
+                continue
+            matches.append(record)
+            if len(matches) >= limit:
+                break
+        return matches
+
+# Process-wide exporter shared by every subscriber.
+trace_exporter = TraceExporter(TRACE_BUFFER_SIZE, TRACE_FILE, TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS)
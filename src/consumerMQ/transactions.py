@@ -0,0 +1,118 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class _BatchTimer:
+    """Container task handler that commits the open batch when its time window elapses."""
+    def __init__(self, batcher, transaction):
+        self.batcher = batcher
+        self.transaction = transaction
+
+    def on_timer_task(self, event):
+        if self.batcher.transaction is self.transaction:
+            self.batcher.commit()
+
+class TransactionBatcher:
+    """
+    Groups accepts of successfully delivered messages into AMQP local transactions.
+
+    A transaction is committed once batch_size deliveries were accepted under it or
+    batch_ms milliseconds after its first accept, whichever comes first, and the next
+    transaction is declared right away. Deliveries are settled locally when the broker
+    confirms the commit; if the commit fails the broker releases them for redelivery.
+    While no transaction is declared, accept() returns False and the caller should
+    accept the delivery on its own.
+    """
+    def __init__(self, enrollment_id, batch_size=100, batch_ms=200):
+        self.enrollment_id = enrollment_id
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.container = None
+        self.connection = None
+        self.handler = None
+        self.transaction = None
+        self.batches = {}
+
+    @classmethod
+    def from_args(cls, enrollment_id, transaction_args):
+        """
+        Builds a batcher from the "transaction" entry of subscription_args, or returns None
+        when transactional acknowledgement is not enabled. Accepts either `true` or a dict
+        such as {"batch_size": 100, "batch_ms": 200}.
+        """
+        if not transaction_args:
+            return None
+        if transaction_args is True:
+            transaction_args = {}
+        if not isinstance(transaction_args, dict):
+            raise ValueError("transaction must be `true` or an object")
+        if not transaction_args.get("enabled", True):
+            return None
+        return cls(
+            enrollment_id,
+            batch_size=max(1, int(transaction_args.get("batch_size", 100))),
+            batch_ms=max(1, int(transaction_args.get("batch_ms", 200))),
+        )
+
+    def attach(self, container, connection, handler):
+        """Declares the first transaction on a newly opened connection."""
+        self.container = container
+        self.connection = connection
+        self.handler = handler
+        self.transaction = None
+        self.batches = {}
+        self.declare()
+
+    def declare(self):
+        if self.container is None:
+            return
+        self.container.declare_transaction(self.connection, handler=self.handler)
+
+    def detach(self):
+        """Forgets all transaction state, e.g. after the connection dropped."""
+        self.transaction = None
+        self.batches = {}
+        self.connection = None
+
+    def on_declared(self, transaction):
+        self.transaction = transaction
+        self.batches[transaction] = []
+        logger.debug("Subscriber for client '%s': Transaction declared.", self.enrollment_id)
+
+    def accept(self, delivery):
+        """Accepts the delivery under the open transaction. Returns False if there is none."""
+        if self.transaction is None:
+            return False
+        batch = self.batches[self.transaction]
+        self.transaction.accept(delivery)
+        batch.append(delivery)
+        if len(batch) >= self.batch_size:
+            self.commit()
+        elif len(batch) == 1:
+            self.container.schedule(self.batch_ms / 1000.0, _BatchTimer(self, self.transaction))
+        return True
+
+    def commit(self):
+        """Commits the open transaction (if it has any accepts) and declares the next one."""
+        transaction = self.transaction
+        if transaction is None or not self.batches.get(transaction):
+            return
+        self.transaction = None
+        transaction.commit()
+        self.declare()
+
+    def on_committed(self, transaction):
+        batch = self.batches.pop(transaction, [])
+        for delivery in batch:
+            delivery.settle()
+        logger.info("Subscriber for client '%s': Committed %d accept(s) in one transaction.",
+                    self.enrollment_id, len(batch))
+
+    def on_failed(self, transaction):
+        """Drops a failed transaction; its deliveries were released and will be redelivered."""
+        batch = self.batches.pop(transaction, [])
+        if self.transaction is transaction:
+            self.transaction = None
+        logger.warning("Subscriber for client '%s': Transaction failed; %d delivery(ies) released.",
+                       self.enrollment_id, len(batch))
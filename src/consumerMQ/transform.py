@@ -0,0 +1,286 @@
+import re
+import ast
+import json
+import logging
+import operator
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+_MISSING = object()
+
+# Deepest nesting of "not", parentheses and lists a predicate may use; deeper ones are
+# refused rather than left to overflow the parser's (and the evaluator's) recursion.
+MAX_DEPTH = 32
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<number>-?\d+(?:\.\d+)?)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<op>==|!=|<=|>=|<|>|\(|\)|\[|\]|,)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z0-9_]+)*)
+    )""", re.VERBOSE)
+
+_KEYWORDS = {"and", "or", "not", "in", "exists", "true", "false", "null"}
+
+_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+def _get_path(payload, path):
+    """Returns the value at a dotted path of nested objects, or _MISSING."""
+    value = payload
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _truthy(value):
+    return value is not _MISSING and bool(value)
+
+def _tokenize(source):
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN.match(source, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected character at position {position}: {source[position:position + 10]!r}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "name" and text in _KEYWORDS:
+            kind = text
+        tokens.append((kind, text))
+        position = match.end()
+    tokens.append(("end", None))
+    return tokens
+
+class _Parser:
+    """
+    Recursive-descent parser that turns a predicate into nested closures taking the
+    payload, so evaluating it per message does no parsing.
+
+        expr       := and_expr ("or" and_expr)*
+        and_expr   := not_expr ("and" not_expr)*
+        not_expr   := "not" not_expr | "exists" path | comparison
+        comparison := value (("==" | "!=" | "<" | "<=" | ">" | ">=" | "in") value)?
+        value      := path | number | string | true | false | null | "[" value, ... "]" | "(" expr ")"
+    """
+    def __init__(self, source):
+        self.tokens = _tokenize(source)
+        self.index = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.index][0]
+
+    def take(self, kind=None):
+        token_kind, text = self.tokens[self.index]
+        if kind is not None and token_kind != kind:
+            raise ValueError(f"Expected {kind!r} but found {text or 'end of expression'!r}")
+        self.index += 1
+        return text
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise ValueError(f"Expression nested more than {MAX_DEPTH} levels deep")
+
+    def leave(self):
+        self.depth -= 1
+
+    def parse(self):
+        predicate = self.expr()
+        self.take("end")
+        return predicate
+
+    def expr(self):
+        operands = [self.and_expr()]
+        while self.peek() == "or":
+            self.take()
+            operands.append(self.and_expr())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda payload: any(operand(payload) for operand in operands)
+
+    def and_expr(self):
+        operands = [self.not_expr()]
+        while self.peek() == "and":
+            self.take()
+            operands.append(self.not_expr())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda payload: all(operand(payload) for operand in operands)
+
+    def not_expr(self):
+        if self.peek() == "not":
+            self.take()
+            self.enter()
+            operand = self.not_expr()
+            self.leave()
+            return lambda payload: not operand(payload)
+        if self.peek() == "exists":
+            self.take()
+            path = self.take("name").split(".")
+            return lambda payload: _get_path(payload, path) is not _MISSING
+        return self.comparison()
+
+    def comparison(self):
+        left = self.value()
+        kind = self.peek()
+        if kind == "op" and self.tokens[self.index][1] in _COMPARISONS:
+            compare = _COMPARISONS[self.take()]
+        elif kind == "in":
+            self.take()
+            compare = lambda item, container: isinstance(container, (list, str)) and item in container
+        else:
+            return lambda payload: _truthy(left(payload))
+        right = self.value()
+
+        def evaluate(payload):
+            a, b = left(payload), right(payload)
+            if a is _MISSING or b is _MISSING:
+                return False
+            try:
+                return compare(a, b)
+            except TypeError:
+                # e.g. ordering a string against a number
+                return False
+        return evaluate
+
+    def value(self):
+        kind = self.peek()
+        if kind == "name":
+            path = self.take().split(".")
+            return lambda payload: _get_path(payload, path)
+        if kind == "number":
+            text = self.take()
+            constant = float(text) if "." in text else int(text)
+        elif kind == "string":
+            text = self.take()
+            try:
+                constant = ast.literal_eval(text)
+            except (SyntaxError, ValueError) as e:
+                raise ValueError(f"Invalid string {text}: {getattr(e, 'msg', e)}") from None
+        elif kind in ("true", "false", "null"):
+            constant = {"true": True, "false": False, "null": None}[self.take()]
+        elif kind == "op" and self.tokens[self.index][1] == "[":
+            self.take()
+            self.enter()
+            items = []
+            while not (self.peek() == "op" and self.tokens[self.index][1] == "]"):
+                if items:
+                    if self.take("op") != ",":
+                        raise ValueError("Expected ',' between list items")
+                items.append(self.value())
+            self.take()
+            self.leave()
+            return lambda payload: [item(payload) for item in items]
+        elif kind == "op" and self.tokens[self.index][1] == "(":
+            self.take()
+            self.enter()
+            inner = self.expr()
+            if self.take("op") != ")":
+                raise ValueError("Expected ')'")
+            self.leave()
+            return inner
+        else:
+            raise ValueError(f"Unexpected {self.tokens[self.index][1] or 'end of expression'!r}")
+        return lambda payload: constant
+
+class Transform:
+    """
+    A compiled subscription_args "transform": an optional predicate ("where") and an
+    optional projection ("fields", with "rename"). Immutable once compiled, so one
+    instance is shared by every subscriber using the same spec.
+    """
+    def __init__(self, where=None, fields=None, rename=None):
+        self.where = where
+        self.predicate = _Parser(where).parse() if where else None
+        self.fields = [(field, field.split(".")) for field in (fields or [])]
+        self.rename = {source: target.split(".") for source, target in (rename or {}).items()}
+
+    def matches(self, payload):
+        return self.predicate is None or bool(self.predicate(payload))
+
+    def project(self, payload):
+        """Returns the payload reduced to the selected fields, renamed. Non-objects pass through."""
+        if not isinstance(payload, dict) or not (self.fields or self.rename):
+            return payload
+        if self.fields:
+            selected = [(field, _get_path(payload, path)) for field, path in self.fields]
+            result = {}
+        else:
+            selected = [(source, _get_path(payload, source.split("."))) for source in self.rename]
+            result = dict(payload)
+            for source in self.rename:
+                _pop_path(result, source.split("."))
+        for field, value in selected:
+            if value is _MISSING:
+                continue
+            _set_path(result, self.rename.get(field) or field.split("."), value)
+        return result
+
+    def apply(self, payload):
+        """Returns (matched, payload to send)."""
+        if not self.matches(payload):
+            return False, None
+        return True, self.project(payload)
+
+def _set_path(result, path, value):
+    for part in path[:-1]:
+        child = result.get(part)
+        if not isinstance(child, dict):
+            child = result[part] = {}
+        result = child
+    result[path[-1]] = value
+
+def _pop_path(result, path):
+    """Removes a dotted path, copying the nested objects on the way so the source is untouched."""
+    for part in path[:-1]:
+        child = result.get(part)
+        if not isinstance(child, dict):
+            return
+        child = result[part] = dict(child)
+        result = child
+    result.pop(path[-1], None)
+
+@lru_cache(maxsize=256)
+def _compile(spec_json):
+    spec = json.loads(spec_json)
+    if not isinstance(spec, dict):
+        raise ValueError("transform must be an object")
+    unknown = set(spec) - {"fields", "rename", "where"}
+    if unknown:
+        raise ValueError(f"Unknown transform option(s): {', '.join(sorted(unknown))}")
+    fields = spec.get("fields")
+    if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) and f for f in fields)):
+        raise ValueError("fields must be a list of field paths")
+    rename = spec.get("rename")
+    if rename is not None and not (isinstance(rename, dict)
+                                   and all(isinstance(t, str) and t for t in rename.values())):
+        raise ValueError("rename must map field paths to new field paths")
+    where = spec.get("where")
+    if where is not None and not isinstance(where, str):
+        raise ValueError("where must be a string")
+    return Transform(where=where, fields=fields, rename=rename)
+
+def compile_transform(spec):
+    """
+    Compiles the "transform" entry of subscription_args, e.g.:
+      {"where": "status == 'paid' and total >= 100",
+       "fields": ["order.id", "total"], "rename": {"order.id": "id"}}
+    Returns None when there is none. Compiled transforms are cached by spec, so
+    validating an enrollment and starting its subscriber compile it only once.
+    Raises ValueError for malformed specs or predicates.
+    """
+    if not spec:
+        return None
+    return _compile(json.dumps(spec, sort_keys=True))
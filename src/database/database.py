@@ -23,6 +23,8 @@ class DatabaseManager:
     def __init__(self, backup_path=SQLITE_BACKUP_PATH):
         self.backup_path = backup_path
         self.lock = threading.Lock()
+        # Serializes disk backups with each other, but not with queries.
+        self.backup_lock = threading.Lock()
         # Create an in-memory database; using check_same_thread=False to allow usage from multiple threads.
         self.conn = sqlite3.connect(":memory:", check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
@@ -58,14 +60,20 @@ class DatabaseManager:
         """
         Backs up the current in-memory database to the persistent file.
         This method is intended to run in a separate thread.
+        The database lock is only held while copying into an in-memory snapshot;
+        the snapshot is written to disk afterwards, so queries never wait on disk I/O.
         """
-        with self.lock:
+        with self.backup_lock:
             try:
+                snapshot = sqlite3.connect(":memory:")
+                with self.lock:
+                    self.conn.backup(snapshot)
                 disk_conn = sqlite3.connect(self.backup_path)
                 disk_conn.row_factory = sqlite3.Row
-                self.conn.backup(disk_conn)
+                snapshot.backup(disk_conn)
                 disk_conn.commit()
                 disk_conn.close()
+                snapshot.close()
                 logger.info("Backed up in-memory database to disk at '%s'.", self.backup_path)
             except Exception as e:
                 logger.error("Backup to disk failed: %s", e)
@@ -83,7 +91,7 @@ class DatabaseManager:
                 cursor.execute(query)
             self.conn.commit()
         # Schedule backup_to_disk() to run in a separate daemon thread.
-        threading.Thread(target=self.backup_to_disk, daemon=True).start()
+        threading.Thread(target=self.backup_to_disk, daemon=True, name="sqlite-backup").start()
         return cursor
 
     def query(self, query, params=None):
@@ -0,0 +1,63 @@
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from src.database.database import db_manager
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class EnrollmentStore:
+    """
+    Async access to the enrollments table for the aiohttp handlers.
+
+    DatabaseManager is synchronous and guarded by a threading.Lock, so every call is run
+    on a dedicated executor instead of the event loop; a busy database then delays only
+    the requests that need it, not the whole HTTP API.
+    """
+    def __init__(self, manager, max_workers=1):
+        self.manager = manager
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enrollment-store")
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    @staticmethod
+    def _to_enrollment(row):
+        enrollment = dict(row)
+        try:
+            enrollment["subscription_args"] = json.loads(enrollment["subscription_args"]) if enrollment["subscription_args"] else {}
+        except Exception:
+            enrollment["subscription_args"] = {}
+        return enrollment
+
+    async def create(self, enrollment_id, queue, target_url, subscription_args):
+        await self._run(
+            self.manager.execute,
+            "INSERT OR REPLACE INTO enrollments (id, queue, target_url, subscription_args) VALUES (?, ?, ?, ?)",
+            (enrollment_id, queue, target_url, json.dumps(subscription_args))
+        )
+
+    async def get(self, enrollment_id):
+        """Returns the enrollment with decoded subscription_args, or None."""
+        rows = await self._run(self.manager.query, "SELECT * FROM enrollments WHERE id = ?", (enrollment_id,))
+        return self._to_enrollment(rows[0]) if rows else None
+
+    async def list(self):
+        rows = await self._run(self.manager.query, "SELECT * FROM enrollments")
+        return [self._to_enrollment(row) for row in rows]
+
+    async def update(self, enrollment_id, queue, target_url, subscription_args):
+        await self._run(
+            self.manager.execute,
+            "UPDATE enrollments SET queue = ?, target_url = ?, subscription_args = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (queue, target_url, json.dumps(subscription_args), enrollment_id)
+        )
+
+    async def delete(self, enrollment_id):
+        await self._run(self.manager.execute, "DELETE FROM enrollments WHERE id = ?", (enrollment_id,))
+
+# Singleton instance for use by the HTTP handlers.
+enrollment_store = EnrollmentStore(db_manager)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import threading
+from aiohttp import web
+from src.consumerMQ.budget import global_budget, enrollment_budgets
+from src.consumerMQ.subscriptions import active_subscribers
+from src.debug.profiler import stack_sampler, collapsed, MAX_SECONDS, MAX_HZ
+from src.consumerMQ.tracing import trace_exporter
+from src.consumerMQ.compression import compressors
+from src.consumerMQ.scheduler import delivery_scheduler
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+async def handle_budget(request):
+    """
+    GET /debug/budget endpoint.
+    Returns the in-flight memory budget gauges, process-wide and per enrollment.
+    """
+    return web.json_response({
+        "global": global_budget.snapshot(),
+        "enrollments": {
+            enrollment_id: budget.snapshot()
+            for enrollment_id, budget in list(enrollment_budgets.items())
+        }
+    })
+
+async def handle_subscribers(request):
+    """
+    GET /debug/subscribers endpoint.
+    Returns the live state of every running subscriber, keyed by enrollment ID.
+    """
+    return web.json_response({
+        enrollment_id: runner.snapshot()
+        for enrollment_id, runner in list(active_subscribers.items())
+    })
+
+async def handle_subscriber(request):
+    """
+    GET /debug/subscribers/{id} endpoint.
+    Returns the live state of one subscriber.
+    """
+    enrollment_id = request.match_info.get("id")
+    runner = active_subscribers.get(enrollment_id)
+    if runner is None:
+        return web.json_response({"error": "Subscriber not found"}, status=404)
+    return web.json_response(runner.snapshot())
+
+async def handle_profile(request):
+    """
+    GET /debug/profile?seconds=30&hz=100 endpoint.
+    Samples the stacks of every thread for the given time and returns them in collapsed
+    (flamegraph-ready) format, each stack rooted at the enrollment or thread it belongs to.
+    """
+    try:
+        seconds = float(request.query.get("seconds", 30))
+        hz = float(request.query.get("hz", 100))
+    except ValueError:
+        return web.json_response({"error": "seconds and hz must be numbers"}, status=400)
+    if not (0 < seconds <= MAX_SECONDS and 0 < hz <= MAX_HZ):
+        return web.json_response(
+            {"error": f"seconds must be in (0, {MAX_SECONDS}] and hz in (0, {MAX_HZ}]"}, status=400)
+    if stack_sampler.running:
+        return web.json_response({"error": "A profile is already running"}, status=409)
+    loop = asyncio.get_running_loop()
+    thread_names = {threading.get_ident(): "event-loop"}
+    try:
+        # Sampled from a worker thread so the event loop keeps serving (and is profiled too).
+        stacks, samples = await loop.run_in_executor(None, stack_sampler.sample, seconds, hz, thread_names)
+    except RuntimeError as e:
+        return web.json_response({"error": str(e)}, status=409)
+    logger.info("Profile taken: %d sample(s) over %.1fs at %.0f Hz.", samples, seconds, hz)
+    return web.Response(text=collapsed(stacks), content_type="text/plain",
+                        headers={"X-Profile-Samples": str(samples)})
+
+async def handle_traces(request):
+    """
+    GET /debug/traces?enrollment_id=&min_ms=&limit=100 endpoint.
+    Returns the most recent sampled message traces, newest first, optionally only those
+    of one enrollment or slower than min_ms.
+    """
+    try:
+        min_ms = float(request.query.get("min_ms", 0))
+        limit = max(1, int(request.query.get("limit", 100)))
+    except ValueError:
+        return web.json_response({"error": "min_ms and limit must be numbers"}, status=400)
+    return web.json_response(trace_exporter.recent(
+        enrollment_id=request.query.get("enrollment_id"), min_ms=min_ms, limit=limit))
+
+async def handle_compression(request):
+    """
+    GET /debug/compression endpoint.
+    Returns raw versus sent byte counters for every enrollment that compresses its payloads.
+    """
+    return web.json_response({
+        enrollment_id: compressor.snapshot()
+        for enrollment_id, compressor in list(compressors.items())
+    })
+
+async def handle_scheduler(request):
+    """
+    GET /debug/scheduler endpoint.
+    Returns the shared delivery pool's load and, per scheduled enrollment, its weight,
+    priority class, backlog, credit share and queue wait times.
+    """
+    return web.json_response(delivery_scheduler.snapshot())
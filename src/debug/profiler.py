@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Thread name prefixes that carry an enrollment ID: "<prefix>-<enrollment id>[_<n>]".
+ENROLLMENT_THREAD_PREFIXES = ("subscriber-", "deliver-", "spool-")
+
+MAX_SECONDS = 300
+MAX_HZ = 1000
+
+def enrollment_of(thread_name):
+    """Returns the enrollment ID a thread works for, judging by its name, or None."""
+    for prefix in ENROLLMENT_THREAD_PREFIXES:
+        if thread_name.startswith(prefix):
+            enrollment_id = thread_name[len(prefix):]
+            if prefix == "deliver-":
+                # ThreadPoolExecutor appends "_<worker number>".
+                enrollment_id = enrollment_id.rsplit("_", 1)[0]
+            return enrollment_id
+    return None
+
+class StackSampler:
+    """
+    Wall-clock sampling profiler over every thread of the process.
+
+    A single sampling thread wakes hz times a second, reads sys._current_frames() and
+    counts each thread's stack in collapsed form ("root;caller;callee"), the input format
+    of flamegraph.pl and speedscope. The profiled threads are never interrupted or
+    instrumented, so the cost is one stack walk per thread per sample on the sampler.
+    Each stack is rooted at a tag naming what the thread works for: "enrollment=<id>"
+    for subscriber, delivery and spool threads, otherwise the thread's name.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame_labels = {}
+
+    @property
+    def running(self):
+        return self.lock.locked()
+
+    def _label(self, code):
+        label = self.frame_labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.frame_labels[code] = label
+        return label
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ";".join(labels)
+
+    def _thread_tags(self, thread_names):
+        tags = {}
+        for thread in threading.enumerate():
+            name = thread_names.get(thread.ident, thread.name)
+            enrollment_id = enrollment_of(thread.name)
+            if enrollment_id is not None:
+                tags[thread.ident] = f"enrollment={enrollment_id};{name}"
+            else:
+                tags[thread.ident] = name
+        return tags
+
+    def sample(self, seconds, hz, thread_names=None):
+        """
+        Samples all threads for the given duration and returns (stacks, samples) where
+        stacks is a Counter of collapsed stacks. thread_names overrides the names of
+        threads by ident (e.g. to label the event loop thread). Blocks the calling thread;
+        raises RuntimeError if another profile is in progress.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            thread_names = thread_names or {}
+            own_ident = threading.get_ident()
+            interval = 1.0 / hz
+            stacks = Counter()
+            tags = self._thread_tags(thread_names)
+            samples = 0
+            deadline = time.monotonic() + seconds
+            next_sample = time.monotonic()
+            while next_sample < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    tag = tags.get(ident)
+                    if tag is None:
+                        # A thread started during the profile.
+                        tags = self._thread_tags(thread_names)
+                        tag = tags.get(ident, f"thread-{ident}")
+                    stacks[f"{tag};{self._collapse(frame)}"] += 1
+                del frame
+                samples += 1
+                next_sample += interval
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind (e.g. GIL contention); skip the missed ticks instead of bursting.
+                    next_sample = time.monotonic()
+            return stacks, samples
+        finally:
+            self.lock.release()
+
+def collapsed(stacks):
+    """Renders sampled stacks in collapsed format, one "stack count" line each, hottest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+# Process-wide sampler; only one profile runs at a time.
+stack_sampler = StackSampler()
@@ -1,14 +1,84 @@
-import json
 import uuid
 import logging
 from aiohttp import web
-from src.database.database import db_manager
-from src.consumerMQ.subscriptions import start_subscriber_for_enrollment
+from src.database.store import enrollment_store
+from src.consumerMQ.subscriptions import start_subscriber_for_enrollment, update_subscriber_for_enrollment
 from src.callbacks import send_message_callback
+from src.enroll.stream import handle_stream
+from src.debug.debug import handle_budget, handle_subscribers, handle_subscriber, handle_profile, handle_traces, handle_compression, handle_scheduler
+from src.consumerMQ.policy import ResponsePolicy
+from src.consumerMQ.tracing import sample_rate_from_args
+from src.consumerMQ.compression import Compressor
+from src.consumerMQ.transform import compile_transform
+from src.consumerMQ.fanout import validate_fanout
+from src.consumerMQ.scheduler import parse_scheduling_args
+from src.consumerMQ.dedupe import DedupeCache
+from src.consumerMQ.spool import Spool
+from src.consumerMQ.transactions import TransactionBatcher
+from src.consumerMQ.ordering import KeyedDispatcher
+from src.consumerMQ.streaming import StreamChannel
+from src.consumerMQ.subscriber import parse_delivery_args
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def validate_subscription_args(subscription_args):
+    """
+    Checks the parts of subscription_args that are compiled when the subscriber starts.
+    Returns an error message, or None if they are valid.
+    """
+    if not isinstance(subscription_args, dict):
+        return "subscription_args must be an object"
+    try:
+        parse_delivery_args(subscription_args)
+    except ValueError as e:
+        return f"Invalid subscription_args: {e}"
+    try:
+        StreamChannel.validate_args(subscription_args)
+    except ValueError as e:
+        return f"Invalid delivery: {e}"
+    try:
+        DedupeCache.validate_args(subscription_args.get("dedupe"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid dedupe: {e}"
+    try:
+        Spool.validate_args(subscription_args.get("spool"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid spool: {e}"
+    try:
+        TransactionBatcher.from_args(None, subscription_args.get("transaction"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid transaction: {e}"
+    try:
+        KeyedDispatcher.validate_args(subscription_args.get("ordering"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid ordering: {e}"
+    try:
+        ResponsePolicy.from_args(subscription_args.get("policy"))
+    except ValueError as e:
+        return f"Invalid policy: {e}"
+    try:
+        sample_rate_from_args(subscription_args.get("trace"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid trace: {e}"
+    try:
+        Compressor.from_args(None, subscription_args.get("compression"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid compression: {e}"
+    try:
+        compile_transform(subscription_args.get("transform"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid transform: {e}"
+    try:
+        validate_fanout(subscription_args.get("fanout"), subscription_args)
+    except (TypeError, ValueError) as e:
+        return f"Invalid fanout: {e}"
+    try:
+        parse_scheduling_args(subscription_args.get("scheduling"))
+    except (TypeError, ValueError) as e:
+        return f"Invalid scheduling: {e}"
+    return None
+
 async def handle_enroll(request):
     """
     POST /enroll endpoint.
@@ -28,16 +98,17 @@ async def handle_enroll(request):
         if field not in data:
             return web.json_response({"error": f"Missing required field: {field}"}, status=400)
 
+    error = validate_subscription_args(data.get("subscription_args", {}))
+    if error:
+        return web.json_response({"error": error}, status=400)
+
     enrollment_id = str(uuid.uuid4())
     queue = data["queue"]
     target_url = data["target_url"]
-    subscription_args = json.dumps(data.get("subscription_args", {}))
+    subscription_args = data.get("subscription_args", {})
 
     try:
-        db_manager.execute(
-            "INSERT OR REPLACE INTO enrollments (id, queue, target_url, subscription_args) VALUES (?, ?, ?, ?)",
-            (enrollment_id, queue, target_url, subscription_args)
-        )
+        await enrollment_store.create(enrollment_id, queue, target_url, subscription_args)
     except Exception as e:
         logger.error("Error inserting enrollment: %s", e)
         return web.json_response({"error": "Database insertion failed"}, status=500)
@@ -46,7 +117,7 @@ async def handle_enroll(request):
         "id": enrollment_id,
         "queue": queue,
         "target_url": target_url,
-        "subscription_args": json.loads(subscription_args)
+        "subscription_args": subscription_args
     }
     logger.info("Enrollment created: %s", enrollment_id)
     
@@ -63,26 +134,79 @@ async def handle_delete_enrollment(request):
     """
     enrollment_id = request.match_info.get("id")
     try:
-        db_manager.execute("DELETE FROM enrollments WHERE id = ?", (enrollment_id,))
+        await enrollment_store.delete(enrollment_id)
     except Exception as e:
         logger.error("Error deleting enrollment: %s", e)
         return web.json_response({"error": "Failed to delete enrollment"}, status=500)
 
     logger.info("Enrollment deleted: %s", enrollment_id)
     from src.consumerMQ.subscriptions import stop_subscriber_for_enrollment
-    stop_subscriber_for_enrollment(enrollment_id)
+    stop_subscriber_for_enrollment(enrollment_id, discard=True)
     return web.json_response({"message": f"Enrollment {enrollment_id} deleted"}, status=200)
 
+async def handle_patch_enrollment(request):
+    """
+    PATCH /enroll/{id} endpoint.
+    Changes an enrollment without deleting it. Expected JSON payload (all fields optional):
+      {
+        "queue": "chat.test",
+        "target_url": "http://client-service/receive",
+        "subscription_args": { ... }
+      }
+    subscription_args are merged into the existing ones; a key set to null is removed.
+    Target and delivery settings are swapped on the running subscriber without reconnecting.
+    """
+    enrollment_id = request.match_info.get("id")
+    try:
+        data = await request.json()
+    except Exception:
+        return web.json_response({"error": "Invalid JSON payload"}, status=400)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Invalid JSON payload"}, status=400)
+
+    try:
+        current = await enrollment_store.get(enrollment_id)
+    except Exception as e:
+        logger.error("Error fetching enrollment: %s", e)
+        return web.json_response({"error": "Failed to fetch enrollment"}, status=500)
+    if current is None:
+        return web.json_response({"error": f"Enrollment {enrollment_id} not found"}, status=404)
+
+    subscription_args = current["subscription_args"]
+    changes = data.get("subscription_args", {})
+    if not isinstance(changes, dict):
+        return web.json_response({"error": "subscription_args must be an object"}, status=400)
+    for key, value in changes.items():
+        if value is None:
+            subscription_args.pop(key, None)
+        else:
+            subscription_args[key] = value
+    error = validate_subscription_args(subscription_args)
+    if error:
+        return web.json_response({"error": error}, status=400)
+
+    enrollment = {
+        "id": enrollment_id,
+        "queue": data.get("queue", current["queue"]),
+        "target_url": data.get("target_url", current["target_url"]),
+        "subscription_args": subscription_args
+    }
+    try:
+        await enrollment_store.update(enrollment_id, enrollment["queue"], enrollment["target_url"],
+                                      subscription_args)
+    except Exception as e:
+        logger.error("Error updating enrollment: %s", e)
+        return web.json_response({"error": "Database update failed"}, status=500)
+
+    from src.config import load_config
+    config = load_config()
+    in_place = update_subscriber_for_enrollment(config.AMQP_URL, enrollment, send_message_callback)
+    logger.info("Enrollment updated (%s): %s", "in place" if in_place else "restarted", enrollment_id)
+    return web.json_response(enrollment, status=200)
+
 async def handle_list_enrollments(request):
     try:
-        rows = db_manager.query("SELECT * FROM enrollments")
-        enrollments = [dict(row) for row in rows]
-        # Convert subscription_args from JSON string back to dict.
-        for enrollment in enrollments:
-            try:
-                enrollment["subscription_args"] = json.loads(enrollment["subscription_args"]) if enrollment["subscription_args"] else {}
-            except Exception:
-                enrollment["subscription_args"] = {}
+        enrollments = await enrollment_store.list()
         return web.json_response(enrollments)
     except Exception as e:
         logger.error("Error fetching enrollments: %s", e)
@@ -93,6 +217,15 @@ def create_app():
     app.add_routes([
         web.post("/enroll", handle_enroll),
         web.get("/enrollments", handle_list_enrollments),
-        web.delete("/enroll/{id}", handle_delete_enrollment)
+        web.delete("/enroll/{id}", handle_delete_enrollment),
+        web.patch("/enroll/{id}", handle_patch_enrollment),
+        web.get("/stream/{id}", handle_stream),
+        web.get("/debug/budget", handle_budget),
+        web.get("/debug/subscribers", handle_subscribers),
+        web.get("/debug/subscribers/{id}", handle_subscriber),
+        web.get("/debug/profile", handle_profile),
+        web.get("/debug/traces", handle_traces),
+        web.get("/debug/compression", handle_compression),
+        web.get("/debug/scheduler", handle_scheduler)
     ])
     return app
@@ -0,0 +1,65 @@
+import json
+import asyncio
+import logging
+from aiohttp import web, WSMsgType
+from src.consumerMQ.streaming import stream_channels
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+async def _pump(ws, outbox, channel):
+    """
+    Writes queued frames to the WebSocket in the order the subscriber produced them.
+    Payloads that are not JSON (e.g. binary bodies forwarded unparsed) are sent as
+    strings, as the spool stores them; a frame that still cannot be encoded is
+    rejected so the pump keeps going.
+    """
+    while True:
+        frame = await outbox.get()
+        try:
+            data = json.dumps(frame, default=str)
+        except (TypeError, ValueError) as e:
+            logger.error("Stream for client '%s': cannot encode frame %s: %s",
+                         channel.enrollment_id, frame.get("seq"), e)
+            if frame.get("seq") is not None:
+                channel.on_client_frame({"type": "nack", "seq": frame["seq"], "requeue": False})
+            continue
+        await ws.send_str(data)
+
+async def handle_stream(request):
+    """
+    GET /stream/{id} endpoint (WebSocket).
+    Streams messages of an enrollment created with "delivery": "websocket".
+    Server frames:  {"type": "message", "seq": 1, "payload": {...}}
+    Client frames:  {"type": "window", "credit": 10}
+                    {"type": "ack", "seq": 1}
+                    {"type": "nack", "seq": 1, "requeue": true}
+    """
+    enrollment_id = request.match_info.get("id")
+    channel = stream_channels.get(enrollment_id)
+    if channel is None:
+        return web.json_response({"error": "No streaming subscriber for this enrollment"}, status=404)
+
+    outbox = asyncio.Queue()
+    if not channel.attach(asyncio.get_running_loop(), outbox):
+        return web.json_response({"error": "A stream consumer is already connected"}, status=409)
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    sender = None
+    try:
+        await ws.prepare(request)
+        sender = asyncio.create_task(_pump(ws, outbox, channel))
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                try:
+                    channel.on_client_frame(json.loads(msg.data))
+                except (ValueError, KeyError, TypeError) as e:
+                    await ws.send_json({"type": "error", "error": str(e)})
+            elif msg.type == WSMsgType.ERROR:
+                logger.error("Stream for client '%s' closed with error: %s", enrollment_id, ws.exception())
+                break
+    finally:
+        if sender is not None:
+            sender.cancel()
+        channel.detach()
+    return ws
@@ -0,0 +1,159 @@
+import pytest
+from aiohttp.test_utils import TestClient
+from proton import Delivery
+
+from src.enroll.enroll import create_app, validate_subscription_args
+from src.consumerMQ import budget as budget_module
+from src.consumerMQ.budget import MemoryBudget, message_size
+from src.consumerMQ.subscriber import SubscriberHandler, parse_delivery_args
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+        self.settled = False
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyReceiver:
+    def __init__(self):
+        self.credit = 0
+
+    def flow(self, n):
+        self.credit += n
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def test_message_size():
+    assert message_size(DummyMessage("abcd")) == 4
+    assert message_size(DummyMessage(b"ab")) == 2
+    assert message_size(DummyMessage({"a": 1})) == len('{"a": 1}')
+    assert message_size(DummyMessage(None)) == 0
+
+def test_budget_exhaustion_and_listener():
+    budget = MemoryBudget("test", limit_bytes=10)
+    woken = []
+    budget.add_listener(lambda: woken.append(True))
+    budget.reserve(6)
+    assert not budget.exhausted
+    budget.reserve(6)
+    assert budget.exhausted
+    budget.release(6)
+    assert not budget.exhausted
+    assert woken == [True]
+    snapshot = budget.snapshot()
+    assert snapshot["used_bytes"] == 6 and snapshot["peak_bytes"] == 12 and snapshot["messages"] == 1
+
+def test_unlimited_budget_is_never_exhausted():
+    budget = MemoryBudget("test")
+    budget.reserve(10 ** 12)
+    assert not budget.exhausted
+
+def test_parse_delivery_args():
+    assert parse_delivery_args({}) == {"prefetch": 10, "max_inflight_bytes": 0, "timeout": None, "selector": None}
+    parsed = parse_delivery_args({"prefetch": 50, "max_inflight_bytes": "1024"})
+    assert (parsed["prefetch"], parsed["max_inflight_bytes"]) == (50, 1024)
+
+@pytest.mark.parametrize("args", [
+    {"prefetch": "x"},
+    {"prefetch": 0},
+    {"prefetch": True},
+    {"max_inflight_bytes": "x"},
+    {"max_inflight_bytes": -1},
+    {"max_inflight_bytes": [1]},
+])
+def test_bad_delivery_args_are_refused_at_enroll(args):
+    assert validate_subscription_args(args).startswith("Invalid subscription_args")
+
+def test_credit_stops_when_enrollment_budget_is_exhausted():
+    pending = []
+
+    def send(url, payload):
+        return 200
+
+    enrollment = {
+        "id": "enr-budget",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"max_inflight_bytes": 10, "prefetch": 5,
+                              "ordering": {"max_workers": 1}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, send)
+    handler.dispatcher.submit = lambda key, task: pending.append(task) or True
+    handler.receiver = DummyReceiver()
+    handler._replenish_credit()
+    assert handler.receiver.credit == 5
+
+    delivery = DummyDelivery()
+    handler.receiver.credit -= 1
+    handler.on_message(DummyEvent(DummyMessage("x" * 20), delivery))
+    assert handler.budget.exhausted
+    assert handler.receiver.credit == 4  # no top-up while over budget
+
+    pending.pop()()  # the delivery completes and settles
+    assert delivery.status == Delivery.ACCEPTED
+    assert not handler.budget.exhausted
+    assert handler.receiver.credit == 5
+    assert budget_module.global_budget.snapshot()["used_bytes"] == 0
+    handler.close()
+
+def held_handler(enrollment_id, count):
+    """A handler in ordering mode holding count unsettled 1 KB messages."""
+    enrollment = {
+        "id": enrollment_id,
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"ordering": {"max_workers": 1}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, lambda url, payload: 200)
+    handler.dispatcher.submit = lambda key, task: True  # never runs: the deliveries stay unsettled
+    for _ in range(count):
+        handler.on_message(DummyEvent(DummyMessage("x" * 1024), DummyDelivery()))
+    return handler
+
+def test_close_releases_unsettled_bytes_from_global_budget():
+    before = budget_module.global_budget.snapshot()
+    handler = held_handler("enr-close", 5)
+    assert budget_module.global_budget.used_bytes == before["used_bytes"] + 5 * 1024
+    handler.close()
+    after = budget_module.global_budget.snapshot()
+    assert after["used_bytes"] == before["used_bytes"]
+    assert after["messages"] == before["messages"]
+
+def test_disconnect_releases_deliveries_that_can_no_longer_settle():
+    before = budget_module.global_budget.used_bytes
+    handler = held_handler("enr-disconnect", 3)
+    handler.on_disconnected(None)
+    assert handler.budget.used_bytes == 0
+    assert budget_module.global_budget.used_bytes == before
+    assert handler.state.unsettled == 0
+    handler.close()
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_budget_gauges_endpoint(client):
+    resp = await client.get("/debug/budget")
+    assert resp.status == 200
+    data = await resp.json()
+    assert "used_bytes" in data["global"]
+    assert isinstance(data["enrollments"], dict)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
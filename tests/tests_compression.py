@@ -0,0 +1,77 @@
+import gzip
+import json
+import pytest
+import requests
+from aiohttp.test_utils import TestClient
+
+from src.enroll.enroll import create_app
+from src.callbacks import send_message_callback
+from src.consumerMQ import compression as compression_module
+from src.consumerMQ.compression import Compressor, compressors
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+def test_small_payloads_are_sent_raw():
+    compressor = Compressor("enr-1", min_bytes=1024)
+    body, headers = compressor.encode({"k": "v"})
+    assert json.loads(body) == {"k": "v"}
+    assert "Content-Encoding" not in headers
+    assert compressor.snapshot()["compressed_messages"] == 0
+
+def test_large_payloads_are_gzipped_and_counted():
+    compressor = Compressor.from_args("enr-1", {"encoding": "gzip", "min_bytes": 100, "level": 9})
+    payload = {"text": "hot potato " * 500}
+    body, headers = compressor.encode(payload)
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == payload
+    snapshot = compressor.snapshot()
+    assert snapshot["compressed_messages"] == 1
+    assert snapshot["sent_bytes"] == len(body) < snapshot["raw_bytes"]
+
+def test_zstd_falls_back_to_gzip_when_unavailable(monkeypatch):
+    monkeypatch.setattr(compression_module, "zstandard", None)
+    assert Compressor.from_args("enr-1", "zstd").encoding == "gzip"
+
+def test_invalid_settings_are_refused():
+    assert Compressor.from_args("enr-1", None) is None
+    with pytest.raises(ValueError):
+        Compressor.from_args("enr-1", "brotli")
+    with pytest.raises(ValueError):
+        Compressor.from_args("enr-1", {"encoding": "gzip", "level": 12})
+
+def test_callback_posts_compressed_body(monkeypatch):
+    sent = {}
+
+    def fake_post(url, data, timeout, headers):
+        sent.update(data=data, headers=headers)
+        return FakeResponse(200)
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    compressor = Compressor("enr-1", min_bytes=0)
+    status = send_message_callback("http://dummy-url", {"k": "v"}, compressor=compressor,
+                                   headers={"traceparent": "x"})
+    assert status == 200
+    assert sent["headers"]["Content-Encoding"] == "gzip"
+    assert sent["headers"]["traceparent"] == "x"
+    assert json.loads(gzip.decompress(sent["data"])) == {"k": "v"}
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_compression_counters_endpoint(client):
+    compressors["enr-gauge"] = Compressor("enr-gauge")
+    try:
+        resp = await client.get("/debug/compression")
+        assert resp.status == 200
+        assert (await resp.json())["enr-gauge"]["encoding"] == "gzip"
+    finally:
+        compressors.pop("enr-gauge", None)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import pytest
+from proton import Delivery
+from src.consumerMQ import dedupe as dedupe_module
+from src.consumerMQ import subscriptions
+from src.consumerMQ.dedupe import DedupeCache, message_key
+from src.consumerMQ.subscriber import SubscriberHandler
+from src.enroll.enroll import validate_subscription_args
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+        self.settled = False
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyMessage:
+    def __init__(self, body, id=None, properties=None):
+        self.body = body
+        self.id = id
+        self.properties = properties or {}
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def test_message_key_variants():
+    message = DummyMessage('{"a": 1}', id="abc", properties={"order": 7})
+    assert message_key(message, "message_id") == "abc"
+    assert message_key(message, "property:order") == "7"
+    assert message_key(message, "property:missing") is None
+    assert message_key(message, "body_hash") == message_key(DummyMessage('{"a": 1}'), "body_hash")
+    with pytest.raises(ValueError):
+        message_key(message, "nope")
+
+def test_cache_is_bounded_lru():
+    cache = DedupeCache(max_entries=2)
+    cache.add("a")
+    cache.add("b")
+    assert cache.seen("a")  # refreshes "a", so "b" is now least recently used
+    cache.add("c")
+    assert len(cache) == 2
+    assert cache.seen("a")
+    assert not cache.seen("b")
+    assert cache.seen("c")
+
+def test_cache_entries_expire():
+    cache = DedupeCache(ttl_seconds=0)
+    cache.add("a")
+    assert not cache.seen("a")
+
+def test_evicted_keys_spill_to_disk(tmp_path):
+    path = str(tmp_path / "dedupe.sqlite")
+    cache = DedupeCache(max_entries=1, spill_path=path)
+    cache.add("a")
+    cache.add("b")
+    assert cache.seen("a")
+    cache.close()
+
+    reopened = DedupeCache(max_entries=1, spill_path=path)
+    assert reopened.seen("a")
+    assert reopened.seen("b")
+    reopened.close()
+
+def test_recent_keys_survive_a_crash(tmp_path):
+    path = str(tmp_path / "dedupe.sqlite")
+    cache = DedupeCache(max_entries=100, spill_path=path)
+    cache.add("a")
+    # No close(): another process opening the file sees the key straight away.
+    survivor = DedupeCache(max_entries=100, spill_path=path)
+    assert survivor.seen("a")
+    survivor.close()
+    cache.close()
+
+def test_spill_file_is_removed_with_the_enrollment(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe_module, "DEDUPE_DIR", str(tmp_path))
+    enrollment = {"id": "enr-gone", "target_url": "http://example.com/api", "queue": "chat.test",
+                  "subscription_args": {"dedupe": {"spill": True}}}
+    runner = subscriptions.start_subscriber_for_enrollment("amqp://127.0.0.1:1", enrollment, None)
+    deadline = time.time() + 5
+    while runner.handler is None and time.time() < deadline:
+        time.sleep(0.05)
+    assert os.path.exists(tmp_path / "enr-gone.sqlite")
+    subscriptions.stop_subscriber_for_enrollment("enr-gone", wait=True, discard=True)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("enr-gone")]
+
+def test_from_args_disabled_by_default():
+    assert DedupeCache.from_args("id-1", None) is None
+    assert DedupeCache.from_args("id-1", {"enabled": False}) is None
+    assert DedupeCache.from_args("id-1", True).key == "message_id"
+
+def test_unknown_key_is_refused_up_front():
+    with pytest.raises(ValueError):
+        DedupeCache.from_args("id-1", {"key": "msgid"})
+    assert validate_subscription_args({"dedupe": {"key": "property:tenant"}}) is None
+    assert validate_subscription_args({"dedupe": {"key": "msgid"}}).startswith("Invalid dedupe")
+
+def test_other_modes_are_validated_at_enroll_time():
+    assert validate_subscription_args({"spool": {"fsync": "sometimes"}}).startswith("Invalid spool")
+    assert validate_subscription_args({"spool": "yes"}).startswith("Invalid spool")
+    assert validate_subscription_args({"spool": {"max_attempts": 0}}).startswith("Invalid spool")
+    assert validate_subscription_args({"transaction": {"batch_size": "many"}}).startswith("Invalid transaction")
+    assert validate_subscription_args({"ordering": {"key": "tenant"}}).startswith("Invalid ordering")
+    assert validate_subscription_args({"spool": True, "transaction": True, "ordering": True}) is None
+
+def test_on_message_skips_delivery_of_duplicates():
+    calls = []
+
+    def fake_send(url, payload):
+        calls.append(payload)
+        return 200
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": json.dumps({"dedupe": {"key": "message_id"}}),
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send)
+    for _ in range(3):
+        delivery = DummyDelivery()
+        handler.on_message(DummyEvent(DummyMessage('{"k": 1}', id="m-1"), delivery))
+        assert delivery.status == Delivery.ACCEPTED
+        assert delivery.settled
+    assert calls == [{"k": 1}]
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -54,6 +54,50 @@ async def test_post_enroll_missing_field(client):
     assert "error" in data
     assert "target_url" in data["error"]
 
+@pytest.mark.asyncio
+async def test_post_enroll_invalid_policy(client):
+    payload = {
+        "queue": "chat.test",
+        "target_url": "http://example.com/api",
+        "subscription_args": {"policy": {"status": {"404": "drop"}}}
+    }
+    resp = await client.post("/enroll", json=payload)
+    assert resp.status == 400
+    data = await resp.json()
+    assert "policy" in data["error"]
+
+@pytest.mark.asyncio
+async def test_patch_enrollment_updates_in_place(client, monkeypatch):
+    import src.enroll.enroll as enroll
+    updates = []
+    monkeypatch.setattr(enroll, "update_subscriber_for_enrollment",
+                        lambda amqp_url, enrollment, callback: updates.append(enrollment) or True)
+    payload = {
+        "queue": "chat.test",
+        "target_url": "http://example.com/api",
+        "subscription_args": {"durable": True, "timeout": 30}
+    }
+    post_resp = await client.post("/enroll", json=payload)
+    enrollment_id = (await post_resp.json())["id"]
+
+    patch = {"target_url": "http://example.com/v2", "subscription_args": {"timeout": 5, "durable": None}}
+    resp = await client.patch(f"/enroll/{enrollment_id}", json=patch)
+    assert resp.status == 200
+    data = await resp.json()
+    assert data["id"] == enrollment_id
+    assert data["target_url"] == "http://example.com/v2"
+    assert data["subscription_args"] == {"timeout": 5}
+    assert updates == [data]
+
+    enrollments = await (await client.get("/enrollments")).json()
+    assert enrollments[0]["target_url"] == "http://example.com/v2"
+    assert enrollments[0]["subscription_args"] == {"timeout": 5}
+
+@pytest.mark.asyncio
+async def test_patch_nonexistent_enrollment(client):
+    resp = await client.patch("/enroll/nonexistent-id", json={"target_url": "http://x"})
+    assert resp.status == 404
+
 @pytest.mark.asyncio
 async def test_get_enrollments(client):
     # Create an enrollment first.
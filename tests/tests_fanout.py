@@ -0,0 +1,155 @@
+import threading
+import pytest
+
+from src.consumerMQ import fanout as fanout_module
+from src.consumerMQ import subscriptions
+from src.consumerMQ.fanout import FanoutGroup, fanout_args, validate_fanout
+from src.enroll.enroll import validate_subscription_args
+from src.consumerMQ.subscriber import requires_restart
+
+class FakeRunner:
+    def __init__(self, amqp_url, enrollment, send_message_callback):
+        self.enrollment = enrollment
+        self.send_message_callback = send_message_callback
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def update(self, enrollment):
+        if requires_restart(self.enrollment, enrollment):
+            return False
+        self.enrollment = enrollment
+        return True
+
+    def stop(self, discard=False):
+        self.stopped = True
+
+    def join(self, timeout=None):
+        return self.stopped
+
+    def snapshot(self):
+        return {"enrollment_id": self.enrollment["id"]}
+
+@pytest.fixture(autouse=True)
+def fake_runner(monkeypatch):
+    monkeypatch.setattr(fanout_module, "SubscriberRunner", FakeRunner)
+    monkeypatch.setattr(subscriptions, "SubscriberRunner", FakeRunner)
+    yield
+    subscriptions.active_subscribers.clear()
+    subscriptions.fanout_groups.clear()
+    subscriptions.fanout_members.clear()
+
+def member(enrollment_id, target_url, **fanout):
+    return {"id": enrollment_id, "queue": "orders", "target_url": target_url,
+            "subscription_args": {"fanout": fanout or True}}
+
+def make_group(statuses, **fanout):
+    """Builds a group whose targets answer with the given status (None raises)."""
+    calls = []
+    lock = threading.Lock()
+
+    def callback(target_url, payload, **options):
+        with lock:
+            calls.append((target_url, payload))
+        if statuses[target_url] is None:
+            raise ConnectionError("refused")
+        return statuses[target_url]
+
+    group = FanoutGroup("amqp://broker", "orders", callback)
+    for index, target_url in enumerate(statuses):
+        group.join(member(f"enr-{index}", target_url, **fanout))
+    return group, calls
+
+def test_fanout_args():
+    assert fanout_args({"subscription_args": {}}) is None
+    assert fanout_args({"subscription_args": '{"fanout": true}'}) == {}
+    assert fanout_args({"subscription_args": {"fanout": {"enabled": False}}}) is None
+
+def test_posts_once_to_every_member():
+    group, calls = make_group({"http://a": 200, "http://b": 204, "http://c": 200})
+    assert group(None, {"k": "v"}) == 200
+    assert sorted(target for target, _ in calls) == ["http://a", "http://b", "http://c"]
+    assert all(payload == {"k": "v"} for _, payload in calls)
+
+def test_all_policy_reports_first_failure():
+    group, _ = make_group({"http://a": 200, "http://b": 503, "http://c": None})
+    assert group(None, {}) == 503
+
+def test_any_policy():
+    group, _ = make_group({"http://a": 500, "http://b": None, "http://c": 200}, policy="any")
+    assert group(None, {}) == 200
+    group, _ = make_group({"http://a": 500, "http://b": None}, policy="any")
+    assert group(None, {}) == 500
+
+def test_quorum_policy_defaults_to_majority():
+    group, _ = make_group({"http://a": 200, "http://b": 200, "http://c": 500}, policy="quorum")
+    assert group(None, {}) == 200
+    group, _ = make_group({"http://a": 200, "http://b": None, "http://c": None}, policy="quorum")
+    assert group(None, {}) == 500
+    group, _ = make_group({"http://a": 200, "http://b": 500, "http://c": 500}, policy="quorum", quorum=1)
+    assert group(None, {}) == 200
+
+def test_enrollments_sharing_a_queue_share_one_receiver():
+    first = subscriptions.start_subscriber_for_enrollment("amqp://broker", member("enr-1", "http://a"), None)
+    second = subscriptions.start_subscriber_for_enrollment("amqp://broker", member("enr-2", "http://b"), None)
+    assert first is second
+    assert first.runner.started
+    assert set(subscriptions.active_subscribers) == {"fanout-orders"}
+    assert subscriptions.active_subscribers["fanout-orders"].snapshot()["fanout"]["members"] == ["enr-1", "enr-2"]
+
+    subscriptions.stop_subscriber_for_enrollment("enr-1")
+    assert not first.runner.stopped
+    subscriptions.stop_subscriber_for_enrollment("enr-2")
+    assert first.runner.stopped
+    assert not subscriptions.fanout_groups and not subscriptions.active_subscribers
+
+def test_switching_fanout_off_restarts_as_own_subscriber():
+    subscriptions.start_subscriber_for_enrollment("amqp://broker", member("enr-1", "http://a"), None)
+    plain = {"id": "enr-1", "queue": "orders", "target_url": "http://a", "subscription_args": {}}
+    assert subscriptions.update_subscriber_for_enrollment("amqp://broker", plain, None) is False
+    assert isinstance(subscriptions.active_subscribers["enr-1"], FakeRunner)
+    assert not subscriptions.fanout_groups
+
+def test_group_receiver_restarts_when_update_needs_it():
+    group = subscriptions.start_subscriber_for_enrollment("amqp://broker", member("enr-1", "http://a"), None)
+    first_runner = group.runner
+    assert subscriptions.update_subscriber_for_enrollment(
+        "amqp://broker", member("enr-1", "http://a", prefetch=50), None)
+    assert group.runner is first_runner
+    assert first_runner.enrollment["subscription_args"] == {"prefetch": 50}
+
+    assert not subscriptions.update_subscriber_for_enrollment(
+        "amqp://broker", member("enr-1", "http://a", scheduling=True), None)
+    assert first_runner.stopped
+    assert group.runner is not first_runner and group.runner.started
+    assert group.runner.enrollment["subscription_args"] == {"scheduling": True}
+
+def test_validation():
+    validate_fanout({"policy": "quorum", "quorum": 2})
+    with pytest.raises(ValueError):
+        validate_fanout({"policy": "most"})
+    with pytest.raises(ValueError):
+        validate_fanout("yes")
+    assert validate_subscription_args({"fanout": {"quorum": 0}}).startswith("Invalid fanout")
+    assert validate_subscription_args({"fanout": {"prefetch": "x"}}).startswith("Invalid fanout")
+    assert validate_subscription_args({"fanout": {"scheduling": {"weight": 0}}}).startswith("Invalid fanout")
+
+@pytest.mark.parametrize("args", [
+    {"transform": {"where": "a"}},
+    {"compression": "gzip"},
+    {"policy": {"status": {"404": "reject"}}},
+    {"dedupe": True},
+    {"spool": True},
+    {"delivery": "websocket"},
+    {"prefetch": 50},
+])
+def test_member_options_the_group_would_drop_are_refused(args):
+    error = validate_subscription_args(dict(args, fanout=True))
+    assert error.startswith("Invalid fanout")
+    assert next(iter(args)) in error
+
+def test_member_options_the_group_honours_are_accepted():
+    assert validate_subscription_args({"fanout": {"prefetch": 50}, "timeout": 5, "delivery": "http",
+                                       "dedupe": False}) is None
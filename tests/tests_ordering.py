@@ -0,0 +1,161 @@
+import time
+import threading
+import pytest
+from proton import Delivery
+from src.consumerMQ.ordering import KeyedDispatcher, group_key
+from src.consumerMQ.subscriber import SubscriberHandler, requires_restart
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+        self.settled = False
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyMessage:
+    def __init__(self, body, group_id=None, properties=None):
+        self.body = body
+        self.group_id = group_id
+        self.properties = properties or {}
+
+class DummyReceiver:
+    def __init__(self):
+        self.credit = 0
+
+    def flow(self, credit):
+        self.credit += credit
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_group_key_variants():
+    assert group_key(DummyMessage("x", group_id="g1")) == "g1"
+    assert group_key(DummyMessage("x", properties={"JMSXGroupID": "g2"})) == "g2"
+    assert group_key(DummyMessage("x", properties={"tenant": 5}), "property:tenant") == "5"
+    assert group_key(DummyMessage("x")) is None
+
+def test_same_key_is_serialized_and_keys_run_in_parallel():
+    dispatcher = KeyedDispatcher("enr-1", max_workers=4)
+    order = []
+    running = {"a": 0, "b": 0}
+    overlap = threading.Event()
+    lock = threading.Lock()
+
+    def task(key, i):
+        def run():
+            with lock:
+                running[key] += 1
+                assert running[key] == 1
+                if running["a"] and running["b"]:
+                    overlap.set()
+            time.sleep(0.02)
+            with lock:
+                order.append((key, i))
+                running[key] -= 1
+        return run
+
+    for i in range(5):
+        assert dispatcher.submit("a", task("a", i))
+        assert dispatcher.submit("b", task("b", i))
+    assert wait_for(lambda: len(order) == 10)
+    assert [i for key, i in order if key == "a"] == list(range(5))
+    assert [i for key, i in order if key == "b"] == list(range(5))
+    assert overlap.is_set()
+    assert dispatcher.active_keys() == 0
+    dispatcher.close()
+
+def test_bounds_on_active_keys_and_backlog():
+    dispatcher = KeyedDispatcher("enr-1", max_workers=1, max_active_keys=2, max_key_backlog=2)
+    release = threading.Event()
+    assert dispatcher.submit("a", release.wait)
+    assert dispatcher.submit("a", lambda: None)
+    assert not dispatcher.submit("a", lambda: None)  # backlog of "a" is full
+    assert dispatcher.submit("b", lambda: None)
+    assert not dispatcher.submit("c", lambda: None)  # too many active keys
+    release.set()
+    assert wait_for(lambda: dispatcher.active_keys() == 0)
+    dispatcher.close()
+
+def test_on_message_delivers_through_dispatcher():
+    def fake_send(url, payload):
+        return 200
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"ordering": {"max_workers": 2}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}', group_id="g1"), delivery))
+    assert wait_for(lambda: delivery.settled)
+    assert delivery.status == Delivery.ACCEPTED
+    handler.close()
+
+def test_full_backlog_parks_messages_in_order():
+    gate = threading.Event()
+    posted = []
+
+    def fake_send(url, payload):
+        if payload["k"] == 1:
+            gate.wait(5)
+        posted.append(payload["k"])
+        return 200
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"ordering": {"max_key_backlog": 1}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send)
+    deliveries = [DummyDelivery() for _ in range(3)]
+    for k, delivery in enumerate(deliveries, 1):
+        handler.on_message(DummyEvent(DummyMessage(f'{{"k": {k}}}', group_id="g1"), delivery))
+    assert len(handler.parked) == 2
+    assert not any(delivery.settled for delivery in deliveries)
+    handler.receiver = DummyReceiver()
+    handler._replenish_credit()
+    assert handler.receiver.credit == 0  # no credit while messages are parked
+    gate.set()
+    assert wait_for(lambda: all(delivery.settled for delivery in deliveries))
+    assert posted == [1, 2, 3]
+    assert all(delivery.status == Delivery.ACCEPTED for delivery in deliveries)
+    assert not handler.parked
+    assert handler.receiver.credit == handler.prefetch
+    handler.close()
+
+def test_changing_the_ordering_key_needs_a_restart():
+    def enrollment(ordering):
+        return {"id": "enr-1", "queue": "q", "subscription_args": {"ordering": ordering}}
+    assert not requires_restart(enrollment(True), enrollment({"key": "group_id", "max_workers": 4}))
+    assert not requires_restart(enrollment({"key": "property:tenant"}),
+                                enrollment({"key": "property:tenant", "max_key_backlog": 5}))
+    assert requires_restart(enrollment(True), enrollment({"key": "property:tenant"}))
+    assert requires_restart(enrollment({"key": "property:a"}), enrollment({"key": "property:b"}))
+
+def test_reconfigure_keeps_the_key():
+    dispatcher = KeyedDispatcher("enr-1", key="property:tenant")
+    dispatcher.reconfigure({"key": "group_id", "max_key_backlog": 5})
+    assert dispatcher.key == "property:tenant"
+    assert dispatcher.max_key_backlog == 5
+    dispatcher.close()
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,118 @@
+import pytest
+import requests
+from proton import Delivery
+from src.consumerMQ.policy import ResponsePolicy, ACCEPT, RETRY, UNDELIVERABLE, REJECT
+from src.consumerMQ.subscriber import SubscriberHandler
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyLocalState:
+    type = None
+    failed = False
+    undeliverable = False
+
+class DummyDelivery:
+    MODIFIED = Delivery.MODIFIED
+
+    def __init__(self):
+        self.status = None
+        self.settled = False
+        self.local = DummyLocalState()
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def make_handler(policy, send):
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"policy": policy},
+    }
+    return SubscriberHandler(sibimq_url, enrollment, send)
+
+def test_default_policy_keeps_historical_behaviour():
+    policy = ResponsePolicy()
+    assert policy.classify_status(204) == ACCEPT
+    assert policy.classify_status(404) == RETRY
+    assert policy.classify_error(ValueError()) == RETRY
+    assert not policy.classifies_errors
+
+def test_exact_codes_win_over_classes():
+    policy = ResponsePolicy.from_args({"status": {"4xx": "undeliverable", "429": "retry", "404": "reject"}})
+    assert policy.classify_status(404) == REJECT
+    assert policy.classify_status(429) == RETRY
+    assert policy.classify_status(422) == UNDELIVERABLE
+    assert policy.classify_status(500) == RETRY
+
+def test_error_rules_match_exception_hierarchy():
+    policy = ResponsePolicy.from_args({"errors": {"ConnectionError": "retry", "default": "reject"}})
+    assert policy.classifies_errors
+    assert policy.classify_error(requests.exceptions.ConnectTimeout()) == RETRY
+    assert policy.classify_error(KeyError()) == REJECT
+
+@pytest.mark.parametrize("policy", [
+    {"status": {"404": "drop"}},
+    {"status": {"40": "reject"}},
+    {"parse_error": "ignore"},
+    {"status": ["404"]},
+    {"errors": "x"},
+])
+def test_invalid_policies_are_refused(policy):
+    with pytest.raises(ValueError):
+        ResponsePolicy.from_args(policy)
+
+def test_permanent_status_is_dead_lettered():
+    handler = make_handler({"status": {"422": "reject"}}, lambda url, payload: 422)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    assert delivery.status == Delivery.REJECTED
+
+def test_undeliverable_outcome_sets_flag():
+    handler = make_handler({"status": {"4xx": "undeliverable"}}, lambda url, payload: 400)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    assert delivery.status == Delivery.MODIFIED
+    assert delivery.local.failed and delivery.local.undeliverable
+
+def test_parse_failure_fast_path_skips_delivery():
+    calls = []
+
+    def send(url, payload):
+        calls.append(payload)
+        return 200
+
+    handler = make_handler({"parse_error": "reject"}, send)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage("not a valid json"), delivery))
+    assert delivery.status == Delivery.REJECTED
+    assert calls == []
+
+def test_errors_are_raised_to_the_policy_when_rules_exist():
+    seen_options = []
+
+    def send(url, payload, **options):
+        seen_options.append(options)
+        raise requests.exceptions.ReadTimeout()
+
+    handler = make_handler({"errors": {"Timeout": "undeliverable"}}, send)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    assert seen_options == [{"raise_errors": True}]
+    assert delivery.local.undeliverable
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,61 @@
+import threading
+import pytest
+from aiohttp.test_utils import TestClient
+
+from src.enroll.enroll import create_app
+from src.debug.profiler import StackSampler, enrollment_of, collapsed
+
+def test_enrollment_of_thread_names():
+    assert enrollment_of("subscriber-enr-1") == "enr-1"
+    assert enrollment_of("deliver-enr-1_3") == "enr-1"
+    assert enrollment_of("spool-enr_2") == "enr_2"
+    assert enrollment_of("MainThread") is None
+
+def busy_wait(stop):
+    while not stop.is_set():
+        stop.wait(0.001)
+
+def test_sampler_tags_stacks_by_enrollment():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_wait, args=(stop,), name="subscriber-enr-prof", daemon=True)
+    worker.start()
+    try:
+        stacks, samples = StackSampler().sample(0.2, 50)
+    finally:
+        stop.set()
+        worker.join()
+    assert samples > 0
+    tagged = [stack for stack in stacks if stack.startswith("enrollment=enr-prof;subscriber-enr-prof;")]
+    assert tagged and any("busy_wait" in stack for stack in tagged)
+    line = collapsed(stacks).splitlines()[0]
+    assert int(line.rsplit(" ", 1)[1]) > 0
+
+def test_only_one_profile_at_a_time():
+    sampler = StackSampler()
+    sampler.lock.acquire()
+    with pytest.raises(RuntimeError):
+        sampler.sample(0.1, 10)
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_profile_endpoint(client):
+    resp = await client.get("/debug/profile?seconds=0.2&hz=50")
+    assert resp.status == 200
+    assert int(resp.headers["X-Profile-Samples"]) > 0
+    text = await resp.text()
+    assert any(line.startswith("event-loop;") for line in text.splitlines())
+
+@pytest.mark.asyncio
+async def test_profile_endpoint_validates_parameters(client):
+    resp = await client.get("/debug/profile?seconds=0&hz=50")
+    assert resp.status == 400
+    resp = await client.get("/debug/profile?hz=fast")
+    assert resp.status == 400
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,178 @@
+import time
+import threading
+import pytest
+from proton import Delivery
+from src.consumerMQ import scheduler as scheduler_module
+from src.consumerMQ.scheduler import DeliveryScheduler, ScheduledFlow, parse_scheduling_args
+from src.consumerMQ.ordering import KeyedDispatcher
+from src.consumerMQ.subscriber import SubscriberHandler, requires_restart
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+        self.settled = False
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+        self.group_id = None
+        self.properties = {}
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeliveryScheduler(workers=1, credit_per_worker=8)
+    yield scheduler
+    scheduler.close()
+
+def hold_worker(scheduler):
+    """Occupies the single worker until the returned event is set."""
+    gate = threading.Event()
+    started = threading.Event()
+    flow = scheduler.register("gate", priority="critical")
+
+    def block():
+        started.set()
+        gate.wait()
+    flow.submit(block)
+    assert started.wait(5)
+    return gate
+
+def run_all(scheduler, flows, count):
+    order = []
+    gate = hold_worker(scheduler)
+    for _ in range(count):
+        for flow in flows:
+            flow.submit(order.append, flow.enrollment_id)
+    gate.set()
+    assert wait_for(lambda: len(order) == count * len(flows))
+    return order
+
+def test_parse_scheduling_args():
+    assert parse_scheduling_args(None) is None
+    assert parse_scheduling_args(True) == (1.0, "standard")
+    assert parse_scheduling_args({"weight": 4, "priority": "critical"}) == (4.0, "critical")
+    assert parse_scheduling_args({"enabled": False}) is None
+    with pytest.raises(ValueError):
+        parse_scheduling_args({"weight": 0})
+    with pytest.raises(ValueError):
+        parse_scheduling_args({"priority": "urgent"})
+    for weight in ("inf", "nan", 1e400):
+        with pytest.raises(ValueError):
+            parse_scheduling_args({"weight": weight})
+
+def test_backlogged_enrollments_share_workers_by_weight(scheduler):
+    heavy = scheduler.register("heavy", weight=3)
+    light = scheduler.register("light", weight=1)
+    order = run_all(scheduler, [heavy, light], 8)
+    assert order[:8].count("heavy") == 6
+    assert order[:8].count("light") == 2
+
+def test_fractional_weights_save_up_turns(scheduler):
+    full = scheduler.register("full", weight=1)
+    half = scheduler.register("half", weight=0.5)
+    order = run_all(scheduler, [full, half], 6)
+    assert order[:6].count("full") == 4
+
+def test_higher_priority_class_is_served_first(scheduler):
+    bulk = scheduler.register("bulk", weight=10, priority="bulk")
+    critical = scheduler.register("critical", weight=1, priority="critical")
+    order = run_all(scheduler, [bulk, critical], 3)
+    assert order[:3] == ["critical"] * 3
+
+def test_credit_is_split_by_weight():
+    scheduler = DeliveryScheduler(workers=2, credit_per_worker=4)
+    first = scheduler.register("first", weight=3)
+    second = scheduler.register("second", weight=1)
+    assert (first.credit(), second.credit()) == (6, 2)
+    second.shutdown()
+    assert first.credit() == 8
+    scheduler.close()
+
+def test_queue_wait_is_recorded(scheduler):
+    flow = scheduler.register("enr-1")
+    gate = hold_worker(scheduler)
+    flow.submit(lambda: None)
+    time.sleep(0.05)
+    gate.set()
+    assert wait_for(lambda: scheduler.snapshot()["enrollments"]["enr-1"]["completed"] == 1)
+    wait_ms = scheduler.snapshot()["enrollments"]["enr-1"]["wait_ms"]
+    assert wait_ms["max"] >= 40
+    assert wait_ms["p50"] == wait_ms["max"]
+
+def test_shutdown_drops_queued_tasks(scheduler):
+    flow = scheduler.register("enr-1")
+    ran = []
+    gate = hold_worker(scheduler)
+    flow.submit(ran.append, 1)
+    flow.shutdown()
+    gate.set()
+    with pytest.raises(RuntimeError):
+        flow.submit(ran.append, 2)
+    time.sleep(0.05)
+    assert ran == []
+    assert "enr-1" not in scheduler.snapshot()["enrollments"]
+
+def test_keyed_dispatcher_runs_on_the_flow(scheduler):
+    flow = scheduler.register("enr-1")
+    dispatcher = KeyedDispatcher("enr-1", executor=flow)
+    order = []
+    for i in range(5):
+        assert dispatcher.submit("a", lambda i=i: order.append(i))
+    assert wait_for(lambda: len(order) == 5)
+    assert order == list(range(5))
+    assert scheduler.snapshot()["enrollments"]["enr-1"]["completed"] == 5
+    dispatcher.close()
+
+def test_on_message_delivers_through_scheduler(monkeypatch, scheduler):
+    monkeypatch.setattr(scheduler_module, "delivery_scheduler", scheduler)
+    threads = []
+
+    def fake_send(url, payload):
+        threads.append(threading.current_thread().name)
+        return 200
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"scheduling": {"weight": 2}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send)
+    assert isinstance(handler.flow, ScheduledFlow)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    assert wait_for(lambda: delivery.settled)
+    assert delivery.status == Delivery.ACCEPTED
+    assert threads == ["scheduler-0"]
+    handler.close()
+    assert "enr-1" not in scheduler.snapshot()["enrollments"]
+
+def test_toggling_scheduling_needs_a_restart():
+    plain = {"id": "enr-1", "queue": "q", "subscription_args": {}}
+    scheduled = {"id": "enr-1", "queue": "q", "subscription_args": {"scheduling": {"weight": 2}}}
+    reweighted = {"id": "enr-1", "queue": "q", "subscription_args": {"scheduling": {"weight": 5}}}
+    assert requires_restart(plain, scheduled)
+    assert not requires_restart(scheduled, reweighted)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,246 @@
+import json
+import time
+import pytest
+from proton import Delivery
+from src.consumerMQ.spool import Spool, SpoolDrainer, encode_record, decode_record
+from src.consumerMQ.subscriber import SubscriberHandler
+from src.consumerMQ import subscriptions
+from src.consumerMQ.policy import ResponsePolicy
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+        self.settled = False
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def test_append_read_commit_in_order(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    for i in range(3):
+        assert spool.append(f"record-{i}".encode())
+    for i in range(3):
+        position, payload = spool.next_record(timeout=0)
+        assert bytes(payload) == f"record-{i}".encode()
+        spool.commit(position)
+    assert spool.next_record(timeout=0) is None
+    spool.close()
+
+def test_uncommitted_records_survive_reopen(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096, fsync="always")
+    spool.append(b"first")
+    spool.append(b"second")
+    position, _ = spool.next_record(timeout=0)
+    spool.commit(position)
+    spool.close()
+
+    reopened = Spool(str(tmp_path), segment_bytes=4096)
+    _, payload = reopened.next_record(timeout=0)
+    assert bytes(payload) == b"second"
+    assert reopened.append(b"third")
+    reopened.close()
+
+def test_rolls_segments_and_enforces_size_cap(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=128)
+    record = b"x" * 40
+    assert spool.append(record)
+    assert spool.append(record)      # rolls into the second segment
+    assert not spool.append(record)  # a third segment would exceed max_bytes
+
+    position, _ = spool.next_record(timeout=0)
+    spool.commit(position)
+    position, _ = spool.next_record(timeout=0)  # drops the consumed first segment
+    spool.commit(position)
+    assert spool.append(record)
+    spool.close()
+
+def test_spool_smaller_than_a_segment_is_reused_once_drained(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=64)
+    record = b"x" * 20
+    assert spool.append(record)
+    assert spool.append(record)
+    assert not spool.append(record)  # would exceed max_bytes
+    for _ in range(2):
+        position, _ = spool.next_record(timeout=0)
+        spool.commit(position)
+    assert spool.append(record)      # rolls over the drained segment
+    position, payload = spool.next_record(timeout=0)
+    assert bytes(payload) == record
+    spool.close()
+
+def test_max_bytes_caps_pending_bytes_within_a_segment(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096, max_bytes=100)
+    assert spool.append(b"x" * 40)
+    assert spool.append(b"x" * 40)
+    assert not spool.append(b"x" * 40)
+    spool.close()
+
+def test_oversized_record_is_refused(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64)
+    assert not spool.append(b"x" * 64)
+    spool.close()
+
+def test_drainer_retries_until_target_accepts(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    statuses = [503, 200]
+    delivered = []
+
+    def fake_send(url, payload):
+        delivered.append(payload)
+        return statuses.pop(0) if statuses else 200
+
+    drainer = SpoolDrainer(spool, {"id": "enr-1", "target_url": "http://example.com"}, fake_send)
+    drainer.start()
+    spool.append(json.dumps({"k": 1}).encode())
+    deadline = time.time() + 5
+    while len(delivered) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    drainer.stop()
+    assert delivered == [{"k": 1}, {"k": 1}]
+    assert spool.next_record(timeout=0) is None
+    spool.close()
+
+def drain(spool, send, records, **drainer_options):
+    drainer = SpoolDrainer(spool, {"id": "enr-1", "target_url": "http://example.com"}, send, **drainer_options)
+    for record in records:
+        spool.append(json.dumps(record).encode())
+    return drainer
+
+def read_dead_letters(tmp_path):
+    with open(tmp_path / "dead-letter.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+def test_drainer_dead_letters_rejected_records(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    delivered = []
+
+    def fake_send(url, payload, **options):
+        delivered.append(payload)
+        return 404 if payload["k"] == 1 else 200
+
+    drainer = drain(spool, fake_send, [{"k": 1}, {"k": 2}])
+    drainer.policy = ResponsePolicy.from_args({"status": {"4xx": "reject"}})
+    drainer.start()
+    deadline = time.time() + 5
+    while len(delivered) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    drainer.stop()
+    assert delivered == [{"k": 1}, {"k": 2}]
+    assert spool.next_record(timeout=0) is None
+    [dead] = read_dead_letters(tmp_path)
+    assert dead["payload"] == {"k": 1}
+    assert (dead["outcome"], dead["status"], dead["attempts"]) == ("reject", 404, 1)
+    spool.close()
+
+def test_drainer_gives_up_after_max_attempts(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    delivered = []
+
+    def fake_send(url, payload, **options):
+        delivered.append((payload, options.get("timeout")))
+        return 400 if payload["k"] == 1 else 200
+
+    drainer = drain(spool, fake_send, [{"k": 1}, {"k": 2}], max_attempts=2)
+    drainer.timeout = 3
+    drainer.start()
+    deadline = time.time() + 5
+    while len(delivered) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    drainer.stop()
+    assert delivered == [({"k": 1}, 3), ({"k": 1}, 3), ({"k": 2}, 3)]
+    assert spool.next_record(timeout=0) is None
+    [dead] = read_dead_letters(tmp_path)
+    assert (dead["payload"], dead["outcome"], dead["attempts"]) == ({"k": 1}, "retry", 2)
+    spool.close()
+
+def test_record_round_trip():
+    assert decode_record(encode_record({"k": 1})) == ({"k": 1}, {})
+    assert decode_record(json.dumps({"k": 1}).encode()) == ({"k": 1}, {})
+    headers = {"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"}
+    assert decode_record(encode_record({"k": 1}, headers)) == ({"k": 1}, headers)
+
+def test_spooled_message_keeps_trace_context(tmp_path):
+    delivered = []
+
+    def fake_send(url, payload, headers=None):
+        delivered.append((payload, headers))
+        return 200
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"spool": {"path": str(tmp_path), "segment_bytes": 4096}},
+    }
+    traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send)
+    message = DummyMessage('{"k": 1}')
+    message.properties = {"traceparent": traceparent}
+    handler.on_message(DummyEvent(message, DummyDelivery()))
+    deadline = time.time() + 5
+    while not delivered and time.time() < deadline:
+        time.sleep(0.05)
+    handler.close()
+    assert delivered[0][0] == {"k": 1}
+    assert delivered[0][1]["traceparent"].split("-")[1] == traceparent.split("-")[1]
+
+def test_on_message_accepts_once_spooled(tmp_path):
+    def failing_send(url, payload):
+        return 503
+
+    enrollment = {
+        "id": "enr-1",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"spool": {"path": str(tmp_path), "segment_bytes": 4096}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, failing_send)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    handler.close()
+    assert delivery.status == Delivery.ACCEPTED
+    assert delivery.settled
+
+def test_restart_closes_old_spool_before_reopening(tmp_path):
+    def fake_send(url, payload, **options):
+        return 200
+
+    enrollment = {
+        "id": "enr-restart",
+        "target_url": "http://example.com/api",
+        "queue": "chat.test",
+        "subscription_args": {"spool": {"path": str(tmp_path), "segment_bytes": 4096}},
+    }
+    # Nothing listens there: the subscriber keeps trying to connect until it is stopped.
+    amqp_url = "amqp://127.0.0.1:1"
+    old = subscriptions.start_subscriber_for_enrollment(amqp_url, enrollment, fake_send)
+    try:
+        deadline = time.time() + 5
+        while old.handler is None and time.time() < deadline:
+            time.sleep(0.05)
+        old_spool = old.handler.spool
+        changed = dict(enrollment, subscription_args={"spool": {"path": str(tmp_path), "segment_bytes": 8192}})
+        assert not subscriptions.update_subscriber_for_enrollment(amqp_url, changed, fake_send)
+        assert not old.thread.is_alive()
+        assert old_spool.closed
+        assert subscriptions.active_subscribers["enr-restart"] is not old
+    finally:
+        subscriptions.stop_subscriber_for_enrollment("enr-restart", wait=True)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,105 @@
+import pytest
+from aiohttp.test_utils import TestClient
+from proton import Delivery
+
+from src.enroll.enroll import create_app
+from src.consumerMQ.subscriber import SubscriberHandler, SubscriberRunner
+from src.consumerMQ.subscriptions import active_subscribers
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    MODIFIED = Delivery.MODIFIED
+
+    def __init__(self):
+        self.status = None
+        self.settled = False
+        self.local = type("LocalState", (), {"type": None})()
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyReceiver:
+    def __init__(self):
+        self.credit = 0
+
+    def flow(self, n):
+        self.credit += n
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def make_handler(statuses):
+    enrollment = {"id": "enr-state", "target_url": "http://example.com/api", "queue": "chat.test"}
+    handler = SubscriberHandler(sibimq_url, enrollment, lambda url, payload: statuses.pop(0))
+    handler.receiver = DummyReceiver()
+    handler._replenish_credit()
+    return handler
+
+def test_state_tracks_credit_and_outcomes():
+    handler = make_handler([200, 500])
+    assert handler.state.credit == 10
+    for _ in range(2):
+        handler.receiver.credit -= 1
+        handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), DummyDelivery()))
+    snapshot = handler.state.snapshot()
+    assert snapshot["received"] == 2
+    assert snapshot["accepted"] == 1
+    assert snapshot["modified"] == 1
+    assert snapshot["unsettled"] == 0
+    assert snapshot["credit"] == 10
+    assert snapshot["last_message_at"] is not None
+    handler.close()
+
+def test_state_counts_unsettled_while_dispatched():
+    pending = []
+    enrollment = {"id": "enr-state", "target_url": "http://example.com/api", "queue": "chat.test",
+                  "subscription_args": {"ordering": {"max_workers": 1}}}
+    handler = SubscriberHandler(sibimq_url, enrollment, lambda url, payload: 200)
+    handler.dispatcher.submit = lambda key, task: pending.append(task) or True
+    handler.receiver = DummyReceiver()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), DummyDelivery()))
+    assert handler.state.unsettled == 1
+    pending.pop()()
+    assert handler.state.unsettled == 0
+    assert handler.state.accepted == 1
+    handler.close()
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_subscribers_endpoints(client):
+    runner = SubscriberRunner(sibimq_url, {"id": "enr-debug", "target_url": "http://x", "queue": "q"},
+                              lambda url, payload: 200)
+    active_subscribers["enr-debug"] = runner
+    try:
+        resp = await client.get("/debug/subscribers")
+        assert resp.status == 200
+        data = await resp.json()
+        assert data["enr-debug"]["phase"] == "created"
+        assert data["enr-debug"]["thread_alive"] is False
+
+        resp = await client.get("/debug/subscribers/enr-debug")
+        assert resp.status == 200
+        assert (await resp.json())["queue"] == "q"
+
+        resp = await client.get("/debug/subscribers/missing")
+        assert resp.status == 404
+    finally:
+        active_subscribers.pop("enr-debug", None)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,42 @@
+import pytest
+from src.database.database import DatabaseManager
+from src.database.store import EnrollmentStore
+
+@pytest.fixture
+def store(tmp_path):
+    manager = DatabaseManager(backup_path=str(tmp_path / "hotpotato.sqlite"))
+    yield EnrollmentStore(manager)
+    manager.close()
+
+@pytest.mark.asyncio
+async def test_store_round_trip(store):
+    await store.create("id-1", "chat.test", "http://example.com", {"durable": True})
+    enrollment = await store.get("id-1")
+    assert (enrollment["queue"], enrollment["target_url"], enrollment["subscription_args"]) == (
+        "chat.test", "http://example.com", {"durable": True})
+    assert [e["id"] for e in await store.list()] == ["id-1"]
+    await store.update("id-1", "chat.other", "http://example.com/v2", {})
+    enrollment = await store.get("id-1")
+    assert (enrollment["queue"], enrollment["target_url"], enrollment["subscription_args"]) == (
+        "chat.other", "http://example.com/v2", {})
+    await store.delete("id-1")
+    assert await store.get("id-1") is None
+    assert await store.list() == []
+
+def test_backup_snapshot_restores(tmp_path):
+    path = str(tmp_path / "hotpotato.sqlite")
+    manager = DatabaseManager(backup_path=path)
+    manager.execute(
+        "INSERT INTO enrollments (id, queue, target_url, subscription_args) VALUES (?, ?, ?, ?)",
+        ("id-1", "chat.test", "http://example.com", "{}")
+    )
+    manager.backup_to_disk()
+    manager.close()
+
+    restored = DatabaseManager(backup_path=path)
+    assert [row["id"] for row in restored.query("SELECT * FROM enrollments")] == ["id-1"]
+    restored.close()
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,196 @@
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient
+from proton import Delivery
+
+from src.enroll.enroll import create_app, validate_subscription_args
+from src.enroll.stream import _pump
+from src.consumerMQ.streaming import StreamChannel, stream_channels
+from src.consumerMQ.subscriber import SubscriberHandler
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+class DummyDelivery:
+    MODIFIED = Delivery.MODIFIED
+
+    def __init__(self):
+        self.status = None
+        self.settled = False
+        self.local = type("LocalState", (), {"type": None})()
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        self.settled = True
+
+class DummyReceiver:
+    def __init__(self):
+        self.credit = 0
+
+    def flow(self, n):
+        self.credit += n
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+class ImmediateLoop:
+    def call_soon_threadsafe(self, fn, *args):
+        fn(*args)
+
+class Outbox(list):
+    def put_nowait(self, frame):
+        self.append(frame)
+
+def make_stream_handler():
+    enrollment = {
+        "id": "enr-stream",
+        "target_url": "http://unused",
+        "queue": "chat.test",
+        "subscription_args": {"delivery": "websocket", "stream": {"max_window": 5}},
+    }
+    handler = SubscriberHandler(sibimq_url, enrollment, lambda url, payload: 500)
+    handler.receiver = DummyReceiver()
+    handler.stream.bind(handler._notify)
+    return handler
+
+def test_message_released_without_consumer():
+    handler = make_stream_handler()
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    assert delivery.status == Delivery.RELEASED
+
+def test_window_ack_and_nack_map_to_credit_and_dispositions():
+    handler = make_stream_handler()
+    outbox = Outbox()
+    assert handler.stream.attach(ImmediateLoop(), outbox)
+
+    handler.stream.on_client_frame({"type": "window", "credit": 10})
+    assert handler.receiver.credit == 5  # capped by max_window
+
+    first, second = DummyDelivery(), DummyDelivery()
+    handler.receiver.credit -= 2
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), first))
+    handler.on_message(DummyEvent(DummyMessage('{"k": 2}'), second))
+    assert outbox == [
+        {"type": "message", "seq": 1, "payload": {"k": 1}},
+        {"type": "message", "seq": 2, "payload": {"k": 2}},
+    ]
+
+    handler.stream.on_client_frame({"type": "ack", "seq": 1})
+    assert first.status == Delivery.ACCEPTED
+    handler.stream.on_client_frame({"type": "nack", "seq": 2, "requeue": False})
+    assert second.status == Delivery.REJECTED
+
+def test_detach_returns_unacked_messages():
+    handler = make_stream_handler()
+    handler.stream.attach(ImmediateLoop(), Outbox())
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}'), delivery))
+    handler.stream.detach()
+    assert delivery.status == Delivery.MODIFIED
+    assert delivery.settled
+
+def test_detach_resets_requested_credit():
+    handler = make_stream_handler()
+    handler.stream.attach(ImmediateLoop(), Outbox())
+    handler.stream.on_client_frame({"type": "window", "credit": 5})
+    handler.receiver.credit = 5  # link credit is at the window, so some of the request is still owed
+    handler.stream.on_client_frame({"type": "window", "credit": 3})
+    assert handler.stream_credit_wanted == 3
+    handler.stream.detach()
+    assert handler.stream_credit_wanted == 0
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+def test_pump_survives_frames_that_are_not_json():
+    events = []
+    channel = StreamChannel("enr-pump")
+    channel.bind(lambda name, subject: events.append((name, subject)))
+    circular = {}
+    circular["self"] = circular
+
+    async def run():
+        ws = FakeWebSocket()
+        outbox = asyncio.Queue()
+        outbox.put_nowait({"type": "message", "seq": 1, "payload": b"\x00binary"})
+        outbox.put_nowait({"type": "message", "seq": 2, "payload": circular})
+        outbox.put_nowait({"type": "message", "seq": 3, "payload": {"k": 1}})
+        pump = asyncio.create_task(_pump(ws, outbox, channel))
+        while len(ws.sent) < 2:
+            await asyncio.sleep(0.01)
+        pump.cancel()
+        return ws.sent
+
+    sent = asyncio.run(run())
+    assert '"seq": 1' in sent[0] and '"seq": 3' in sent[1]
+    assert events == [("stream_settle", (2, "reject"))]
+
+def test_malformed_frames_are_refused():
+    channel = StreamChannel("enr-x")
+    channel.bind(lambda name, subject: None)
+    with pytest.raises(ValueError):
+        channel.on_client_frame({"type": "window", "credit": 0})
+    with pytest.raises(ValueError):
+        channel.on_client_frame({"type": "bogus"})
+
+def test_stream_args_are_validated_at_enroll():
+    assert StreamChannel.validate_args({}) is None
+    assert StreamChannel.validate_args({"delivery": "http"}) is None
+    assert StreamChannel.validate_args({"delivery": "websocket", "stream": {"max_window": 50}}) == 50
+    for args in ({"delivery": "carrier-pigeon"},
+                 {"delivery": "websocket", "stream": {"max_window": "x"}},
+                 {"delivery": "websocket", "stream": {"max_window": 0}},
+                 {"delivery": "websocket", "stream": 5}):
+        assert validate_subscription_args(args).startswith("Invalid delivery")
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_websocket_endpoint_bridges_frames(client):
+    events = []
+    channel = StreamChannel("enr-ws")
+    channel.bind(lambda name, subject: events.append((name, subject)))
+    stream_channels["enr-ws"] = channel
+    try:
+        ws = await client.ws_connect("/stream/enr-ws")
+        await ws.send_json({"type": "window", "credit": 3})
+        channel.push({"type": "message", "seq": 1, "payload": {"k": 1}})
+        frame = await asyncio.wait_for(ws.receive_json(), timeout=5)
+        assert frame == {"type": "message", "seq": 1, "payload": {"k": 1}}
+        await ws.send_json({"type": "ack", "seq": 1})
+        await ws.close()
+        for _ in range(50):
+            if events and events[-1][0] == "stream_detached":
+                break
+            await asyncio.sleep(0.01)
+        assert events == [
+            ("stream_credit", 3),
+            ("stream_settle", (1, "accept")),
+            ("stream_detached", None),
+        ]
+    finally:
+        stream_channels.pop("enr-ws", None)
+
+@pytest.mark.asyncio
+async def test_websocket_unknown_enrollment(client):
+    resp = await client.get("/stream/missing")
+    assert resp.status == 404
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -1,6 +1,8 @@
 import json
 import pytest
-from src.consumerMQ.subscriber import SubscriberHandler
+from proton.reactor import EventInjector
+from src.consumerMQ.subscriber import SubscriberHandler, SubscriberRunner, requires_restart
+from src.enroll.enroll import validate_subscription_args
 
 sibimq_url = "amqp://192.168.15.22:5672"
 # Dummy classes to simulate Proton event, message, and delivery objects.
@@ -70,6 +72,162 @@ def test_on_message_invalid_json():
     # With fake_send_message_success, a 200 is returned even with invalid JSON.
     assert delivery.status == DummyDelivery.ACCEPTED
 
+class DummyReceiver:
+    def __init__(self, address, options):
+        self.address = address
+        self.options = options
+        self.credit = 0
+        self.closed = False
+
+    def flow(self, n):
+        self.credit += n
+
+    def close(self):
+        self.closed = True
+
+class DummyContainer:
+    def create_receiver(self, connection, address, options=None):
+        return DummyReceiver(address, options)
+
+def make_running_handler(enrollment, callback):
+    handler = SubscriberHandler(sibimq_url, enrollment, callback)
+    handler.container = DummyContainer()
+    handler._attach_receiver()
+    return handler
+
+def test_requires_restart():
+    base = {"id": "x", "queue": "q", "target_url": "http://a", "subscription_args": {"timeout": 5}}
+    assert not requires_restart(base, dict(base, target_url="http://b"))
+    assert not requires_restart(base, dict(base, subscription_args={"timeout": 10, "prefetch": 50}))
+    assert not requires_restart(base, dict(base, queue="other"))
+    assert requires_restart(base, dict(base, subscription_args={"dedupe": True}))
+    assert requires_restart(base, dict(base, subscription_args={"ordering": {"max_workers": 2}}))
+
+@pytest.mark.parametrize("args", [
+    {"timeout": -5},
+    {"timeout": 0},
+    {"timeout": "10"},
+    {"timeout": float("inf")},
+    {"selector": 5},
+])
+def test_bad_timeout_and_selector_are_refused(args):
+    assert validate_subscription_args(args).startswith("Invalid subscription_args")
+
+def test_bad_update_leaves_settings_untouched():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test",
+                  "subscription_args": {"timeout": 5}}
+    handler = make_running_handler(enrollment, fake_send_message_success)
+    handler.update_enrollment(dict(enrollment, target_url="http://b",
+                                   subscription_args={"timeout": 10, "prefetch": "x"}))
+    assert handler.timeout == 5
+    assert handler.prefetch == 10
+    assert handler.enrollment["target_url"] == "http://a"
+
+def test_update_enrollment_swaps_target_in_place():
+    calls = []
+
+    def fake_send(url, payload, **options):
+        calls.append((url, options))
+        return 200
+
+    enrollment = {"id": "enr-1", "target_url": "http://old", "queue": "chat.test", "subscription_args": {}}
+    handler = make_running_handler(enrollment, fake_send)
+    receiver = handler.receiver
+    assert receiver.credit == 10
+
+    handler.update_enrollment(dict(enrollment, target_url="http://new",
+                                   subscription_args={"timeout": 7, "prefetch": 20}))
+    assert handler.receiver is receiver and not receiver.closed
+    assert receiver.credit == 20
+    handler._deliver({"k": 1})
+    assert calls == [("http://new", {"timeout": 7})]
+
+def test_update_enrollment_reattaches_on_queue_or_selector_change():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test", "subscription_args": {}}
+    handler = make_running_handler(enrollment, fake_send_message_success)
+    old_receiver = handler.receiver
+    handler.update_enrollment(dict(enrollment, subscription_args={"selector": "region = 'eu'"}))
+    assert old_receiver.closed
+    assert handler.receiver is not old_receiver
+    assert handler.receiver.options is not None
+
+    second_receiver = handler.receiver
+    handler.update_enrollment(dict(enrollment, queue="chat.other",
+                                   subscription_args={"selector": "region = 'eu'"}))
+    assert second_receiver.closed
+    assert handler.receiver.address == "chat.other"
+
+def test_runner_update_refuses_mode_changes():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test", "subscription_args": {}}
+    runner = SubscriberRunner(sibimq_url, enrollment, fake_send_message_success)
+    assert runner.update(dict(enrollment, target_url="http://b"))
+    assert runner.enrollment["target_url"] == "http://b"
+    assert not runner.update(dict(enrollment, subscription_args={"spool": True}))
+
+def test_runner_stopped_right_after_start_finishes():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test", "subscription_args": {}}
+    runner = SubscriberRunner("amqp://127.0.0.1:1", enrollment, fake_send_message_success)
+    runner.start()
+    runner.stop()
+    assert runner.join(timeout=5)
+
+class Closable:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class DummyTask:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class StoppableContainer(DummyContainer):
+    def __init__(self):
+        self.stopped = False
+        self.tasks = []
+
+    def schedule(self, delay, task):
+        self.tasks.append(task)
+        return DummyTask()
+
+    def stop(self):
+        self.stopped = True
+
+def test_stop_closes_connection_before_stopping_container():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test", "subscription_args": {}}
+    handler = make_running_handler(enrollment, fake_send_message_success)
+    container = handler.container = StoppableContainer()
+    handler.connection = Closable()
+    handler.injector = Closable()
+    handler.on_stop_requested(None)
+    assert handler.connection.closed and handler.injector.closed
+    assert not container.stopped  # waits for the broker to confirm the close
+
+    grace_task = handler.stop_task
+    handler.on_connection_closed(type("Event", (), {"container": container})())
+    assert container.stopped
+    assert grace_task.cancelled and handler.stop_task is None
+
+def test_notifications_are_dropped_once_stopping():
+    enrollment = {"id": "enr-1", "target_url": "http://a", "queue": "chat.test", "subscription_args": {}}
+    handler = SubscriberHandler(sibimq_url, enrollment, fake_send_message_success)
+    injector = handler.injector = EventInjector()
+    handler.request_stop()
+    assert injector.queue.qsize() == 1  # stop_requested
+
+    delivery = DummyDelivery()
+    handler._complete(delivery, 200, None, None)  # a worker finishing late
+    assert injector.queue.qsize() == 1
+    handler.close()
+    assert handler.injector is None
+
+    handler._complete(delivery, 200, None, None)  # not run inline after the container stopped
+    assert delivery.status is None
+
 if __name__ == '__main__':
     import sys
     sys.exit(pytest.main([__file__]))
@@ -0,0 +1,108 @@
+import pytest
+from aiohttp.test_utils import TestClient
+from proton import Delivery
+
+from src.enroll.enroll import create_app
+from src.consumerMQ.subscriber import SubscriberHandler
+from src.consumerMQ.tracing import (MessageTrace, TraceExporter, trace_exporter,
+                                    sample_rate_from_args, propagation_headers)
+
+sibimq_url = "amqp://192.168.15.22:5672"
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+class DummyDelivery:
+    MODIFIED = Delivery.MODIFIED
+
+    def __init__(self):
+        self.status = None
+        self.local = type("LocalState", (), {"type": None})()
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        pass
+
+class DummyMessage:
+    def __init__(self, body, properties=None):
+        self.body = body
+        self.properties = properties
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+def test_sample_rate_from_args():
+    assert sample_rate_from_args(True) == 1.0
+    assert sample_rate_from_args(False) == 0.0
+    assert sample_rate_from_args({"sample_rate": 0.25}) == 0.25
+    with pytest.raises(ValueError):
+        sample_rate_from_args({"sample_rate": 2})
+
+def test_context_is_propagated_without_sampling():
+    message = DummyMessage("{}", {"traceparent": TRACEPARENT, "tracestate": "k=v"})
+    assert propagation_headers(message) == {"traceparent": TRACEPARENT, "tracestate": "k=v"}
+    assert propagation_headers(DummyMessage("{}", {"traceparent": "garbage"})) == {}
+
+def test_sampled_trace_continues_incoming_context():
+    trace = MessageTrace("enr-1", DummyMessage("{}", {"traceparent": TRACEPARENT}))
+    assert trace.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert trace.parent_id == "00f067aa0ba902b7"
+    headers = trace.headers()
+    assert headers["traceparent"].startswith("00-4bf92f3577b34da6a3ce929d0e0e4736-")
+    assert trace.span_id in headers["traceparent"]
+
+def test_exporter_ring_buffer_and_filters():
+    exporter = TraceExporter(buffer_size=2)
+    for i, duration in enumerate([5.0, 50.0, 500.0]):
+        exporter.export({"enrollment_id": f"enr-{i % 2}", "duration_ms": duration})
+    assert [r["duration_ms"] for r in exporter.recent()] == [500.0, 50.0]
+    assert [r["duration_ms"] for r in exporter.recent(min_ms=100)] == [500.0]
+    assert [r["duration_ms"] for r in exporter.recent(enrollment_id="enr-1")] == [50.0]
+
+def test_on_message_records_spans_and_forwards_headers():
+    sent = {}
+
+    def send(url, payload, headers=None, trace=None):
+        sent["headers"] = headers
+        trace.span("http").end(status=200)
+        return 200
+
+    enrollment = {"id": "enr-trace", "target_url": "http://example.com/api", "queue": "chat.test",
+                  "subscription_args": {"trace": True}}
+    handler = SubscriberHandler(sibimq_url, enrollment, send)
+    delivery = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"k": 1}', {"traceparent": TRACEPARENT}), delivery))
+    assert delivery.status == Delivery.ACCEPTED
+    assert sent["headers"]["traceparent"].split("-")[1] == "4bf92f3577b34da6a3ce929d0e0e4736"
+
+    record = trace_exporter.recent(enrollment_id="enr-trace", limit=1)[0]
+    assert record["attributes"]["outcome"] == "accept"
+    assert [span["name"] for span in record["spans"]] == ["parse", "http", "settle"]
+    handler.close()
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_traces_endpoint(client):
+    trace_exporter.export({"enrollment_id": "enr-endpoint", "duration_ms": 1.0})
+    resp = await client.get("/debug/traces?enrollment_id=enr-endpoint")
+    assert resp.status == 200
+    assert (await resp.json())[0]["enrollment_id"] == "enr-endpoint"
+
+    resp = await client.get("/debug/traces?limit=x")
+    assert resp.status == 400
+
+@pytest.mark.asyncio
+async def test_enroll_rejects_invalid_trace(client):
+    resp = await client.post("/enroll", json={"queue": "q", "target_url": "http://x",
+                                              "subscription_args": {"trace": {"sample_rate": 5}}})
+    assert resp.status == 400
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
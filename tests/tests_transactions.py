@@ -0,0 +1,88 @@
+import pytest
+from src.consumerMQ.transactions import TransactionBatcher
+
+class DummyDelivery:
+    def __init__(self):
+        self.settled = False
+
+    def settle(self):
+        self.settled = True
+
+class DummyTransaction:
+    def __init__(self):
+        self.accepted = []
+        self.committed = False
+
+    def accept(self, delivery):
+        self.accepted.append(delivery)
+
+    def commit(self):
+        self.committed = True
+
+class DummyContainer:
+    def __init__(self):
+        self.declared = 0
+        self.scheduled = []
+
+    def declare_transaction(self, connection, handler=None):
+        self.declared += 1
+
+    def schedule(self, delay, handler):
+        self.scheduled.append((delay, handler))
+
+def make_batcher(**kwargs):
+    batcher = TransactionBatcher("enr-1", **kwargs)
+    container = DummyContainer()
+    batcher.attach(container, object(), handler=None)
+    return batcher, container
+
+def test_accept_without_declared_transaction_falls_back():
+    batcher, container = make_batcher()
+    assert container.declared == 1
+    assert not batcher.accept(DummyDelivery())
+
+def test_commits_when_batch_is_full():
+    batcher, container = make_batcher(batch_size=2)
+    transaction = DummyTransaction()
+    batcher.on_declared(transaction)
+    deliveries = [DummyDelivery(), DummyDelivery()]
+    assert batcher.accept(deliveries[0])
+    assert not transaction.committed
+    assert batcher.accept(deliveries[1])
+    assert transaction.committed
+    assert container.declared == 2  # next transaction declared right away
+    assert not any(d.settled for d in deliveries)
+
+    batcher.on_committed(transaction)
+    assert all(d.settled for d in deliveries)
+
+def test_commits_when_time_window_elapses():
+    batcher, container = make_batcher(batch_size=100, batch_ms=50)
+    transaction = DummyTransaction()
+    batcher.on_declared(transaction)
+    batcher.accept(DummyDelivery())
+    batcher.accept(DummyDelivery())
+    assert len(container.scheduled) == 1
+    delay, timer = container.scheduled[0]
+    assert delay == pytest.approx(0.05)
+    timer.on_timer_task(None)
+    assert transaction.committed
+
+def test_failed_commit_drops_batch_without_settling():
+    batcher, _ = make_batcher(batch_size=1)
+    transaction = DummyTransaction()
+    batcher.on_declared(transaction)
+    delivery = DummyDelivery()
+    batcher.accept(delivery)
+    batcher.on_failed(transaction)
+    assert not delivery.settled
+    assert transaction not in batcher.batches
+
+def test_from_args():
+    assert TransactionBatcher.from_args("enr-1", None) is None
+    batcher = TransactionBatcher.from_args("enr-1", {"batch_size": 10, "batch_ms": 5})
+    assert (batcher.batch_size, batcher.batch_ms) == (10, 5)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,114 @@
+import pytest
+from aiohttp.test_utils import TestClient
+from proton import Delivery
+
+from src.enroll.enroll import create_app, validate_subscription_args
+from src.consumerMQ.subscriber import SubscriberHandler
+from src.consumerMQ.transform import compile_transform
+
+sibimq_url = "amqp://192.168.15.22:5672"
+
+ORDER = {"status": "paid", "total": 120.5, "tags": ["eu", "vip"],
+         "order": {"id": 7, "lines": 3}, "customer": {"name": "Ana", "email": "a@x"}}
+
+class DummyDelivery:
+    def __init__(self):
+        self.status = None
+
+    def update(self, status):
+        self.status = status
+
+    def settle(self):
+        pass
+
+class DummyMessage:
+    def __init__(self, body):
+        self.body = body
+
+class DummyEvent:
+    def __init__(self, message, delivery):
+        self.message = message
+        self.delivery = delivery
+
+@pytest.mark.parametrize("where, expected", [
+    ("status == 'paid'", True),
+    ("status == \"paid\" and total >= 100", True),
+    ("total > 200 or order.lines < 5", True),
+    ("not (status == 'paid')", False),
+    ("'vip' in tags", True),
+    ("status in ['refunded', 'void']", False),
+    ("exists customer.email and not exists customer.phone", True),
+    ("missing.field == null", False),
+    ("status > 10", False),
+    ("order.id", True),
+    ("order.missing", False),
+])
+def test_predicates(where, expected):
+    assert compile_transform({"where": where}).matches(ORDER) is expected
+
+@pytest.mark.parametrize("where", ["status ==", "status = 'x'", "(total > 1", "status == 'x' extra", "a @ b"])
+def test_malformed_predicates_are_refused(where):
+    with pytest.raises(ValueError):
+        compile_transform({"where": where})
+
+@pytest.mark.parametrize("where", [r"name == '\N'", r"name == '\x1'", "not " * 1000 + "a", "(" * 1000 + "a" + ")" * 1000,
+                                   "a in " + "[" * 1000 + "]" * 1000])
+def test_bad_escapes_and_deep_nesting_are_refused(where):
+    with pytest.raises(ValueError):
+        compile_transform({"where": where})
+    assert validate_subscription_args({"transform": {"where": where}}).startswith("Invalid transform")
+
+def test_nesting_up_to_the_limit_is_allowed():
+    assert compile_transform({"where": "not " * 32 + "total"}).matches(ORDER)
+    assert compile_transform({"where": "(" * 32 + "total" + ")" * 32}).matches(ORDER)
+
+def test_projection_and_rename():
+    transform = compile_transform({"fields": ["order.id", "customer.name", "nope"],
+                                   "rename": {"order.id": "id"}})
+    assert transform.project(ORDER) == {"id": 7, "customer": {"name": "Ana"}}
+
+def test_rename_only_keeps_other_fields_and_source():
+    transform = compile_transform({"rename": {"customer.email": "email"}})
+    result = transform.project(ORDER)
+    assert result["email"] == "a@x"
+    assert result["customer"] == {"name": "Ana"}
+    assert ORDER["customer"]["email"] == "a@x"
+
+def test_compiled_transforms_are_cached():
+    spec = {"where": "total > 1", "fields": ["total"]}
+    assert compile_transform(spec) is compile_transform(dict(reversed(list(spec.items()))))
+    assert compile_transform(None) is None
+
+def test_on_message_filters_and_projects():
+    sent = []
+    enrollment = {"id": "enr-transform", "target_url": "http://example.com/api", "queue": "chat.test",
+                  "subscription_args": {"transform": {"where": "status == 'paid'", "fields": ["order.id"]}}}
+    handler = SubscriberHandler(sibimq_url, enrollment, lambda url, payload: sent.append(payload) or 200)
+
+    skipped = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"status": "new", "order": {"id": 1}}'), skipped))
+    assert skipped.status == Delivery.ACCEPTED
+    assert sent == []
+    assert handler.state.filtered == 1
+
+    delivered = DummyDelivery()
+    handler.on_message(DummyEvent(DummyMessage('{"status": "paid", "order": {"id": 2}}'), delivered))
+    assert delivered.status == Delivery.ACCEPTED
+    assert sent == [{"order": {"id": 2}}]
+    handler.close()
+
+@pytest.fixture
+def client(aiohttp_client, event_loop) -> TestClient:
+    app = create_app()
+    return event_loop.run_until_complete(aiohttp_client(app))
+
+@pytest.mark.asyncio
+async def test_enroll_rejects_invalid_transform(client):
+    resp = await client.post("/enroll", json={"queue": "q", "target_url": "http://x",
+                                              "subscription_args": {"transform": {"where": "a =="}}})
+    assert resp.status == 400
+    assert "Invalid transform" in (await resp.json())["error"]
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(pytest.main([__file__]))